@@ -1,14 +1,27 @@
 import numpy as np
 import pandas as pd
-import xpress as xp
-import platform
 from helper_funcs import *
 from clusteringdemand import calcClusters
+from cost_matrices import get_cost_matrices
+from model_builder import make_instance, build_mecwlp
+from solver_backends import make_backend, INFEASIBLE
+from pruning import grid_coords, solve_with_pruning, cheapest_supplier_mask
+from scenario_reduction import reduce_scenarios
+from benders import solve_benders, with_integer_flows
+from progressive_hedging import solve_progressive_hedging
+from warm_start import heuristic_start
+from instrumentation import Profiler
 from time import perf_counter
 
+# time and memory of every stage (see instrumentation.py), the table is printed after the solve and
+# the trace can be opened in chrome://tracing or ui.perfetto.dev. Tracing memory slows things down
+TRACE_MEMORY = False
+TRACE_FILE = "stochastic trace.json"
+prof = Profiler(trace_memory=TRACE_MEMORY).activate()
+
 (
     PostcodeDistricts_df, Candidates_df, Suppliers_df,
-    Demand_df, DemandPeriods_df, DemandPeriodsScenarios_df,
+    Demand_df, data,
     Operating_costs_df, DistanceSupplierDistrict_df, DistanceDistrictDistrict_df,
     nbPeriods, nbScenarios
 ) = get_all_data("CaseStudyDataPY")
@@ -24,18 +37,28 @@ from time import perf_counter
 
 ########## this is where it gets  confusing
 #cluster the warehouse locations 
-_, reduced_Candidates_df, _, _, _,_  = calcClusters(Demand_df, Candidates_df,DemandPeriodsScenarios_df, num_clusters=30)
+_, reduced_Candidates_df, _, _  = calcClusters(Demand_df, Candidates_df, data, num_clusters=30)
 Candidates = reduced_Candidates_df.index
 
 #cluster the customer locations and take the aggregated demand
-_, reduced_Customers_df, _, _, DemandPeriodsScenarios, avg_DemandPeriodsScenarios  = calcClusters(Demand_df, Candidates_df,DemandPeriodsScenarios_df, num_clusters=30)
+# cluster_data has the customer x product x period x scenario demand of each cluster, the n'th cluster goes to Customers[n]
+all_Customers_df, reduced_Customers_df, _, cluster_data  = calcClusters(Demand_df, Candidates_df, data, num_clusters=30)
 Customers = reduced_Customers_df.index
 
+DemandPeriodsScenarios = cluster_data.demand_scenarios
+
 
 Suppliers = Suppliers_df.index
 
 Times = range(1, nbPeriods + 1)
+
+# customer x product x period x scenario demand of the customers in the model, every scenario
+DemandCustomers = DemandPeriodsScenarios[cluster_data.customer_positions(Customers)]
+
+# rather than just taking the first few scenarios, pick the nbScenarios that best represent all
+# of them and give each the probability of the scenarios nearest to it (see scenario_reduction.py)
 nbScenarios = 5
+keep, ScenarioProbs = reduce_scenarios(DemandCustomers, nbScenarios, method="fast_forward")
 nbCustomers = len(Customers)
 nbSuppliers = len(Suppliers)
 nbCandidates = len(Candidates)
@@ -43,7 +66,7 @@ print(f"{nbCustomers=:,}\t{nbCandidates=:,}\t{nbSuppliers=:,}\t{nbScenarios=:,}"
 
 
 
-Scenarios = range(1, nbScenarios + 1)
+Scenarios = cluster_data.scenarios[keep]
 Products = (1,2,3,4) #hardcoding
 final_t = max(Times)
 
@@ -87,207 +110,131 @@ VehicleCostPerMileAndTonneOverall = {
 # Round-trip distance (factor 2)
 # Cost depends on supplier vehicle type
 # Division by 1000 converts from kg to tonnes
-CostSupplierCandidate = {
-    (k, j): 2
-    * DistanceSupplierDistrict_df.loc[k, j]
-    * VehicleCostPerMileAndTonneOverall[
-        Suppliers_df.loc[k, "Vehicle type"]
-    ]
-    / 1000
-    for j in Candidates
-    for k in Suppliers
-}
-
 # Cost from candidate facilities to customers
 # All transports use 3.5t vans (vehicle type 3)
-CostCandidateCustomers = {
-    (j, i): 2
-    * DistanceDistrictDistrict_df.loc[j, i]
-    * VehicleCostPerMileAndTonneOverall[3]
-    / 1000
-    for j in Candidates
-    for i in Customers
-}
+CostSupplierCandidate, CostCandidateCustomers = get_cost_matrices(
+    DistanceSupplierDistrict_df, DistanceDistrictDistrict_df, Suppliers_df,
+    VehicleCostPerMileAndTonneOverall,
+    suppliers=Suppliers, candidates=Candidates, customers=Customers
+)
 
 
 # =============================================================================
 # Build optimization model
 # =============================================================================
 
-if platform.system()== "Windows":
-    xp.init('c:/xpressmp/bin/xpauth.xpr')
-else:
-    print("lmk if that annoying message is coming up")
-prob = xp.problem("Assignment 1")
-
-######## Decision variables 
-
-x = {
-    (i,j,t,p, s): prob.addVariable(name=f"X__C{i}_W{j}_T{t}_P{p}_S{s}", vartype=xp.binary)
-    for i in Customers for j in Candidates for t in Times for p in Products for s in Scenarios
-}
-
-y = {
-    (j,t): prob.addVariable(name=f"Y__W{j}_T{t}", vartype = xp.binary)
-    for j in Candidates for t in Times
-}
-
-z = {
-    (k,j,t,p, s): prob.addVariable(name=f"Z__S{k}_W{j}_T{t}_P{p}_S{s}", ub=1) #idk if this helps the solver
-    for k in Suppliers for j in Candidates for t in Times for p in Products for s in Scenarios
-}
-
-########### Constraints
-# we can only supply from a warehouse if it is built
-prob.addConstraint(
-    x[i,j,t,p, s] <= y[j,t]
-    for i in Customers for j in Candidates for t in Times for p in Products for s in Scenarios
+# "xpress" or "highs", highs has no licence so no size limit
+SOLVER = "xpress"
+backend = make_backend(
+    SOLVER,
+    time_limit=20*60,   # stops after 20 mins
+    rel_gap=.05,        # stop once the mip gap is below 5%
 )
-#if we build a warehouse it stays open 
-prob.addConstraint(
-    y[j,t] <= y[j,t+1]
-    for j in Candidates for t in Times if t != max(Times)
-)
-
-
 
-
-# We must meet all customer demands, each year
-prob.addConstraint(
-    xp.Sum(
-        x[i,j,t,p, s]
-        for j in Candidates
-    )
-    == 1
-    for i in Customers for p in Products for t in Times for s in Scenarios
+# the whole model is built as arrays and loaded in one go, see model_builder.py for the formulation:
+#   x[i,j,t,p,s] binary, customer i gets product p from warehouse j
+#   y[j,t] binary, warehouse j is open (and stays open)
+#   z[k,j,t,p,s] in [0,1], share of supplier k's stock sent to warehouse j, only for the product k carries
+# stock into a warehouse has to be exactly 80% of what goes out to customers
+# and we only supply to open warehouses - this helps to do 30,30 10scen in 10 mins
+instance = make_instance(
+    Candidates, Customers, Suppliers, Products, Times, Scenarios,
+    DemandCustomers[..., keep],
+    CostSupplierCandidate, CostCandidateCustomers,
+    Candidates_df, Suppliers_df, Operating_costs_df,
+    scenario_probs=ScenarioProbs,
 )
 
-# the z decision variables are percentages of supplier k's total stock of p sent to warehouse j at time t 
-# constrain them less than one and summing less than one
-# and force them to zero if the supplier doesnt supply that product
-prob.addConstraint(
-    z[k,j,t,p, s] <= int( p == Suppliers_df["Product group"][k] )
-    for k in Suppliers for j in Candidates for p in Products for t in Times for s in Scenarios
-)
-# we can supply out 100% of stock at most
-prob.addConstraint(
-    xp.Sum(
-        z[k,j,t,p, s]
-        for j in Candidates
+# only let each warehouse get each product from its nearest_suppliers cheapest suppliers
+# (plus more if they wouldn't have enough stock between them), None keeps every supplier
+nearest_suppliers = None
+supply_mask = None
+if nearest_suppliers is not None:
+    supply_mask = cheapest_supplier_mask(instance, n=nearest_suppliers, stock_ratio=.8)
+
+def build_and_solve(assign_mask):
+    build_start = perf_counter()
+    model = build_mecwlp(instance, stock_ratio=.8, exact_stock=True, supply_only_open=True,
+                         assign_mask=assign_mask, supply_mask=supply_mask, name="Assignment 1")
+
+    print(f"building took {perf_counter()-build_start:.2f}secs")
+
+    # start from a greedy/drop plan so there's an incumbent from the start (see warm_start.py)
+    start_sol, start_obj = heuristic_start(model, backend)
+
+    print(f"Solving a problem with {model.matrix.size()} using {SOLVER}")
+    result = backend.solve(model.matrix, mip_start=start_sol)
+    print(f"took {pretty_print_seconds(result.solve_time)} for a problem with {model.matrix.size()}")
+
+    return (model, result), result.status == INFEASIBLE
+
+# "extensive" puts every scenario into one MIP, "benders" keeps the warehouse plan in a master
+# problem and solves each scenario's flows as a separate LP (see benders.py), "ph" solves every
+# scenario as its own MIP and nudges their plans together (see progressive_hedging.py)
+METHOD = "extensive"
+# benders and ph can solve the scenarios in this many processes at once, None solves them one by one.
+# (on windows that needs everything below the imports inside if __name__ == "__main__":)
+WORKERS = None
+
+# only let each customer be served from its nearest_k closest candidates, None keeps every pair
+# if that turns out infeasible nearest_k is doubled until it isn't
+nearest_k = None
+if METHOD == "benders":
+    plan = solve_benders(
+        instance, backend, time_limit=20*60, workers=WORKERS,
+        stock_ratio=.8, exact_stock=True, supply_only_open=True, supply_mask=supply_mask
     )
-    <= 1
-    for k in Suppliers for p in Products for t in Times for s in Scenarios
-)
-# we only supply to open warehouses - this helps to do 30,30 10scen in 10 mins
-prob.addConstraint(
-    z[k,j,t,p,s] <= y[j,t]
-    for t in Times for k in Suppliers for j in Candidates for p in Products for s in Scenarios
-)
-
-######link warehouse stock supplier
-# a warehouse can deliver no more than what it has in stock
-# assuming no stock gets carried over into the next year because fuck that its too complicated
-#Double check where the for s goes #ND looks good
-prob.addConstraint(
-    xp.Sum(
-        Suppliers_df["Capacity"][k] * z[k,j,t,p, s]        #Into warehouse from suppliers
-        for k in Suppliers for p in Products
+    # benders costs its plans with LP flows but x is binary in the model, so cost the plan again
+    # with integer flows, that's what it really costs (and what the breakdown below is made of)
+    plan = with_integer_flows(
+        plan, backend, workers=WORKERS,
+        stock_ratio=.8, exact_stock=True, supply_only_open=True, supply_mask=supply_mask
     )
-    ==
-    .8*(xp.Sum(
-        DemandPeriodsScenarios[i,p,t,s] * x[i,j,t,p, s]             #Out of warehouse to customers
-        for i in Customers  for p in Products               
-    ) )
-    for j in Candidates for t in Times for s in Scenarios
-)
-
-# a warehouse has a capacity
-prob.addConstraint(
-    xp.Sum(
-        Suppliers_df["Capacity"][k] * z[k,j,t,p, s]        #Into warehouse from suppliers
-        for k in Suppliers for p in Products
-    )
-    <= Candidates_df["Capacity"][j]                     #Warehouse capacity
-    for j in Candidates for t in Times for s in Scenarios
-)
-
-
-######### Objective function
-#minimise costs
-#we know that if we build a warehouse it will be open in year 10
-# so we can use year 10 to calculate fixed costs
-warehouse_setup_costs = xp.Sum(
-    Candidates_df["Setup cost"][j]*y[j,final_t]
-    for j in Candidates
-)
-warehouse_operating_costs = {
-    t: xp.Sum(
-        Operating_costs_df[j]*y[j,t] 
-        for j in Candidates
+elif METHOD == "ph":
+    plan = solve_progressive_hedging(
+        instance, backend, time_limit=20*60, workers=WORKERS,
+        stock_ratio=.8, exact_stock=True, supply_only_open=True, supply_mask=supply_mask
     )
-    for t in Times
-}
-
-
-supplier_to_warehouse_costs = {
-    t: xp.Sum(
-        1/nbScenarios * (
-        CostSupplierCandidate[k,j] * Suppliers_df["Capacity"][k] * z[k,j,t,p,s] ) 
-        for k in Suppliers for j in Candidates for p in Products for s in Scenarios
-    )
-    for t in Times
-}
-
-
-warehouse_to_customer_costs = {
-    t: xp.Sum(
-        1/nbScenarios * (
-        CostCandidateCustomers[j,i] * DemandPeriodsScenarios[i,p,t,s] * x[i,j,t,p,s] ) 
-        for i in Customers for j in Candidates for p in Products for s in Scenarios
-    )
-    for t in Times
-}
-
-prob.setControl('miprelstop', .05) # stop once the mip gap is below 5%
-prob.controls.maxtime = -20*60 # stops after 3 mins
-prob.setObjective(
-    warehouse_setup_costs + xp.Sum(
-    warehouse_operating_costs[t] + supplier_to_warehouse_costs[t] + warehouse_to_customer_costs[t]
-    for t in Times
+elif nearest_k is None:
+    (model, result), _ = build_and_solve(None)
+else:
+    (model, result), _ = solve_with_pruning(
+        build_and_solve,
+        grid_coords(PostcodeDistricts_df, Customers), grid_coords(Candidates_df, Candidates),
+        k=nearest_k
     )
-    ,sense = xp.minimize
-)
-
-xp.setOutputEnabled(False)
-start_time = perf_counter()
-print(f"Solving a problem with {prob.getAttrib('rows'):,} rows and {prob.getAttrib("cols"):,} columns")
-prob.solve()
-end_time = perf_counter()
-print(f"took {pretty_print_seconds(end_time-start_time)} for a problem with {prob.getAttrib('rows'):,} rows and {prob.getAttrib("cols"):,} columns")
 
 
 # =============================================================================
 # Post-processing and data visualisation
 # =============================================================================
 
-obj_2sp = prob.attributes.objval
-
-
-
-print_sol_status(prob)
+if METHOD in ("benders", "ph"):
+    obj_2sp = plan.upper_bound
+    if plan.lp_upper_bound is not None:
+        print(f"Expected cost with LP flows (benders' upper bound): {plan.lp_upper_bound:,.0f}")
+    if not np.isfinite(plan.upper_bound):
+        print("The plan couldn't be costed with integer flows in every scenario, the figures below use "
+              + ("the LP flows" if METHOD == "benders" else "each scenario's flows for its own plan"))
+    print(f"Expected cost: {plan.upper_bound:,.0f}\t lower bound: {plan.lower_bound:,.0f}\t gap: {plan.gap*100:.2f}%")
+
+    ys = plan.y_dict()
+    setup, operating, sup_ware, ware_cust = plan.cost_breakdown()
+    supplier_usage = plan.supplier_usage()
+else:
+    obj_2sp = result.objval
 
-#x = { k:int(v) for k,v in prob.getSolution(x).items() }   # if x is not binary change this !!!
-ytemp = { k:int(v) for k,v in prob.getSolution(y).items() }
-#z = prob.getSolution(z)
-costs = (warehouse_setup_costs, warehouse_operating_costs, supplier_to_warehouse_costs, warehouse_to_customer_costs)
-costs = map(
-    lambda v: prob.getSolution(v),
-    costs
-)
+    print_sol_status(result)
 
+    sol = result.x
+    ys = model.y_dict(sol)
+    setup, operating, sup_ware, ware_cust = model.cost_breakdown(sol)
+    supplier_usage = model.supplier_usage(sol)
 
+prof.deactivate()
+print(prof.report())
+prof.save_chrome_trace(TRACE_FILE)
 
-setup, operating, sup_ware, ware_cust = costs
 #print(f"t\tware\t{"operating":>10} {"supp->ware":>10} {"ware->cust":>10}")
 # print("t\t, warehouses operating, sup_ware, ware_cust")
 
@@ -306,11 +253,8 @@ setup, operating, sup_ware, ware_cust = costs
 
 
 
-probs=prob
-ys = prob.getSolution(y)
-zs = prob.getSolution(z)
-ys = prob.getSolution(y)
-zs = prob.getSolution(z)
+# largest share of its stock each supplier sends anywhere in the final period
+supplier_used = dict(zip(Suppliers, supplier_usage[:, -1]))
 cand_gdf=Candidates_df.loc[Candidates]
 cust_gdf=PostcodeDistricts_df.loc[Customers] 
 supp_gdf=Suppliers_df
@@ -355,12 +299,7 @@ jitter_amount = 0.02
 for k in supp_gdf.index:
     supp = supp_gdf.loc[k]
     supp_loc = (supp["lat"], supp["lon"])
-    color = "green" if max(
-        zs[k,j,t,p,s] 
-        for p in product_index 
-        for j in cand_gdf.index 
-        for s in Scenarios
-    ) else "grey"
+    color = "green" if supplier_used[k] else "grey"
 
     folium.CircleMarker(
         location=supp_loc,
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import numpy as np
+from dataclasses import dataclass
+from pathlib import Path
+
+# =============================================================================
+# Demand weighted Ward tree over the districts.
+#
+# Built once, the tree holds every level of aggregation at the same time:
+# cutting it at k clusters just replays the first n-k merges, O(n), so a sweep
+# over 20, 40, 60, 80 clusters only clusters once. Every district counts with
+# its demand, merging two groups costs
+#
+#   w_a w_b / (w_a + w_b) * |c_a - c_b|^2      (c = demand weighted centre)
+#
+# which is the increase in demand weighted squared distance to the centres,
+# the same thing weighted KMeans minimises.
+# =============================================================================
+
+
+def ward_merges(points, weights):
+    """
+    Weighted Ward clustering by nearest neighbour chains, O(n^2) time and O(n) memory.
+
+    :return: (n-1) x 2 array of the positions of two points, one from each group merged, and the
+        cost of each merge, both sorted by cost
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    # districts without demand still need a position in the tree, they get a tiny weight
+    weights = np.nan_to_num(np.asarray(weights, dtype=np.float64))
+    weights = np.maximum(weights, 1e-9 * max(weights.mean(), 1.0))
+
+    centre = points.copy()
+    size = weights.copy()
+    active = np.ones(n, dtype=bool)
+    merges = np.empty((n - 1, 2), dtype=np.int64)
+    heights = np.empty(n - 1)
+    done = 0
+    chain = []
+    while done < n - 1:
+        if not chain:
+            chain.append(int(np.argmax(active)))
+        a = chain[-1]
+        cost = size[a] * size / (size[a] + size) * ((centre - centre[a])**2).sum(axis=1)
+        cost[~active] = np.inf
+        cost[a] = np.inf
+        b = int(cost.argmin())
+        # on a tie go back down the chain, otherwise it can go round in circles
+        if len(chain) > 1 and cost[chain[-2]] <= cost[b]:
+            b = chain[-2]
+
+        if len(chain) > 1 and b == chain[-2]:
+            # a and b are each other's nearest, merge b into a
+            chain = chain[:-2]
+            merges[done] = a, b
+            heights[done] = cost[b]
+            centre[a] = (size[a] * centre[a] + size[b] * centre[b]) / (size[a] + size[b])
+            size[a] += size[b]
+            active[b] = False
+            done += 1
+        else:
+            chain.append(b)
+
+    # the chains find the merges out of order, for Ward sorting them gives the same tree
+    order = np.argsort(heights, kind="stable")
+    return merges[order], heights[order]
+
+
+@dataclass
+class AggregationTree:
+    """
+    Every district (``ids``) with the merges of the tree, cut it with ``labels(k)``.
+    """
+    ids: np.ndarray
+    points: np.ndarray
+    weights: np.ndarray
+    merges: np.ndarray
+    heights: np.ndarray
+
+    def labels(self, k):
+        """cluster (0, ..., k-1) of every district when the tree is cut at k clusters"""
+        n = len(self.ids)
+        if not 1 <= k <= n:
+            raise ValueError(f"can't cut {n} districts into {k} clusters")
+        parent = np.arange(n)
+
+        def root(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for a, b in self.merges[:n - k]:
+            parent[root(b)] = root(a)
+        roots = np.array([root(i) for i in range(n)])
+        # numbered in order of their first district
+        _, first, labels = np.unique(roots, return_index=True, return_inverse=True)
+        renumber = np.empty(k, dtype=np.int64)
+        renumber[np.argsort(first)] = np.arange(k)
+        return renumber[labels]
+
+    def centres(self, k, labels=None):
+        """
+        Position of the district nearest the demand weighted centre of each cluster, cluster n first.
+        Pass the labels if you already have them.
+        """
+        labels = self.labels(k) if labels is None else labels
+        w = np.nan_to_num(self.weights) + 1e-12
+        total = np.bincount(labels, weights=w, minlength=k)
+        centre = np.stack([
+            np.bincount(labels, weights=w * self.points[:, d], minlength=k) / total
+            for d in range(self.points.shape[1])
+        ], axis=1)
+        dist = ((self.points - centre[labels])**2).sum(axis=1)
+        order = np.lexsort((dist, labels))
+        return order[np.searchsorted(labels[order], np.arange(k))]
+
+    def cut(self, k):
+        """cluster labels and the ids of the cluster centres (cluster n -> centre_ids[n])"""
+        labels = self.labels(k)
+        return labels, self.ids[self.centres(k, labels)]
+
+    def save(self, path):
+        np.savez(path, ids=self.ids, points=self.points, weights=self.weights,
+                 merges=self.merges, heights=self.heights)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            return cls(**{name: f[name] for name in f.files})
+
+
+def tree_key(ids, points, weights):
+    """hash of what the tree is built from"""
+    h = hashlib.sha1()
+    for arr in (ids, points, weights):
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.dtype, arr.shape)).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()[:16]
+
+
+# trees already built in this process, by tree_key
+_trees = {}
+
+
+def aggregation_tree(ids, points, weights, cache_dir=None):
+    """
+    The tree over ``ids`` at ``points`` (n x 2) weighted by demand, only built the first time
+    it's asked for with the same inputs.
+
+    :param cache_dir: also keep it in this directory, so the next run doesn't build it again either
+    """
+    ids, points = np.asarray(ids), np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    key = tree_key(ids, points, weights)
+    if key in _trees:
+        return _trees[key]
+
+    path = None if cache_dir is None else Path(cache_dir) / f"ward_tree_{key}.npz"
+    if path is not None and path.exists():
+        tree = AggregationTree.load(path)
+    else:
+        merges, heights = ward_merges(points, weights)
+        tree = AggregationTree(ids, points, weights, merges, heights)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write then rename so parallel runs never see a partial file
+            tmp_file = path.with_suffix(f".{os.getpid()}.tmp.npz")
+            tree.save(tmp_file)
+            os.replace(tmp_file, path)
+
+    _trees[key] = tree
+    return tree
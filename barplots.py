@@ -2,10 +2,14 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from pathlib import Path
+from experiment_runner import results_frame, progress_frame
 
 def load_and_prepare_data(file_path):
     """Load warehouse data and sort it for plotting."""
-    df = pd.read_csv(file_path)
+    if Path(file_path).suffix == ".jsonl":
+        df = results_to_comparison(file_path)
+    else:
+        df = pd.read_csv(file_path)
     df = df.sort_values(["warehouses", "method"])
     df["time"] = df["time"]//60
     df["objval"] = df["objval"]/(1_000_000)
@@ -13,6 +17,18 @@ def load_and_prepare_data(file_path):
     
     return df
 
+def results_to_comparison(file_path):
+    """the experiment_runner records in the columns of "part a comparison Subprob.txt" """
+    records = results_frame(file_path)
+    return pd.DataFrame({
+        "time": records["total_time"].fillna(0).astype(int),
+        "objval": records["objval"].fillna(0),
+        "error": records["status"] == "error",
+        "warehouses": records["num_warehouses"],
+        "customers": records["num_customers"],
+        "method": np.where(records["aggregation"] == "subprob", "subprob", records["aggregation"].str.capitalize()),
+    })
+
 def create_comparison_chart(df, value_column, y_label, chart_title):
     """Create a grouped bar chart comparing methods across warehouse counts."""
     warehouses = sorted(df["warehouses"].unique())
@@ -51,8 +67,34 @@ def create_comparison_chart(df, value_column, y_label, chart_title):
     plt.tight_layout()
     plt.show()
 
+def create_gap_chart(file_path, aggregation=None):
+    """MIP gap against solve time for every run in an experiment_runner results file, one line per run"""
+    points = progress_frame(file_path)
+    if aggregation is not None:
+        points = points[points["aggregation"] == aggregation]
+
+    plt.figure(figsize=(10, 6))
+    for (warehouses, customers, method, scenarios), run in points.groupby(
+            ["num_warehouses", "num_customers", "aggregation", "scenarios"], dropna=False):
+        run = run.dropna(subset=["gap"])
+        label = f"{warehouses} warehouses, {customers} customers, {method}"
+        if pd.notna(scenarios):
+            label += f", {int(scenarios)} scenarios"
+        plt.step(run["elapsed"]/60, run["gap"]*100, where="post", label=label)
+
+    plt.axhline(5, color="grey", linestyle="--", alpha=0.6)
+    plt.yscale("log")
+    plt.xlabel("Solve Time (minutes)", fontsize=11)
+    plt.ylabel("MIP Gap (%)", fontsize=11)
+    plt.title("MIP gap during the solve", fontsize=13, fontweight='bold')
+    plt.legend(fontsize=8)
+    plt.grid(alpha=0.3)
+    plt.tight_layout()
+    plt.show()
+
 if __name__ == "__main__":
     # Load the data
+    # the old results, "part a results.jsonl" for what running part a many times.py writes now
     data_file =  "part a comparison Subprob.txt"
     warehouse_data = load_and_prepare_data(data_file)
     
@@ -73,3 +115,7 @@ if __name__ == "__main__":
         chart_title="Objective Value for increasing numbers of candidate locations"
     )
     
+
+    # Chart 3: how the gap closed, only for results files of experiment_runner.py
+    if Path(data_file).suffix == ".jsonl":
+        create_gap_chart(data_file)
@@ -0,0 +1,287 @@
+import numpy as np
+import copy
+from dataclasses import dataclass, field, replace
+from time import perf_counter
+from model_builder import MatrixBuilder, MecwlpInstance, warehouse_costs
+from solver_backends import make_backend
+from scenario_subproblems import ScenarioSolver
+from helper_funcs import pretty_print_seconds
+
+# =============================================================================
+# L-shaped / Benders decomposition of the two-stage stochastic MECWLP.
+#
+# The warehouse plan y[j,t] is the first stage and sits in a small master MIP
+# together with theta[s], an estimate of the flow (x, z) cost of scenario s.
+# Every iteration the master proposes a plan, each scenario's flow problem is
+# solved as an LP with y fixed, and its reduced costs on y give a cut
+#
+#   optimality:  theta[s] >= Q_s(y^) + g_s . (y - y^)
+#   feasibility:        0 >= w_s(y^) + g_s . (y - y^)   (w_s = phase one infeasibility)
+#
+# so the master only ever grows by a few rows per scenario and the work per
+# iteration is one LP per scenario rather than one MIP with every scenario in it.
+# The scenario LPs themselves live in scenario_subproblems.py and can be spread
+# over several processes.
+# =============================================================================
+
+
+@dataclass
+class BendersResult:
+    """
+    Best plan found, with the flow solutions of each scenario for that plan.
+
+    upper_bound is the expected cost of ``y`` with LP flows, lower_bound is the master's bound.
+    with_integer_flows solves the flows again with x binary, upper_bound is then the cost with
+    those and lp_upper_bound the LP figure
+    """
+    instance: MecwlpInstance
+    y: np.ndarray
+    lower_bound: float
+    upper_bound: float
+    first_stage_cost: float
+    recourse_costs: np.ndarray
+    iterations: int
+    scenario_models: list = field(repr=False)
+    scenario_solutions: list = field(repr=False)
+    history: list = field(default_factory=list, repr=False)  # (iteration, lower bound, upper bound, seconds)
+    lp_upper_bound: float = None  # only once the flows are integer
+
+    @property
+    def gap(self):
+        return (self.upper_bound - self.lower_bound) / (1e-10 + abs(self.upper_bound))
+
+    def y_dict(self):
+        """{(j, t): 0/1} like MecwlpModel.y_dict"""
+        inst = self.instance
+        return {
+            (j, t): int(self.y[j_pos, t_pos])
+            for j_pos, j in enumerate(inst.candidates) for t_pos, t in enumerate(inst.periods)
+        }
+
+    def cost_breakdown(self):
+        """(setup, operating, supplier->warehouse, warehouse->customer) as MecwlpModel.cost_breakdown, flows are expected values"""
+        inst = self.instance
+        setup = inst.setup_cost @ self.y[:, -1]
+        operating = {t: inst.operating_cost @ self.y[:, t_pos] for t_pos, t in enumerate(inst.periods)}
+        sup_ware = dict.fromkeys(inst.periods, 0.0)
+        ware_cust = dict.fromkeys(inst.periods, 0.0)
+        for prob, model, sol in zip(inst.scenario_probs, self.scenario_models, self.scenario_solutions):
+            _, _, sw, wc = model.cost_breakdown(sol)
+            for t in inst.periods:
+                sup_ware[t] += prob * sw[t]
+                ware_cust[t] += prob * wc[t]
+        return setup, operating, sup_ware, ware_cust
+
+    def supplier_usage(self):
+        """supplier x period, the largest share of its stock a supplier sends anywhere in any scenario"""
+        return np.max([
+            model.supplier_usage(sol) for model, sol in zip(self.scenario_models, self.scenario_solutions)
+        ], axis=0)
+
+
+def with_integer_flows(result:BendersResult, backend=None, workers=None, **build_kwargs) -> BendersResult:
+    """
+    ``result`` with the flows of its plan solved as MIPs (x binary, single sourcing as in the full
+    model), so upper_bound and cost_breakdown are what the plan really costs. The master's bound
+    is still a lower bound. If some scenario's integer flows are infeasible (or not solved in time)
+    upper_bound is inf and the LP flows are kept.
+
+    :param build_kwargs: the same as for solve_benders
+    """
+    inst = result.instance
+    with ScenarioSolver(inst, make_backend(backend or "xpress"), workers, integer=True, **build_kwargs) as scenarios:
+        results = scenarios.solve(result.y)
+        models = scenarios.models()
+    if not all(ok for ok, _, _, _ in results):
+        return replace(result, upper_bound=np.inf, lp_upper_bound=result.upper_bound)
+    recourse = np.array([value for _, value, _, _ in results])
+    return replace(
+        result,
+        upper_bound=result.first_stage_cost + inst.scenario_probs @ recourse,
+        lp_upper_bound=result.upper_bound,
+        recourse_costs=recourse,
+        scenario_models=models,
+        scenario_solutions=[sol for _, _, _, sol in results],
+    )
+
+
+def build_master(inst:MecwlpInstance, cuts, max_open=None, stock_ratio=1.0, assign_mask=None):
+    """
+    The master problem over y[j,t] and theta[s] with the cuts found so far.
+    stock_ratio and assign_mask are those the flow problems were built with.
+
+    :param cuts: list of ``(s_pos, value, subgradient, y)``, s_pos None for a feasibility cut
+    :return: the MatrixModel and the column indices of y (candidate x period) and theta (scenario)
+    """
+    nJ, nT, nS = len(inst.candidates), len(inst.periods), len(inst.scenarios)
+    mb = MatrixBuilder()
+    y_cols = mb.add_columns((nJ, nT), cost=warehouse_costs(inst), ub=1, integer=True)
+    # flows never cost anything negative, so theta >= 0 keeps the first master bounded
+    theta_cols = mb.add_columns(nS, cost=inst.scenario_probs)
+
+    # if we build a warehouse it stays open
+    rows = mb.add_rows((nJ, nT - 1), ub=0)
+    mb.add_coefs(rows, y_cols[:, :-1], 1)
+    mb.add_coefs(rows, y_cols[:, 1:], -1)
+
+    if max_open is not None:
+        rows = mb.add_rows(nT, ub=max_open)
+        mb.add_coefs(rows[None, :], y_cols, 1)
+
+    # the flow problem is only feasible when every customer has an open warehouse it can be
+    # served from and the open warehouses have room for stock_ratio of every scenario's demand.
+    # Saying so up front saves most of the feasibility cuts the first plans would otherwise need
+    if assign_mask is None:
+        rows = mb.add_rows(nT, lb=1)
+        mb.add_coefs(rows[None, :], y_cols, 1)
+    else:
+        cust, cand = np.nonzero(assign_mask)
+        rows = mb.add_rows((len(inst.customers), nT), lb=1)
+        mb.add_coefs(rows[cust], y_cols[cand], 1)
+
+    need = stock_ratio * inst.demand.sum(axis=(0, 1)).max(axis=-1)
+    rows = mb.add_rows(nT, lb=need)
+    mb.add_coefs(rows[None, :], y_cols, inst.candidate_capacity[:, None])
+
+    for s_pos, value, grad, y_hat in cuts:
+        if s_pos is None:
+            # feasibility: g.y <= g.y^ - w(y^)
+            row = mb.add_rows(1, ub=(grad * y_hat).sum() - value)
+            mb.add_coefs(row, y_cols, grad)
+        else:
+            # optimality: theta[s] - g.y >= Q(y^) - g.y^
+            row = mb.add_rows(1, lb=value - (grad * y_hat).sum())
+            mb.add_coefs(row, theta_cols[s_pos], 1)
+            mb.add_coefs(row, y_cols, -grad)
+
+    return mb.build("benders master"), y_cols, theta_cols
+
+
+# the master always gets this long, even when the time is up
+MIN_MASTER_TIME = 10
+
+
+def master_backend(backend, tol, left):
+    """
+    a copy of ``backend`` for the master MIP: solved to at least ``tol`` (a looser master gap would
+    stop the loop short of it) and for no longer than the ``left`` seconds of the loop, None for its own limit
+    """
+    backend = copy.copy(backend)
+    backend.rel_gap = tol if backend.rel_gap is None else min(backend.rel_gap, tol)
+    if left is not None:
+        backend.time_limit = max(left, MIN_MASTER_TIME)
+    return backend
+
+
+def solve_benders(inst:MecwlpInstance, backend=None, max_open=None, tol=1e-3, max_iterations=500,
+                  time_limit=None, lp_warmup=True, workers=None, verbose=True, **build_kwargs):
+    """
+    Solve the stochastic MECWLP with integer warehouse plans and LP flows by Benders decomposition.
+
+    :param backend: solver_backends backend (or its name) for both the master MIP and the flow LPs, the
+        master is solved to a gap of tol within the time that's left (see master_backend)
+    :param max_open: at most this many warehouses open in each period
+    :param tol: stop once the relative gap between the bounds is below this
+    :param time_limit: seconds for the whole loop, the best plan so far is returned when it runs out
+        (it keeps going until it has a plan though)
+    :param lp_warmup: start with y relaxed in the master. LP masters are cheap and the cuts they
+        collect at fractional plans are just as valid, so the integer iterations start from a much
+        better bound
+    :param workers: solve the scenario LPs in this many processes (see scenario_subproblems.ScenarioSolver)
+    :param build_kwargs: passed on to build_mecwlp for the flow problems, e.g.
+        ``stock_ratio=.8, exact_stock=True, supply_only_open=True``
+    """
+    backend = make_backend(backend or "xpress")
+    with ScenarioSolver(inst, backend, workers, integer=False, **build_kwargs) as scenarios:
+        return _benders_loop(inst, backend, scenarios, max_open, tol, max_iterations, time_limit,
+                             lp_warmup, verbose, build_kwargs)
+
+
+def _benders_loop(inst, backend, scenarios:ScenarioSolver, max_open, tol, max_iterations, time_limit,
+                  lp_warmup, verbose, build_kwargs):
+    start = perf_counter()
+    nS = len(inst.scenarios)
+    if verbose:
+        print(f"benders: {nS} flow problems of {scenarios.model(0).matrix.size()}"
+              f"{f' over {scenarios.workers} processes' if scenarios.workers else ''}")
+
+    cuts = []
+    lower, upper = -np.inf, np.inf
+    best = None
+    history = []
+    iteration = 0
+    relaxed = lp_warmup
+    for iteration in range(1, max_iterations + 1):
+        master, y_cols, theta_cols = build_master(
+            inst, cuts, max_open, build_kwargs.get("stock_ratio", 1.0), build_kwargs.get("assign_mask")
+        )
+        if relaxed:
+            master = replace(master, integrality=np.zeros(master.n_cols, dtype=bool))
+        left = None if time_limit is None else time_limit - (perf_counter() - start)
+        master_result = master_backend(backend, tol, left).solve(master)
+        if not master_result.has_solution:
+            if best is not None and left is not None:
+                if verbose:
+                    print("benders: out of time")
+                break
+            raise RuntimeError(f"benders master ended with status {master_result.status!r}")
+        lower = max(lower, master_result.bestbound)
+        y_hat = master_result.x[y_cols] if relaxed else np.rint(master_result.x[y_cols])
+        theta_hat = master_result.x[theta_cols]
+
+        first_stage = (warehouse_costs(inst) * y_hat).sum()
+        recourse = np.zeros(nS)
+        solutions = [None] * nS
+        feasible = True
+        for s_pos, (ok, value, grad, sol) in enumerate(scenarios.solve(y_hat)):
+            if ok:
+                recourse[s_pos], solutions[s_pos] = value, sol
+                # only worth a cut if theta is underestimating this scenario
+                if value > theta_hat[s_pos] + 1e-6 * max(1.0, abs(value)):
+                    cuts.append((s_pos, value, grad, y_hat))
+            else:
+                feasible = False
+                cuts.append((None, value, grad, y_hat))
+
+        total = first_stage + inst.scenario_probs @ recourse if feasible else np.inf
+        if not relaxed and total < upper:
+            upper = total
+            best = (y_hat, first_stage, recourse, solutions)
+
+        elapsed = perf_counter() - start
+        history.append((iteration, lower, upper, elapsed))
+        if verbose:
+            print(f"benders it {iteration:>3}: lower {lower:>14,.0f} upper {upper:>14,.0f} "
+                  f"cuts {len(cuts):>5} {'(LP) ' if relaxed else ''}"
+                  f"{'' if feasible else '(plan infeasible) '}{pretty_print_seconds(elapsed)}")
+
+        if relaxed:
+            # move on to integer plans once the LP master has converged (its plan costs what it
+            # thinks it costs), once its bound stops moving, or after half the time
+            converged = feasible and total - master_result.objval <= tol * abs(total)
+            stalled = iteration > 5 and lower - history[-6][1] <= tol * abs(lower)
+            half_time = time_limit is not None and elapsed > time_limit / 2
+            relaxed = not (converged or stalled or half_time)
+            continue
+        if upper - lower <= tol * abs(upper):
+            break
+        if time_limit is not None and elapsed > time_limit and best is not None:
+            if verbose:
+                print("benders: out of time")
+            break
+
+    if best is None:
+        raise RuntimeError("benders did not find a feasible plan")
+    y, first_stage, recourse, solutions = best
+    return BendersResult(
+        instance=inst,
+        y=y.astype(int),
+        lower_bound=lower,
+        upper_bound=upper,
+        first_stage_cost=first_stage,
+        recourse_costs=recourse,
+        iterations=iteration,
+        scenario_models=scenarios.models(),
+        scenario_solutions=solutions,
+        history=history,
+    )
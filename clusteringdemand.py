@@ -1,15 +1,23 @@
 import pandas as pd
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from pyproj import Transformer
-from shapely.geometry import MultiPoint, Point
-from geopy.distance import great_circle
 import geopandas as gpd
 import folium
 from folium import CircleMarker
 import numpy as np
+import scipy.sparse as sp
+import copy, hashlib, os, pickle
+from collections import OrderedDict
+from pathlib import Path
 from time import perf_counter
 from helper_funcs import *
-import platform
+from cost_matrices import candidate_customer_costs, cost_dict
+from model_builder import MatrixBuilder
+from solver_backends import SolverBackend, make_backend
+from aggregation_tree import aggregation_tree
+from problem_data import ProblemData
+from p_median import solve_p_median
+from instrumentation import span, traced
 
 #I hope moving this wont break your code michael. Apologies in advance
 # num_clusters = 60
@@ -22,11 +30,260 @@ import platform
 # Demand_df = pd.read_csv(f"{data_dir}/Demand.csv")
 
 
+def haversine(lat1, lon1, lat2, lon2):
+    """great circle distance in metres between arrays of points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+
+def centermost_points(latlon:np.ndarray, cluster_labels:np.ndarray, num_clusters:int):
+    """
+    For every cluster the position of its point nearest (great circle) to the cluster's centroid,
+    all clusters at once.
+
+    :param latlon: n x 2 array of lat, lon
+    :param cluster_labels: cluster 0, ..., num_clusters-1 of every point
+    :return: array of num_clusters positions into ``latlon``, cluster n's centre first
+    """
+    counts = np.bincount(cluster_labels, minlength=num_clusters)
+    if (counts == 0).any():
+        raise ValueError(f"clusters {np.flatnonzero(counts == 0).tolist()} have no points")
+    # the centroid is the plain mean of the coordinates, like shapely's MultiPoint centroid
+    centroid_lat = np.bincount(cluster_labels, weights=latlon[:, 0], minlength=num_clusters) / counts
+    centroid_lon = np.bincount(cluster_labels, weights=latlon[:, 1], minlength=num_clusters) / counts
+
+    dist = haversine(latlon[:, 0], latlon[:, 1], centroid_lat[cluster_labels], centroid_lon[cluster_labels])
+    # sort by cluster then distance, the first point of each cluster is its centre
+    order = np.lexsort((dist, cluster_labels))
+    return order[np.searchsorted(cluster_labels[order], np.arange(num_clusters))]
+
+
+def _chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
+
+
+def kmeans_labels(points, weights, num_clusters, random_state=0):
+    """plain weighted KMeans on every point, fine for a few thousand"""
+    return KMeans(n_clusters=num_clusters, random_state=random_state).fit(points, sample_weight=weights).labels_
+
+
+def minibatch_labels(points, weights, num_clusters, random_state=0, chunk_size=100_000, passes=3):
+    """
+    Weighted MiniBatchKMeans fed ``chunk_size`` points at a time, so ``points`` can be a memmap
+    that never fits in memory at once. Only the labels are kept in full.
+    """
+    n = len(points)
+    # the points are often in some order (postcodes are), so the centres start from a weighted
+    # kmeans of rows from all over the array rather than from whatever the first chunk holds, and
+    # centres aren't reassigned, that would drag the quiet ones over to the area the chunk covers
+    chunk_size = max(chunk_size, num_clusters)
+    sample = np.sort(np.random.default_rng(random_state).choice(n, min(n, chunk_size), replace=False))
+    init = KMeans(n_clusters=num_clusters, random_state=random_state).fit(
+        np.asarray(points[sample]), sample_weight=np.asarray(weights[sample])
+    ).cluster_centers_
+    kmeans = MiniBatchKMeans(n_clusters=num_clusters, random_state=random_state, batch_size=min(chunk_size, 4096),
+                             init=init, n_init=1, reassignment_ratio=0)
+    for _ in range(passes):
+        for rows in _chunks(n, chunk_size):
+            kmeans.partial_fit(np.asarray(points[rows]), sample_weight=np.asarray(weights[rows]))
+
+    labels = np.empty(n, dtype=np.int64)
+    for rows in _chunks(n, chunk_size):
+        labels[rows] = kmeans.predict(np.asarray(points[rows]))
+    return labels
+
+
+def grid_labels(points, weights, num_clusters, random_state=0, chunk_size=100_000, cell_size=.05):
+    """
+    Bin the points onto a ``cell_size`` degree grid a chunk at a time, run weighted KMeans on the
+    (demand weighted) middle of each occupied cell, and give every point its cell's cluster.
+    Memory goes with the number of occupied cells, not the number of points.
+    """
+    n = len(points)
+
+    def cell_keys(rows):
+        cells = np.floor(np.asarray(points[rows]) / cell_size).astype(np.int64)
+        # lat/lon cells packed into one int, lon cells are well within +-2**20
+        return (cells[:, 0] << 21) + cells[:, 1]
+
+    # first pass: per cell total weight, number of points, weighted and plain coordinate sums
+    keys, sums = np.empty(0, dtype=np.int64), np.empty((0, 6))
+    for rows in _chunks(n, chunk_size):
+        pts, w = np.asarray(points[rows]), np.asarray(weights[rows], dtype=np.float64)
+        chunk_keys = np.concatenate([keys, cell_keys(rows)])
+        chunk_sums = np.concatenate([sums, np.c_[w, np.ones(len(w)), w[:, None] * pts, pts]])
+        keys, inverse = np.unique(chunk_keys, return_inverse=True)
+        sums = np.zeros((len(keys), 6))
+        np.add.at(sums, inverse, chunk_sums)
+    if len(keys) < num_clusters:
+        raise ValueError(f"only {len(keys)} grid cells are occupied, less than {num_clusters} clusters. Make cell_size smaller")
+
+    cell_weight, cell_count = sums[:, 0], sums[:, 1]
+    # demand weighted middle of each cell, the plain middle if it has no demand
+    has_weight = cell_weight > 0
+    centres = sums[:, 4:6] / cell_count[:, None]
+    centres[has_weight] = sums[has_weight, 2:4] / cell_weight[has_weight, None]
+    cell_labels = kmeans_labels(centres, cell_weight, num_clusters, random_state)
+
+    # second pass: every point takes its cell's cluster
+    labels = np.empty(n, dtype=np.int64)
+    for rows in _chunks(n, chunk_size):
+        labels[rows] = cell_labels[np.searchsorted(keys, cell_keys(rows))]
+    return labels
+
+
+def ward_cut(points, weights, num_clusters, cache_dir=None, random_state=None):
+    """
+    Cut of the demand weighted Ward tree over the points (see aggregation_tree.py). The tree is
+    only built the first time (or loaded from ``cache_dir``), any other number of clusters is then
+    just another cut. random_state is only there so it takes the same options as the others, Ward
+    has nothing random about it.
+
+    :return: the labels and the position of each cluster's centre, the point nearest its demand weighted middle
+    """
+    return aggregation_tree(np.arange(len(points)), points, weights, cache_dir).cut(num_clusters)
+
+
+def ward_labels(points, weights, num_clusters, cache_dir=None, random_state=None):
+    """the labels of ward_cut"""
+    return ward_cut(points, weights, num_clusters, cache_dir)[0]
+
+
+CLUSTERING = {
+    "kmeans": kmeans_labels,
+    "minibatch": minibatch_labels,
+    "grid": grid_labels,
+    "ward": ward_labels,
+}
+
+
+def cluster_points(points, weights, num_clusters, method="kmeans", **options):
+    """
+    Cluster label (0, ..., num_clusters-1) of every point.
+
+    :param points: n x 2 lat, lon, any array that can be sliced in rows (np.memmap works)
+    :param weights: demand of every point
+    :param method: "kmeans" for everything at once, "minibatch" or "grid" for the big datasets,
+        "ward" for sweeps over the number of clusters
+    :param options: random_state, and chunk_size etc of the chosen method
+    """
+    try:
+        labeller = CLUSTERING[method]
+    except KeyError:
+        raise ValueError(f"unknown clustering {method!r}, pick one of {list(CLUSTERING)}") from None
+    return np.asarray(labeller(points, weights, num_clusters, **options), dtype=np.int64)
+
+
 # map demand to the candidate location 
 
-def calcClusters(Demand_df: pd.DataFrame, Candidates_df:pd.DataFrame, DemandPeriodsScenarios_df:pd.DataFrame, num_clusters:int):
+# bump this whenever calcClusters changes what it returns so old memos get ignored
+CLUSTER_CACHE_VERSION = 4
+# results kept in memory, and how much disk the pickled ones may take before the oldest go
+CLUSTER_MEMO_ENTRIES = 16
+CLUSTER_CACHE_BYTES = 200 * 2**20
+
+# key -> calcClusters result, least recently used first
+_cluster_memo = OrderedDict()
+
+
+def clusters_key(frames, data:ProblemData, num_clusters, method, cluster_options):
+    """Hash of the contents of the input frames, the demand arrays and the clustering settings"""
+    h = hashlib.sha1(f"v{CLUSTER_CACHE_VERSION}".encode())
+    for df in frames:
+        if df is None:
+            h.update(b"none;")
+            continue
+        h.update(str(list(df.columns)).encode())
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    for arr in (data.customers, data.products, data.periods, data.scenarios, data.demand_periods, data.demand_scenarios):
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.dtype, arr.shape)).encode())
+        h.update(arr.tobytes())
+    h.update(repr((num_clusters, method, sorted(cluster_options.items()))).encode())
+    return h.hexdigest()[:16]
+
+
+def evict_cluster_cache(cache_dir, max_bytes=CLUSTER_CACHE_BYTES):
+    """delete the least recently used pickled results until they take up less than max_bytes"""
+    files = sorted(Path(cache_dir).glob("clusters_*.pkl"), key=lambda path: path.stat().st_mtime)
+    total = sum(path.stat().st_size for path in files)
+    for path in files:
+        if total <= max_bytes:
+            break
+        total -= path.stat().st_size
+        path.unlink(missing_ok=True)
+
+
+@traced()
+def calcClusters(Demand_df: pd.DataFrame, Candidates_df:pd.DataFrame, data:ProblemData=None, num_clusters:int=30,
+                 method="kmeans", use_cache=True, cache_dir=None, **cluster_options):
+    """
+    Cluster the districts by location, weighted by demand.
+
+    :return: every candidate with its "cluster label", the cluster centres (cluster n is the n'th row),
+        the Demand_df rows of the centres and the ProblemData with the demand summed over each cluster
+        (its customers are the centres)
+
+    The result is remembered, in memory for this run and pickled to ``cache_dir`` (default
+    ``CaseStudyDataPY/.cache``) for later ones, under a hash of the input frames, the data files and
+    the settings. Asking again with the same inputs skips the clustering entirely.
+
+    :param data: the ProblemData from get_all_data, whose demand arrays get summed over the clusters.
+        Loaded (from get_all_data's cache) if not given
+    :param method: clustering to use, see cluster_points. "minibatch" and "grid" work in chunks for
+        when there are far too many points for plain kmeans, "ward" builds a tree once and cuts it
+        for every num_clusters asked for after that
+    :param use_cache: set to False to always cluster (and leave the caches alone)
+    :param cluster_options: passed to cluster_points, e.g. random_state, chunk_size or cell_size
+    """
+    data_dir = "CaseStudyDataPY"
+    if data is None:
+        data = get_all_data(data_dir)[4]
+    if not use_cache:
+        return cluster_districts(Demand_df, Candidates_df, data, num_clusters, method, cache_dir, **cluster_options)
+
+    key = clusters_key((Demand_df, Candidates_df), data, num_clusters, method, cluster_options)
+    if key in _cluster_memo:
+        _cluster_memo.move_to_end(key)
+        # a copy, so whatever the caller does to the frames doesn't end up in the memo
+        return copy.deepcopy(_cluster_memo[key])
+
+    cache_dir = Path(data_dir) / ".cache" if cache_dir is None else Path(cache_dir)
+    cache_file = cache_dir / f"clusters_{key}.pkl"
+    result = None
+    if cache_file.exists():
+        try:
+            with span("load cache"), open(cache_file, "rb") as f:
+                result = pickle.load(f)
+            # keeps recently used results at the back of the eviction queue
+            os.utime(cache_file)
+        except Exception as e:
+            print(f"ignoring unreadable cluster cache {cache_file}: {e}")
+
+    if result is None:
+        # the ward tree goes in the same directory, so other processes and later runs don't build it again
+        result = cluster_districts(Demand_df, Candidates_df, data, num_clusters, method, cache_dir, **cluster_options)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # write then rename so parallel runs never see a partial file
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            pickle.dump(result, f, protocol=5)
+        os.replace(tmp_file, cache_file)
+        evict_cluster_cache(cache_dir)
+
+    _cluster_memo[key] = result
+    while len(_cluster_memo) > CLUSTER_MEMO_ENTRIES:
+        _cluster_memo.popitem(last=False)
+    return copy.deepcopy(result)
+
+
+@traced()
+def cluster_districts(Demand_df: pd.DataFrame, Candidates_df:pd.DataFrame, data:ProblemData, num_clusters:int=30,
+                      method="kmeans", cache_dir=None, **cluster_options):
+    """calcClusters without the caching, apart from the ward tree which is kept in ``cache_dir`` if given"""
 
-    data_dir="CaseStudyDataPY"
     demand_grouped = Demand_df.groupby('Customer')["Demand"].sum()
     
     Candidates_df = pd.merge(Candidates_df, demand_grouped, left_on = 'Candidate ID', right_on = demand_grouped.index, how ='left')
@@ -49,213 +306,137 @@ def calcClusters(Demand_df: pd.DataFrame, Candidates_df:pd.DataFrame, DemandPeri
     arr = Candidates_df[['lat', 'lon']].to_numpy()
     kmeans_weights = Candidates_df['Total Demand'].to_numpy()
 
-        
-    kmeans = KMeans(n_clusters=num_clusters, random_state=0).fit(arr, sample_weight=kmeans_weights)
-    
-    cluster_labels = kmeans.labels_ 
-    
-    
-    clusters = pd.Series([arr[cluster_labels == n] for n in range(num_clusters)])
-    
-    def get_centermost_point(cluster):
-        points = [(lon, lat) for lat, lon in cluster]
-        centroid = MultiPoint(points).centroid
-        centermost_point = min(
-            cluster,
-            key=lambda point: great_circle(point, (centroid.y, centroid.x)).m
-        )
-        return centermost_point
-    
-    centermost_points = clusters.map(get_centermost_point)
-    
-    centermost_points = pd.DataFrame(
-        {
-            "lat": centermost_points.map(lambda x: x[0]),
-            "lon": centermost_points.map(lambda x: x[1]),
-            "is_cluster_centre": 1
-        }
-    )
-    All_Candidates_df = Candidates_df.merge(right=centermost_points, how="left", on=["lon", "lat"])
+
+    # row of the candidate nearest the middle of each cluster, cluster n's centre is row centre_rows[n]
+    if method == "ward":
+        # the tree gives the demand weighted centres with the cut
+        cluster_labels, centre_rows = ward_cut(arr, kmeans_weights, num_clusters, cache_dir, **cluster_options)
+    else:
+        cluster_labels = cluster_points(arr, kmeans_weights, num_clusters, method, **cluster_options)
+        centre_rows = centermost_points(arr, cluster_labels, num_clusters)
+
+    All_Candidates_df = Candidates_df
     # one hot encode the clustre centres
-    All_Candidates_df["is_cluster_centre"] = All_Candidates_df["is_cluster_centre"].fillna(0).astype(bool)
-    
-    assert num_clusters == All_Candidates_df["is_cluster_centre"].sum()
+    All_Candidates_df["is_cluster_centre"] = False
+    All_Candidates_df.iloc[centre_rows, All_Candidates_df.columns.get_loc("is_cluster_centre")] = True
     All_Candidates_df["cluster label"] = cluster_labels
-    
-    reduced_Candidates_df = All_Candidates_df.loc[ All_Candidates_df["is_cluster_centre"] ]
-    
-    reduced_ids = list(reduced_Candidates_df['Candidate ID'])
-    
-    reduced_demand_df = Demand_df[Demand_df['Customer'].isin(reduced_ids)]
 
-    # we need to aggregate demand per cluster across time
-    DemandPeriods_df = pd.read_csv(f"CaseStudyDataPY/DemandPeriods.csv")
-    #go from candidate to their cluster
-    map_cand_id_to_cluster_label = {
-         cand_id:label 
-         for cand_id, label in zip(All_Candidates_df["Candidate ID"], cluster_labels)
-    }
-    #get the cluster for each entry i.e customer time, period 
-    DemandPeriods_df["cluster label"] = DemandPeriods_df["Customer"].apply(lambda x: map_cand_id_to_cluster_label[x])
-   
-    DemandPeriods_df = DemandPeriods_df.astype(int)
-
-    #aggregate by CLUSTER, product and time
-    DemandPeriods_df = DemandPeriods_df.groupby(["cluster label", "Product", "Period"]).sum()
-
-    #then we switch from cluster to the cluster centre
-    DemandPeriods_df = DemandPeriods_df.rename(
-        level=0,
-        index = lambda cluster_label:reduced_Candidates_df.index.array[cluster_label] ) 
-    
-    DemandPeriods_df = DemandPeriods_df.drop(columns="Customer")
-    
-    DemandPeriods_df.index.get_level_values('cluster label').unique()
+    # in cluster order, so the n'th row (and index entry) is the centre of cluster n
+    reduced_Candidates_df = All_Candidates_df.iloc[centre_rows].set_index("Candidate ID")
 
+    reduced_ids = list(reduced_Candidates_df.index)
     
-    #make a dictionary out of it
-    DemandPeriods = DemandPeriods_df.to_dict()["Demand"]
-    
-    
-    DemandPeriodsScenarios_df = pd.read_csv(f"{data_dir}/DemandPeriodScenarios.csv")
-    DemandPeriodsScenarios_df["cluster label"] = DemandPeriodsScenarios_df["Customer"].apply(lambda x: map_cand_id_to_cluster_label[x])
-    DemandPeriodsScenarios_df = DemandPeriodsScenarios_df.astype(int)
-    DemandPeriodsScenarios_df = DemandPeriodsScenarios_df.groupby(["cluster label", "Product", "Period", "Scenario"]).sum()
-    
-    scenarios = DemandPeriodsScenarios_df.index.get_level_values("Scenario")
+    reduced_demand_df = Demand_df[Demand_df['Customer'].isin(reduced_ids)]
+
+    # we need to aggregate demand per cluster across time (and scenario), straight from the
+    # demand arrays: every customer gets its candidate's cluster in one indexing step, then
+    # ProblemData.aggregate sums the arrays over clusters in one np.add.at pass each
+    customer_labels = np.full(len(data.customers), -1, dtype=np.int64)
+    customer_labels[data.customer_positions(All_Candidates_df["Candidate ID"].to_numpy())] = cluster_labels
+    if (customer_labels < 0).any():
+        missing = data.customers[customer_labels < 0]
+        raise KeyError(f"customers {missing[:10].tolist()} have demand but aren't candidates so have no cluster")
+    # the arrays stay arrays, cluster_data.demand_periods_dict() etc still give the old dicts if wanted
+    cluster_data = data.aggregate(customer_labels, reduced_Candidates_df.index)
 
-    DemandPeriodsScenarios_df = DemandPeriodsScenarios_df[
-        (scenarios >= 1) & (scenarios <= 10)
-        ]
-    
-    avg_DemandPeriodsScenarios_df = DemandPeriodsScenarios_df.reset_index().groupby(['cluster label', 'Product', 'Period'])['Demand'].mean()
-    
-    avg_DemandPeriodsScenarios_df = avg_DemandPeriodsScenarios_df.rename(
-        level=0,
-        index = lambda cluster_label:reduced_Candidates_df.index.array[cluster_label] ) 
-    avg_DemandPeriodsScenarios_df = avg_DemandPeriodsScenarios_df.drop(columns="Customer")
-    
-    
-    
-    
-    DemandPeriodsScenarios_df = DemandPeriodsScenarios_df.rename(
-        level=0,
-        index = lambda cluster_label:reduced_Candidates_df.index.array[cluster_label] ) 
-    DemandPeriodsScenarios_df = DemandPeriodsScenarios_df.drop(columns="Customer")
-    
-    
-    DemandPeriodsScenarios = DemandPeriodsScenarios_df.to_dict()["Demand"]
-    
-    avg_DemandPeriodsScenarios = avg_DemandPeriodsScenarios_df.to_dict()
-    
     All_Candidates_df = All_Candidates_df.set_index("Candidate ID") # i think this got unset somehow
 
     
-    return All_Candidates_df, reduced_Candidates_df, reduced_demand_df, DemandPeriods, DemandPeriodsScenarios, avg_DemandPeriodsScenarios
+    return All_Candidates_df, reduced_Candidates_df, reduced_demand_df, cluster_data
     
     
     # creates candidates, then also need seperate df which has demand per product type for each candidate # so are we still using 400 customers and just 60 candidate locations to build?
 
-def get_weighted_travel_costs(reduced_customers_df, cost_ware_cust, all_cust_df):
-
-    #initialisation
-    agg_cost_ware_cust = {
-        (j,central_cust): 0
-        for j,_ in cost_ware_cust 
-        for central_cust in reduced_customers_df.index 
-    }
-
-
-    for (j,i), cost in cost_ware_cust.items():
-
-        central_cust_for_i = reduced_customers_df.index[ all_cust_df.loc[i,"cluster label"] ]
-
-        agg_cost_ware_cust[j, central_cust_for_i] += cost
+def get_weighted_travel_costs(reduced_customers_df, cost_ware_cust, all_cust_df, weights=None):
+    """
+    Travel cost from every warehouse to every cluster, the sum of its costs to the cluster's customers.
 
-    return agg_cost_ware_cust
+    Done as one product of the cost matrix with a sparse customer -> cluster membership matrix.
 
-def aggregate_warehouses_subproblem(num_warehouses:int, candidates_index, customer_index, travel_costs):
+    :param reduced_customers_df: the cluster centres, cluster n is the n'th row
+    :param cost_ware_cust: warehouse x customer cost array, customers in the order of ``all_cust_df``
+    :param all_cust_df: every customer with its "cluster label"
+    :param weights: weight of each customer in the sum (e.g. its demand), by default they all count once
+    :return: warehouse x cluster array
     """
-    Select ``num_warehouses`` warehouses that have minimal transport costs by solving an IP allocation problem.
+    labels = all_cust_df["cluster label"].to_numpy()
+    nI, nC = len(labels), len(reduced_customers_df)
+    weights = np.ones(nI) if weights is None else np.asarray(weights, dtype=np.float64)
+    membership = sp.csr_matrix((weights, (np.arange(nI), labels)), shape=(nI, nC))
+    # sparse.T @ dense comes back dense
+    return np.asarray((membership.T @ np.asarray(cost_ware_cust).T).T)
+
+@traced()
+def aggregate_warehouses_subproblem(num_warehouses:int, candidates_index, customer_index, travel_costs, backend=None, polish=False):
+    """
+    Select ``num_warehouses`` warehouses that have minimal transport costs (a p-median problem).
     This Docstring thing autocompleted, never seen that.
+
+    It's solved with the greedy + vertex substitution heuristic in p_median.py, which takes well
+    under a second and ends up within a fraction of a percent of the IP. With ``polish`` the IP
+    allocation problem is then solved too, starting from the heuristic's answer.
     
     :param num_warehouses: number of warehouses we want to reduce to
     :type num_warehouses: int
     :param candidates_index: index set for all 400 warehouses
     :param customer_index: index set for the REDUCED set of customers
-    :param travel_costs: dictionary of travel costs for going from warehouse to customer
+    :param travel_costs: dictionary of travel costs for going from warehouse to customer, or the
+        candidate x customer array of them
+    :param backend: solver_backends backend, or the name of one, for the polish. Defaults to xpress
+    :param polish: also solve the IP
     """
-    if platform.system()== "Windows":
-        xp.init('c:/xpressmp/bin/xpauth.xpr')
+    Warehouses = np.asarray(candidates_index)
+    Customers = np.asarray(customer_index)
+    nJ, nI = len(Warehouses), len(Customers)
+    if isinstance(travel_costs, dict):
+        costs = np.array([[travel_costs[j,i] for j in Warehouses] for i in Customers])
+    else:
+        costs = np.asarray(travel_costs, dtype=np.float64).T
+
+    open_cols, _ = solve_p_median(costs, num_warehouses)
+    if not polish:
+        return Warehouses[open_cols].tolist()
 
-    subprob = xp.problem("transport cost subproblem")
-    Warehouses = candidates_index
-    Customers = customer_index
+    # we dont need the solution of the subproblem to be that good
+    # It is better than k means if the original problem has better objvals, in the same configurations
+    # when using this subproblem
+    if not isinstance(backend, SolverBackend):
+        # stop after 5 mins or once the mip gap is below 5%
+        backend = make_backend(backend or "xpress", time_limit=60*5, rel_gap=.05)
 
-    # customer allocations
-    x = { 
-        (i,j): subprob.addVariable(name=f"X_{i},{j}", vartype=xp.binary) 
-        for j in Warehouses for i in Customers
-    }
+    mb = MatrixBuilder()
+    # customer allocations, minimise transport costs
+    x = mb.add_columns((nI, nJ), cost=costs, ub=1, integer=True)
     #warehouses open or closed
-    y = {
-        j: subprob.addVariable(name=f"Y{j}", vartype=xp.binary)
-        for j in Warehouses
-    }
-    
+    y = mb.add_columns(nJ, ub=1, integer=True)
+
     # All customers must be allocated a warehouse(s)
-    subprob.addConstraint(
-        xp.Sum(
-            x[i,j]
-            for j in Warehouses
-        )
-        ==1
-        for i in Customers
-    )
+    rows = mb.add_rows(nI, lb=1, ub=1)
+    mb.add_coefs(rows[:, None], x, 1)
 
     #We can only allocate from open Warehouses
-    subprob.addConstraint(
-        x[i,j] <= y[j]
-        for i in Customers for j in Warehouses
-    )
+    rows = mb.add_rows((nI, nJ), ub=0)
+    mb.add_coefs(rows, x, 1)
+    mb.add_coefs(rows, y[None, :], -1)
 
     # We want there to be num_warehouses open
-    subprob.addConstraint(
-        xp.Sum(
-            y[j]
-            for j in Warehouses
-        )
-        == num_warehouses
-    )
+    rows = mb.add_rows(1, lb=num_warehouses, ub=num_warehouses)
+    mb.add_coefs(rows, y, 1)
 
-    # we dont need the solution of the subproblem to be that good
-    # It is better than k means if the original problem has better objvals, in the same configurations
-    # when using this subproblem
-    subprob.setControl('miprelstop', .05) # stop once the mip gap is below 5%
-    subprob.controls.maxtime = -60*5 # stops after 3 mins
-    xp.setOutputEnabled(False)
-
-    # minimise transport costs
-    subprob.setObjective(
-        xp.Sum(
-            travel_costs[j,i] * x[i,j]
-            for i in Customers for j in Warehouses
-        ),
-        sense = xp.minimize
-    )
+    model = mb.build("transport cost subproblem")
 
-    subprob.solve()
+    # start from the heuristic: its warehouses open, every customer to the cheapest of them
+    start = np.zeros(model.n_cols)
+    start[y[open_cols]] = 1
+    start[x[np.arange(nI), open_cols[costs[:, open_cols].argmin(axis=1)]]] = 1
+    result = backend.solve(model, mip_start=start)
 
-    # print_sol_status(subprob)
+    # print_sol_status(result)
 
-    sol_status = subprob.attributes.solstatus
-    if sol_status not in ( xp.SolStatus.OPTIMAL, xp.SolStatus.FEASIBLE):
-        raise "Fuck. Why the fuck did easy allocation model fail?"
+    if not result.has_solution:
+        raise RuntimeError("Fuck. Why the fuck did easy allocation model fail?")
     
-    y = subprob.getSolution(y)
-    chosen_warehouses = [
-        j for j in Warehouses if y[j] == 1
-    ]
+    chosen_warehouses = Warehouses[np.rint(result.x[y]) == 1].tolist()
 
     return chosen_warehouses
 
@@ -263,9 +444,6 @@ def aggregate_warehouses_subproblem(num_warehouses:int, candidates_index, custom
 
 if __name__ == "__main__":
 
-    if platform.system()== "Windows":
-        xp.init('c:/xpressmp/bin/xpauth.xpr')
-
     # num_clusters = 60
 
 
@@ -296,13 +474,13 @@ if __name__ == "__main__":
     # m.save("clusteredloc.html")
     (
         PostcodeDistricts_df, Candidates_df, Suppliers_df,
-        Demand_df, DemandPeriods, DemandPeriodsScenarios_df,
+        Demand_df, data,
         Operating_costs_df, DistanceSupplierDistrict_df, DistanceDistrictDistrict_df,
         nbPeriods, nbScenarios
     ) = get_all_data("CaseStudyDataPY")
 
     #cluster the customer locations and take the aggregated demand
-    _, reduced_Customers_df, _, _ , _, _ = calcClusters(Demand_df, Candidates_df,DemandPeriodsScenarios_df, num_clusters=200)
+    _, reduced_Customers_df, _, _ = calcClusters(Demand_df, Candidates_df, num_clusters=200)
 
     reduced_Customers = reduced_Customers_df.index
     all_Candidates = Candidates_df.index 
@@ -330,14 +508,10 @@ if __name__ == "__main__":
     }
 
 
-    CostCandidateCustomers = {
-        (j, i): 2
-        * DistanceDistrictDistrict_df.loc[j, i]
-        * VehicleCostPerMileAndTonneOverall[3]
-        / 1000
-        for j in all_Candidates
-        for i in reduced_Customers
-    }
+    CostCandidateCustomers = cost_dict(
+        candidate_customer_costs(DistanceDistrictDistrict_df, VehicleCostPerMileAndTonneOverall, all_Candidates, reduced_Customers),
+        all_Candidates, reduced_Customers
+    )
 
 
 
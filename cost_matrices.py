@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from instrumentation import traced
+
+# =============================================================================
+# Transport cost matrices, built in one go with numpy instead of a .loc per pair
+#
+# Cost from suppliers to candidate facilities:
+#   round-trip distance (factor 2) * cost per mile and tonne of the supplier's vehicle / 1000 (kg -> tonnes)
+# Cost from candidate facilities to customers:
+#   the same, but all transports use 3.5t vans (vehicle type 3)
+# =============================================================================
+
+
+def distance_block(distance_df:pd.DataFrame, row_ids=None, col_ids=None):
+    """
+    The distances between ``row_ids`` and ``col_ids`` as a dense array, in the order given.
+    None means every row/column of ``distance_df``.
+    """
+    dist = distance_df.to_numpy(dtype=np.float64)
+    rows = slice(None) if row_ids is None else distance_df.index.get_indexer(row_ids)
+    cols = slice(None) if col_ids is None else distance_df.columns.get_indexer(col_ids)
+
+    for name, pos, ids in (("row", rows, row_ids), ("column", cols, col_ids)):
+        if not isinstance(pos, slice) and (pos < 0).any():
+            missing = np.asarray(ids)[pos < 0]
+            raise KeyError(f"{name} ids {missing[:10].tolist()} are not in the distance matrix")
+
+    # slices keep this a view when all the rows/columns are wanted
+    return dist[rows][:, cols]
+
+
+def supplier_candidate_costs(DistanceSupplierDistrict_df:pd.DataFrame, Suppliers_df:pd.DataFrame,
+                             cost_per_mile_and_tonne:dict, suppliers=None, candidates=None):
+    """suppliers x candidates array of the cost per kg of going from supplier k to candidate j"""
+    suppliers = Suppliers_df.index if suppliers is None else suppliers
+    dist = distance_block(DistanceSupplierDistrict_df, suppliers, candidates)
+
+    vehicle = Suppliers_df.loc[suppliers, "Vehicle type"]
+    rate = vehicle.map(cost_per_mile_and_tonne).to_numpy(dtype=np.float64)
+
+    return 2 * dist * rate[:, None] / 1000
+
+
+def candidate_customer_costs(DistanceDistrictDistrict_df:pd.DataFrame, cost_per_mile_and_tonne:dict,
+                             candidates=None, customers=None, vehicle_type=3):
+    """candidates x customers array of the cost per kg of going from candidate j to customer i"""
+    dist = distance_block(DistanceDistrictDistrict_df, candidates, customers)
+    return 2 * dist * (cost_per_mile_and_tonne[vehicle_type] / 1000)
+
+
+def cost_dict(costs:np.ndarray, row_ids, col_ids):
+    """the {(row id, col id): cost} view the older scripts index into"""
+    keys = pd.MultiIndex.from_product([row_ids, col_ids])
+    return dict(zip(keys, costs.ravel().tolist()))
+
+
+@traced()
+def get_cost_matrices(DistanceSupplierDistrict_df, DistanceDistrictDistrict_df, Suppliers_df,
+                      cost_per_mile_and_tonne:dict, suppliers=None, candidates=None, customers=None,
+                      as_dict=False):
+    """
+    Both transport cost matrices.
+
+    :return: ``CostSupplierCandidate`` (suppliers x candidates) and ``CostCandidateCustomers``
+        (candidates x customers). With ``as_dict=True`` they come back as the dicts keyed
+        by (k, j) and (j, i) the models were originally written against.
+    """
+    suppliers = Suppliers_df.index if suppliers is None else suppliers
+    candidates = DistanceDistrictDistrict_df.index if candidates is None else candidates
+    customers = DistanceDistrictDistrict_df.columns if customers is None else customers
+
+    CostSupplierCandidate = supplier_candidate_costs(
+        DistanceSupplierDistrict_df, Suppliers_df, cost_per_mile_and_tonne, suppliers, candidates
+    )
+    CostCandidateCustomers = candidate_customer_costs(
+        DistanceDistrictDistrict_df, cost_per_mile_and_tonne, candidates, customers
+    )
+
+    if as_dict:
+        return (
+            cost_dict(CostSupplierCandidate, suppliers, candidates),
+            cost_dict(CostCandidateCustomers, candidates, customers),
+        )
+    return CostSupplierCandidate, CostCandidateCustomers
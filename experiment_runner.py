@@ -0,0 +1,433 @@
+import json
+import os
+import itertools
+import traceback
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from time import perf_counter
+from helper_funcs import get_all_data, pretty_print_seconds
+from clusteringdemand import calcClusters, aggregate_warehouses_subproblem
+from cost_matrices import get_cost_matrices
+from model_builder import make_instance, build_mecwlp
+from solver_backends import make_backend, INFEASIBLE
+from scenario_reduction import reduce_scenarios
+from plan_evaluation import evaluate_plan_full
+from warm_start import heuristic_start, plan_start, map_plan
+from pruning import grid_coords, solve_with_pruning, cheapest_supplier_mask
+from instrumentation import profiling, laps, peak_rss
+from solve_progress import progress_summary, progress_records
+
+# =============================================================================
+# Runs a grid of aggregation experiments and keeps one JSON line per run.
+#
+#   configs = config_grid(num_warehouses=(20, 40, 60, 80), num_customers=(80,),
+#                         aggregation=("ward", "subprob"))
+#   run_experiments(configs, "part a results.jsonl", workers=4, threads_per_job=2)
+#
+# Every record has the settings, the model size, status, objective, bound,
+# MIP gap, the full resolution cost (plan_evaluation.py), how long each phase
+# took and how the incumbent and bound moved during the solve (solve_progress.py).
+# Runs already in the file are skipped, so a sweep that was stopped carries on
+# where it was. With one worker the runs share the loaded data and
+# each starts from the last plan of the same aggregation (see warm_start.py),
+# with more they go over a process pool and each worker loads the data once.
+# =============================================================================
+
+# the model is stochastic (StochasticFinal.py) when a config has scenarios, otherwise it's part a
+DETERMINISTIC_OPTIONS = dict(stock_ratio=1, exact_stock=False)
+STOCHASTIC_OPTIONS = dict(stock_ratio=.8, exact_stock=True, supply_only_open=True)
+
+# Cost in pounds per mile and tonne transported (variable cost)
+#   1 = 18t trucks, 2 = 7.5t lorries, 3 = 3.5t vans
+VehicleCostPerMileAndTonneOverall = {
+    1: 0.185,
+    2: 0.720,
+    3: 0.857
+}
+
+
+@dataclass
+class SweepData:
+    """What every run of the sweep needs whatever its sizes, loaded once and kept between runs"""
+    Candidates_df: pd.DataFrame
+    Suppliers_df: pd.DataFrame
+    Demand_df: pd.DataFrame
+    data: object
+    Operating_costs_df: object
+    nbPeriods: int
+    nbScenarios: int
+    CostSupplierCandidate: np.ndarray   # every supplier x every candidate
+    CostCandidateCustomers: np.ndarray  # every candidate x every district
+
+
+def load_sweep_data(data_dir="CaseStudyDataPY"):
+    (
+        PostcodeDistricts_df, Candidates_df, Suppliers_df,
+        Demand_df, data,
+        Operating_costs_df, DistanceSupplierDistrict_df, DistanceDistrictDistrict_df,
+        nbPeriods, nbScenarios
+    ) = get_all_data(data_dir)
+
+    # both are built as arrays in one go (see cost_matrices.py), every candidate x every district,
+    # each run just takes the rows and columns of its own candidates and customers
+    CostSupplierCandidate, CostCandidateCustomers = get_cost_matrices(
+        DistanceSupplierDistrict_df, DistanceDistrictDistrict_df, Suppliers_df,
+        VehicleCostPerMileAndTonneOverall,
+        suppliers=Suppliers_df.index, candidates=Candidates_df.index, customers=Candidates_df.index,
+    )
+
+    return SweepData(
+        Candidates_df, Suppliers_df, Demand_df, data, Operating_costs_df, nbPeriods, nbScenarios,
+        CostSupplierCandidate, CostCandidateCustomers,
+    )
+
+
+@dataclass(frozen=True)
+class RunConfig:
+    """
+    One run of the sweep.
+
+    :param aggregation: how the candidates are picked, a calcClusters method ("ward", "kmeans",
+        "minibatch", "grid") or "subprob" for the p-median subproblem. Customers are always
+        clustered, with "ward" for subprob
+    :param scenarios: keep this many scenarios (scenario_reduction.py) and solve the stochastic
+        model, None solves the deterministic part a model on the average demand
+    :param gap: stop once the MIP gap is below this
+    :param time_limit: seconds for the solve
+    :param nearest_k: only let each customer be served from its nearest_k closest candidates
+        (widened if that's infeasible, see pruning.solve_with_pruning), None keeps every pair
+    :param nearest_suppliers: only let each warehouse get each product from its nearest_suppliers
+        cheapest suppliers (see pruning.cheapest_supplier_mask), None keeps every supplier
+    """
+    num_warehouses: int
+    num_customers: int
+    aggregation: str = "ward"
+    scenarios: int = None
+    gap: float = .1
+    time_limit: float = 15 * 60
+    solver: str = "xpress"
+    nearest_k: int = None
+    nearest_suppliers: int = None
+
+    @property
+    def key(self):
+        """what a run is known by in the results file"""
+        return json.dumps(asdict(self), sort_keys=True)
+
+
+def config_grid(num_warehouses, num_customers, aggregation=("ward",), scenarios=(None,), gap=(.1,),
+                time_limit=(15 * 60,), solver=("xpress",), nearest_k=(None,), nearest_suppliers=(None,)):
+    """every combination of the given values, smallest number of warehouses first"""
+    return [
+        RunConfig(w, c, a, s, g, t, sol, k, n)
+        for a, c, s, g, t, sol, k, n, w in itertools.product(
+            aggregation, num_customers, scenarios, gap, time_limit, solver, nearest_k, nearest_suppliers,
+            num_warehouses
+        )
+    ]
+
+
+def run_config(config:RunConfig, sweep_data:SweepData, threads=None, previous_plan=None, verbose=True):
+    """
+    Cluster, build, warm start, solve and evaluate one configuration.
+
+    :param previous_plan: (candidate ids, candidate x period y) of an earlier run, moved onto this
+        run's candidates to start from if it's cheaper than the heuristic
+    :return: the record of the run and (candidate ids, y) of the best plan found
+    """
+    # every phase is a span of this run's own profiler, the solver's spans (load model, optimise,
+    # get solution) and those of the data functions nest inside them
+    with profiling() as prof:
+        record, plan = _run_phases(config, sweep_data, threads, previous_plan, verbose)
+    timings = {row["name"]: row["wall"] for row in prof.summary() if row["depth"] == 0}
+    record.update(timings=timings, total_time=sum(timings.values()), peak_rss=peak_rss(), spans=prof.summary())
+    return record, plan
+
+
+def _run_phases(config:RunConfig, sweep_data:SweepData, threads, previous_plan, verbose):
+    """run_config without the profiler, each phase is a span"""
+    Candidates_df, Suppliers_df, Demand_df = sweep_data.Candidates_df, sweep_data.Suppliers_df, sweep_data.Demand_df
+    data, Operating_costs_df = sweep_data.data, sweep_data.Operating_costs_df
+    CostSupplierCandidate, CostCandidateCustomers = sweep_data.CostSupplierCandidate, sweep_data.CostCandidateCustomers
+    lap = laps()
+    lap("aggregate")
+    # customers are clustered and get the summed demand, candidates are cluster centres or the p-median
+    cluster_method = "ward" if config.aggregation == "subprob" else config.aggregation
+    _, reduced_Customers_df, _, cluster_data = calcClusters(
+        Demand_df, Candidates_df, data, num_clusters=config.num_customers, method=cluster_method
+    )
+    Customers = reduced_Customers_df.index
+    if config.aggregation == "subprob":
+        Candidates = pd.Index(aggregate_warehouses_subproblem(
+            config.num_warehouses, Candidates_df.index, Customers,
+            CostCandidateCustomers[:, Candidates_df.index.get_indexer(Customers)], backend=config.solver
+        ))
+    else:
+        _, reduced_Candidates_df, _, _ = calcClusters(
+            Demand_df, Candidates_df, data, num_clusters=config.num_warehouses, method=config.aggregation
+        )
+        Candidates = reduced_Candidates_df.index
+
+    lap("costs")
+    Suppliers = Suppliers_df.index
+    Times = range(1, sweep_data.nbPeriods + 1)
+    Products = (1,2,3,4) #hardcoding
+    cand_pos = Candidates_df.index.get_indexer(Candidates)
+    CostSupplierCandidate_arr = CostSupplierCandidate[:, cand_pos]
+    CostCandidateCustomers_arr = CostCandidateCustomers[cand_pos][:, Candidates_df.index.get_indexer(Customers)]
+    cust_pos = cluster_data.customer_positions(Customers)
+    if config.scenarios is None:
+        Scenarios, demand, probs = None, cluster_data.demand_periods[cust_pos], None
+        options = DETERMINISTIC_OPTIONS
+    else:
+        keep, probs = reduce_scenarios(cluster_data.demand_scenarios[cust_pos], config.scenarios)
+        Scenarios, demand = cluster_data.scenarios[keep], cluster_data.demand_scenarios[cust_pos][..., keep]
+        options = STOCHASTIC_OPTIONS
+    instance = make_instance(
+        Candidates, Customers, Suppliers, Products, Times, Scenarios, demand,
+        CostSupplierCandidate_arr, CostCandidateCustomers_arr,
+        Candidates_df, Suppliers_df, Operating_costs_df, scenario_probs=probs,
+    )
+
+    backend = make_backend(config.solver, time_limit=config.time_limit, rel_gap=config.gap, threads=threads)
+    supply_mask = None
+    if config.nearest_suppliers is not None:
+        supply_mask = cheapest_supplier_mask(instance, n=config.nearest_suppliers,
+                                             stock_ratio=options["stock_ratio"], verbose=verbose)
+
+    def build_and_solve(assign_mask):
+        lap("build")
+        model = build_mecwlp(instance, **options, assign_mask=assign_mask, supply_mask=supply_mask,
+                             name="Assignment 1")
+
+        lap("warm_start")
+        start_sol, start_obj = heuristic_start(model, backend, verbose=verbose)
+        if previous_plan is not None:
+            prev_candidates, prev_y = previous_plan
+            mapped_y = map_plan(prev_y, grid_coords(Candidates_df, prev_candidates),
+                                grid_coords(Candidates_df, Candidates))
+            mapped_sol, mapped_obj = plan_start(model, mapped_y, backend)
+            if mapped_obj < start_obj:
+                start_sol, start_obj = mapped_sol, mapped_obj
+
+        lap("solve")
+        if verbose:
+            print(f"Solving a problem with {model.matrix.size()} using {config.solver}")
+        # nothing worse than the start is any use, a little over so the start itself isn't cut off
+        cutoff = start_obj * (1 + 1e-6) if start_sol is not None else None
+        result = backend.solve(model.matrix, mip_start=start_sol, cutoff=cutoff)
+        # with a start the model can't be infeasible, only nothing beats the cutoff
+        return (model, result, start_sol, start_obj), result.status == INFEASIBLE and start_sol is None
+
+    if config.nearest_k is None:
+        (model, result, start_sol, start_obj), _ = build_and_solve(None)
+    else:
+        # customers are districts too, so they have candidate coordinates
+        (model, result, start_sol, start_obj), _ = solve_with_pruning(
+            build_and_solve, grid_coords(Candidates_df, Customers), grid_coords(Candidates_df, Candidates),
+            k=config.nearest_k
+        )
+
+    lap("evaluate")
+    # the objective is over cluster centres so it can't be compared between sizes,
+    # what the plan costs with every district (and every scenario) can be
+    full_cost = np.nan
+    best_sol = result.x if result.has_solution else start_sol
+    plan = None if best_sol is None else (Candidates, model.y_values(best_sol))
+    if result.has_solution:
+        full_demand = data.demand_periods if config.scenarios is None else data.demand_scenarios
+        full_instance = make_instance(
+            Candidates, data.customers, Suppliers, Products, Times, None, full_demand,
+            CostSupplierCandidate_arr,
+            CostCandidateCustomers[cand_pos][:, Candidates_df.index.get_indexer(data.customers)],
+            Candidates_df, Suppliers_df, Operating_costs_df,
+        )
+        full_cost = evaluate_plan_full(
+            full_instance, model.y_values(result.x),
+            stock_ratio=options["stock_ratio"], exact_stock=options["exact_stock"], backend=backend
+        ).total
+    lap.end()
+
+    record = dict(
+        asdict(config),
+        status=result.status,
+        objval=result.objval if result.has_solution else None,
+        bestbound=result.bestbound if np.isfinite(result.bestbound) else None,
+        mip_gap=result.mip_gap if result.has_solution and np.isfinite(result.mip_gap) else None,
+        full_cost=full_cost if np.isfinite(full_cost) else None,
+        start_objval=start_obj if np.isfinite(start_obj) else None,
+        open_warehouses=None if plan is None else int(plan[1][:, -1].sum()),
+        rows=model.matrix.n_rows,
+        cols=model.matrix.n_cols,
+        nonzeros=int(model.matrix.A.nnz),
+        threads=threads,
+        **{k: v if np.isfinite(v) else None for k, v in progress_summary(result.progress).items()},
+        progress=progress_records(result.progress),
+    )
+    return record, plan
+
+
+def error_record(config:RunConfig, e:Exception):
+    return dict(asdict(config), status="error", error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+
+
+# ---------------------------------------------------------------------------
+# worker process side, every worker loads the data once and keeps it
+# ---------------------------------------------------------------------------
+_worker = {}
+
+
+def _init_worker(data_dir):
+    _worker["sweep_data"] = load_sweep_data(data_dir)
+
+
+def _worker_run(config, threads):
+    try:
+        return run_config(config, _worker["sweep_data"], threads, verbose=False)[0]
+    except Exception as e:
+        return error_record(config, e)
+
+
+def load_records(results_path):
+    """every record in the JSON lines file ``results_path``, skipping a half written last line"""
+    path = Path(results_path)
+    if not path.exists():
+        return []
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def completed_keys(results_path):
+    """keys of the configs that already have a result, the ones that errored get run again"""
+    return {
+        # settings added since a record was written take their defaults
+        RunConfig(**{name: r[name] for name in RunConfig.__dataclass_fields__ if name in r}).key
+        for r in load_records(results_path) if r.get("status") != "error"
+    }
+
+
+def append_record(results_path, record):
+    line = json.dumps(record, default=float) + "\n"
+    with open(results_path, "ab+") as f:
+        # a sweep killed mid write leaves a line with no newline, start after it instead of on it
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = "\n" + line
+        f.write(line.encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def summary_line(record):
+    if record["status"] == "error":
+        return f"W{record['num_warehouses']} C{record['num_customers']} {record['aggregation']}: {record['error']}"
+    objval = "-" if record["objval"] is None else f"{record['objval']:,.0f}"
+    gap = "-" if record["mip_gap"] is None else f"{record['mip_gap']*100:.1f}%"
+    return (f"W{record['num_warehouses']} C{record['num_customers']} {record['aggregation']} "
+            f"S{record['scenarios']}: {record['status']} {objval} gap {gap} "
+            f"in {pretty_print_seconds(record['total_time'])}")
+
+
+# after this many dead workers the unfinished runs go one at a time, to find the one that kills them
+PARALLEL_CRASHES = 2
+
+
+def run_experiments(configs, results_path, workers=1, threads_per_job=None, data_dir="CaseStudyDataPY",
+                    chain_plans=True):
+    """
+    Run every config that isn't in ``results_path`` yet and append a JSON line for each as it finishes.
+
+    :param workers: run this many configs at once, each in its own process
+    :param threads_per_job: solver threads for each run, defaults to sharing the cpus between the workers
+    :param chain_plans: with one worker, start each run from the best plan of the previous run with
+        the same aggregation, customers and scenarios
+    :return: the records of the runs done now
+    """
+    done = completed_keys(results_path)
+    todo = [config for config in configs if config.key not in done]
+    print(f"{len(configs) - len(todo)} of {len(configs)} runs already in {results_path}, {len(todo)} to go")
+    if threads_per_job is None:
+        threads_per_job = max(1, (os.cpu_count() or 1) // max(1, workers))
+
+    start = perf_counter()
+    records = []
+    if workers <= 1:
+        sweep_data = load_sweep_data(data_dir)
+        previous_plans = {}
+        for config in todo:
+            chain = (config.aggregation, config.num_customers, config.scenarios)
+            try:
+                record, plan = run_config(config, sweep_data, threads_per_job,
+                                          previous_plans.get(chain) if chain_plans else None)
+                if plan is not None:
+                    previous_plans[chain] = plan
+            except Exception as e:
+                record = error_record(config, e)
+            append_record(results_path, record)
+            records.append(record)
+            print(summary_line(record))
+    else:
+        # on windows the script calling this needs to be behind if __name__ == "__main__":
+        pending, crashes = todo, 0
+        while pending:
+            # a dead worker (out of memory, a solver crash) takes every unfinished run in the pool down
+            # with it, so it can't be told which run did it. The unfinished runs go again in a new pool,
+            # and after PARALLEL_CRASHES they go one at a time, each in its own process, where a crash
+            # is that run's and gets an error record
+            isolate = crashes >= PARALLEL_CRASHES
+            crashed = []
+            for batch in ([[config] for config in pending] if isolate else [pending]):
+                with ProcessPoolExecutor(max_workers=1 if isolate else workers, initializer=_init_worker,
+                                         initargs=(data_dir,)) as pool:
+                    futures = {pool.submit(_worker_run, config, threads_per_job): config for config in batch}
+                    for future in as_completed(futures):
+                        config = futures[future]
+                        try:
+                            record = future.result()
+                        except BrokenProcessPool as e:
+                            if not isolate:
+                                crashed.append(config)
+                                continue
+                            record = error_record(config, e)
+                        except Exception as e:
+                            record = error_record(config, e)
+                        append_record(results_path, record)
+                        records.append(record)
+                        print(summary_line(record))
+            if crashed:
+                crashes += 1
+                print(f"a worker died, running the {len(crashed)} unfinished runs again"
+                      f"{' one at a time' if crashes >= PARALLEL_CRASHES else ''}")
+            pending = crashed
+
+    print(f"{len(records)} runs took {pretty_print_seconds(perf_counter() - start)}")
+    return records
+
+
+def results_frame(results_path):
+    """the results file as a data frame, the phase timings as columns timing_<phase>"""
+    df = pd.json_normalize(load_records(results_path))
+    return df.rename(columns=lambda c: c.replace("timings.", "timing_"))
+
+
+def progress_frame(results_path):
+    """one row per progress point of every run, with the settings of the run, for plotting the gap over time"""
+    frames = []
+    for r in load_records(results_path):
+        if r.get("progress"):
+            points = pd.DataFrame(r["progress"])
+            for name in RunConfig.__dataclass_fields__:
+                points[name] = r.get(name)
+            frames.append(points)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
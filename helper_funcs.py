@@ -1,9 +1,17 @@
-import xpress as xp
 import folium, pyproj
 import pandas as pd
 import geopandas as gpd
 import numpy as np
+import hashlib, os, pickle
+from pathlib import Path
 from pyproj import Transformer
+from problem_data import build_problem_data
+from solver_backends import SolveResult, xpress_result, OPTIMAL, INFEASIBLE, UNBOUNDED
+from instrumentation import span, traced
+from solve_progress import time_to_first_solution, time_to_gap
+
+# bump this whenever get_all_data changes what it returns so old caches get ignored
+DATA_CACHE_VERSION = 3
 
 
 def pretty_print_seconds(secs):
@@ -61,7 +69,8 @@ def put_solution_on_map(probs, xs, ys, zs, cand_gdf:gpd.GeoDataFrame, cust_gdf,
 
     #show the suppliers
     for k in supp_gdf.index:
-        if max(zs[k,j,t,p] for p in product_index for j in cand_gdf.index):
+        # z only exists for the product group a supplier carries
+        if max(zs.get((k,j,t,p), 0) for p in product_index for j in cand_gdf.index):
 
             supp = supp_gdf.loc[k]
             supp_loc = supp["lat"], supp["lon"]
@@ -142,29 +151,85 @@ def put_solution_on_map(probs, xs, ys, zs, cand_gdf:gpd.GeoDataFrame, cust_gdf,
 
 
 def print_sol_status(solved_prob):
-    sol_status = solved_prob.attributes.solstatus
+    """works on a solver_backends.SolveResult or a solved xpress problem"""
+    result = solved_prob if isinstance(solved_prob, SolveResult) else xpress_result(solved_prob)
 
-    if sol_status in( xp.SolStatus.OPTIMAL, xp.SolStatus.FEASIBLE):
-        if sol_status ==  xp.SolStatus.OPTIMAL:
+    if result.has_solution:
+        if result.status == OPTIMAL:
             print("Optimal solution found")
         else:
             print("Feasible solution (not proven optimal)")
         
-        best_obj = solved_prob.attributes.objval
-        best_bound = solved_prob.attributes.bestbound
-        mip_gap = abs(best_obj - best_bound) / (1e-10 +abs(best_obj))
-        print(f"Objval: {best_obj:,.0f}\t MIP Gap: {mip_gap*100:.2f}%")
+        print(f"Objval: {result.objval:,.0f}\t MIP Gap: {result.mip_gap*100:.2f}%")
+        if result.progress:
+            first, five = time_to_first_solution(result.progress), time_to_gap(result.progress, .05)
+            print((f"first solution after {first:.1f}secs, " if np.isfinite(first) else "no solution from the solver itself, ")
+                  + (f"gap under 5% after {five:.1f}secs" if np.isfinite(five) else "gap never under 5%"))
         
 
 
-    elif sol_status == xp.SolStatus.INFEASIBLE:
+    elif result.status == INFEASIBLE:
         print("Model is infeasible")
-    elif sol_status == xp.SolStatus.UNBOUNDED:
+    elif result.status == UNBOUNDED:
         print("Model is unbounded")
     else:
         print("No solution available")
 
-def get_all_data(data_dir="CaseStudyDataPY"):
+def data_dir_fingerprint(data_dir="CaseStudyDataPY"):
+    """
+    Short hash of the name, size and modification time of every csv in ``data_dir``.
+    Touching or replacing any of the data files changes the fingerprint.
+    """
+    h = hashlib.sha1(f"v{DATA_CACHE_VERSION}".encode())
+    for path in sorted(Path(data_dir).glob("*.csv")):
+        stat = path.stat()
+        h.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return h.hexdigest()[:16]
+
+
+@traced()
+def get_all_data(data_dir="CaseStudyDataPY", use_cache=True, cache_dir=None):
+    """
+    Load every data file for the case study.
+
+    The parsed result is pickled (protocol 5) to ``cache_dir`` (default ``data_dir/.cache``)
+    under the fingerprint of the csv files, so later calls skip the csv parsing and the
+    coordinate transforms entirely. Changing any csv gives a new fingerprint and forces a rebuild.
+
+    :param use_cache: set to False to always read the csvs (and leave the cache alone)
+    """
+    if not use_cache:
+        return read_all_data(data_dir)
+
+    cache_dir = Path(data_dir) / ".cache" if cache_dir is None else Path(cache_dir)
+    cache_file = cache_dir / f"all_data_{data_dir_fingerprint(data_dir)}.pkl"
+
+    if cache_file.exists():
+        try:
+            with span("load cache"), open(cache_file, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            # half written or from an incompatible pandas version, just rebuild it
+            print(f"ignoring unreadable data cache {cache_file}: {e}")
+
+    data = read_all_data(data_dir)
+
+    with span("write cache"):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for stale in cache_dir.glob("all_data_*.pkl"):
+            stale.unlink(missing_ok=True)
+        # write then rename so parallel runs never see a partial file
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            pickle.dump(data, f, protocol=5)
+        os.replace(tmp_file, cache_file)
+
+    return data
+
+
+@traced()
+def read_all_data(data_dir="CaseStudyDataPY"):
+    """Parse the csvs in ``data_dir``, see ``get_all_data`` for the cached version"""
     #for converting coords
     transformer = Transformer.from_crs(
         "EPSG:27700",
@@ -172,25 +237,26 @@ def get_all_data(data_dir="CaseStudyDataPY"):
         always_xy=True
     )
 
-    Suppliers_df = pd.read_csv(f"{data_dir}/Suppliers.csv", index_col=0)
-    Suppliers_df["lon"], Suppliers_df["lat"] = transformer.transform(
-        Suppliers_df["X (Easting)"].values,
-        Suppliers_df["Y (Northing)"].values
-    )
+    with span("read locations"):
+        Suppliers_df = pd.read_csv(f"{data_dir}/Suppliers.csv", index_col=0)
+        Suppliers_df["lon"], Suppliers_df["lat"] = transformer.transform(
+            Suppliers_df["X (Easting)"].values,
+            Suppliers_df["Y (Northing)"].values
+        )
 
-    PostcodeDistricts_df = pd.read_csv(f"{data_dir}/PostcodeDistricts.csv", index_col=0)
+        PostcodeDistricts_df = pd.read_csv(f"{data_dir}/PostcodeDistricts.csv", index_col=0)
 
-    PostcodeDistricts_df["lon"], PostcodeDistricts_df["lat"] = transformer.transform(
-        PostcodeDistricts_df["X (Easting)"].values,
-        PostcodeDistricts_df["Y (Northing)"].values
-    )
+        PostcodeDistricts_df["lon"], PostcodeDistricts_df["lat"] = transformer.transform(
+            PostcodeDistricts_df["X (Easting)"].values,
+            PostcodeDistricts_df["Y (Northing)"].values
+        )
 
-    Candidates_df = pd.read_csv(f"{data_dir}/Candidates.csv", index_col=0)
+        Candidates_df = pd.read_csv(f"{data_dir}/Candidates.csv", index_col=0)
 
-    Candidates_df["lon"], Candidates_df["lat"] = transformer.transform(
-        Candidates_df["X (Easting)"].values,
-        Candidates_df["Y (Northing)"].values
-    )
+        Candidates_df["lon"], Candidates_df["lat"] = transformer.transform(
+            Candidates_df["X (Easting)"].values,
+            Candidates_df["Y (Northing)"].values
+        )
 
 
     # -----------------------------------------------------------------------------
@@ -199,52 +265,42 @@ def get_all_data(data_dir="CaseStudyDataPY"):
     # District → District distances
     # Column names are converted from strings to integers for correct .loc indexing
     # -----------------------------------------------------------------------------
-    DistanceSupplierDistrict_df = pd.read_csv(
-        f"{data_dir}/Distance Supplier-District.csv", index_col=0
-    )
-    DistanceSupplierDistrict_df.columns = DistanceSupplierDistrict_df.columns.astype(int)
+    with span("read distance matrices"):
+        DistanceSupplierDistrict_df = pd.read_csv(
+            f"{data_dir}/Distance Supplier-District.csv", index_col=0
+        )
+        DistanceSupplierDistrict_df.columns = DistanceSupplierDistrict_df.columns.astype(int)
 
-    DistanceDistrictDistrict_df = pd.read_csv(
-        f"{data_dir}/Distance District-District.csv", index_col=0
-    )
-    DistanceDistrictDistrict_df.columns = DistanceDistrictDistrict_df.columns.astype(int)
+        DistanceDistrictDistrict_df = pd.read_csv(
+            f"{data_dir}/Distance District-District.csv", index_col=0
+        )
+        DistanceDistrictDistrict_df.columns = DistanceDistrictDistrict_df.columns.astype(int)
 
 
     # -----------------------------------------------------------------------------
     # Read aggregate demand data (no time dimension)
     # Creates a dictionary keyed by (Customer, Product)
     # -----------------------------------------------------------------------------
-    Demand_df = pd.read_csv(f"{data_dir}/Demand.csv")
-    Operating_costs_df = pd.read_csv(f"{data_dir}/Operating.csv", index_col=0)["Operating cost"].to_dict()
+    with span("read demand"):
+        Demand_df = pd.read_csv(f"{data_dir}/Demand.csv")
+        Operating_costs_df = pd.read_csv(f"{data_dir}/Operating.csv", index_col=0)["Operating cost"].to_dict()
 
     # -----------------------------------------------------------------------------
-    # Read demand data with time periods
-    # Creates a dictionary keyed by (Customer, Product, Period)
+    # Read demand data with time periods, and with time periods and scenarios
+    # Both go into dense arrays customer x product x period (x scenario), see ProblemData
     # -----------------------------------------------------------------------------
-    DemandPeriods_df = pd.read_csv(f"{data_dir}/DemandPeriods.csv")
-    nbPeriods = DemandPeriods_df["Period"].max()
-    DemandPeriods_df = (
-        DemandPeriods_df
-            .set_index(["Customer", "Product", "Period"])["Demand"]
-            .to_dict()
-    )
-
+    with span("read demand periods"):
+        DemandPeriods_df = pd.read_csv(f"{data_dir}/DemandPeriods.csv")
+        DemandPeriodsScenarios_df = pd.read_csv(f"{data_dir}/DemandPeriodScenarios.csv")
 
-    # -----------------------------------------------------------------------------
-    # Read demand data with time periods and scenarios
-    # Creates a dictionary keyed by (Customer, Product, Period, Scenario)
-    # -----------------------------------------------------------------------------
-    DemandPeriodsScenarios_df = pd.read_csv(f"{data_dir}/DemandPeriodScenarios.csv")
-    nbScenarios = DemandPeriodsScenarios_df["Scenario"].max()
-    DemandPeriodsScenarios_df = (
-        DemandPeriodsScenarios_df
-            .set_index(["Customer", "Product", "Period", "Scenario"])["Demand"]
-            .to_dict()
-    )
+    with span("build problem data"):
+        data = build_problem_data(Candidates_df, Suppliers_df, DemandPeriods_df, DemandPeriodsScenarios_df)
+    nbPeriods = data.nbPeriods
+    nbScenarios = data.nbScenarios
 
     return (
         PostcodeDistricts_df, Candidates_df, Suppliers_df,
-        Demand_df, DemandPeriods_df, DemandPeriodsScenarios_df,
+        Demand_df, data,
         Operating_costs_df, DistanceSupplierDistrict_df, DistanceDistrictDistrict_df,
         nbPeriods, nbScenarios
-    )
\ No newline at end of file
+    )
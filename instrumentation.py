@@ -0,0 +1,307 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict, replace
+from pathlib import Path
+
+# getrusage is unix only, on windows there's just no peak RSS
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# =============================================================================
+# Timing and memory of each stage of the pipeline.
+#
+# Stages are wrapped in spans, which do nothing unless a Profiler is active:
+#
+#   with profiling(trace_memory=True) as prof:
+#       ... get_all_data, calcClusters, build_mecwlp, backend.solve ...
+#   print(prof.report())
+#   prof.save_chrome_trace("trace.json")   # open in chrome://tracing or ui.perfetto.dev
+#
+# Every span records its wall time, CPU time (this process), how far it pushed
+# up the peak RSS of the process and, with trace_memory, the peak of python
+# allocations (tracemalloc) while it ran. Spans nest, the report adds up the
+# spans with the same path.
+# =============================================================================
+
+MB = 1024 ** 2
+
+
+def peak_rss():
+    """highest resident set size of this process so far in bytes, None where that isn't available"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass
+class Span:
+    """One finished span, times in seconds from the start of the profiler, memory in bytes"""
+    name: str
+    path: str
+    depth: int
+    start: float
+    wall: float
+    cpu: float
+    rss_peak: int = None       # peak RSS of the process when the span ended
+    rss_growth: int = None     # how much the span raised the peak RSS
+    traced_peak: int = None    # peak python allocations during the span, while tracemalloc runs
+    args: dict = field(default_factory=dict)
+    thread: int = 0
+
+
+@dataclass
+class _Frame:
+    """a span that is still running"""
+    path: str
+    args: dict
+    traced_peak: int = 0
+
+
+class Profiler:
+    """
+    Collects spans. Use it through ``profiling()``, or ``activate()`` / ``deactivate()``.
+
+    :param trace_memory: also run tracemalloc for the peak python allocations of every span,
+        this slows allocation heavy code down noticeably
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.spans = []
+        self._origin = time.perf_counter()
+        self._stack = threading.local()
+        self._started_tracemalloc = False
+        self._previous = None
+
+    def activate(self):
+        """spans go here from now on, until deactivate() hands them back to the profiler before"""
+        global _active
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._previous = _active
+        _active = self
+        return self
+
+    def deactivate(self):
+        """stop collecting, the spans are also passed on to the profiler that was active before (if any)"""
+        global _active
+        if _active is self:
+            _active = self._previous
+        if self._previous is not None:
+            self._previous.adopt(self.spans, self._origin)
+        self._previous = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _open(self):
+        if not hasattr(self._stack, "frames"):
+            self._stack.frames = []
+        return self._stack.frames
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Time the block. It gets the span's args dict, anything put in there is kept with the span,
+        e.g. ``args["cache"] = "hit"``
+        """
+        frames = self._open()
+        parent = frames[-1] if frames else None
+        path = name if parent is None else f"{parent.path}/{name}"
+        frame = _Frame(path, dict(args))
+        if tracemalloc.is_tracing():
+            # the parent keeps the peak it had so far, this span starts its own
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        depth = len(frames)
+        frames.append(frame)
+
+        rss_before = peak_rss()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield frame.args
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            rss_after = peak_rss()
+            # a laps() span that never got to end() (the code raised) is already off the stack,
+            # the span around it took it off when it ended
+            if len(frames) > depth and frames[depth] is frame:
+                del frames[depth:]
+                self._record(name, path, depth, frame, parent, wall_start, wall, cpu, rss_before, rss_after)
+
+    def _record(self, name, path, depth, frame, parent, wall_start, wall, cpu, rss_before, rss_after):
+        traced = None
+        if tracemalloc.is_tracing():
+            traced = max(frame.traced_peak, tracemalloc.get_traced_memory()[1])
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak, traced)
+        self.spans.append(Span(
+            name=name,
+            path=path,
+            depth=depth,
+            start=wall_start - self._origin,
+            wall=wall,
+            cpu=cpu,
+            rss_peak=rss_after,
+            rss_growth=None if rss_before is None else rss_after - rss_before,
+            traced_peak=traced,
+            args=frame.args,
+            thread=threading.get_ident(),
+        ))
+
+    def adopt(self, spans, origin):
+        """
+        Take the spans of another profiler (started at perf_counter ``origin``) as if they had been
+        made in the span this thread has open, so a profiler inside a profiled block adds to it
+        """
+        frames = self._open()
+        parent = frames[-1].path + "/" if frames else ""
+        depth = len(frames)
+        for s in spans:
+            self.spans.append(replace(
+                s, path=parent + s.path, depth=s.depth + depth, start=s.start + origin - self._origin
+            ))
+
+    def summary(self):
+        """
+        One row per span path in the order they were first started: calls, total wall and CPU
+        seconds, and the largest memory figures of any of its calls
+        """
+        rows = {}
+        for s in sorted(self.spans, key=lambda s: s.start):
+            row = rows.setdefault(s.path, dict(
+                path=s.path, name=s.name, depth=s.depth, calls=0, wall=0.0, cpu=0.0,
+                rss_peak=None, rss_growth=None, traced_peak=None,
+            ))
+            row["calls"] += 1
+            row["wall"] += s.wall
+            row["cpu"] += s.cpu
+            for key in ("rss_peak", "rss_growth", "traced_peak"):
+                value = getattr(s, key)
+                if value is not None:
+                    row[key] = value if row[key] is None else max(row[key], value)
+        return list(rows.values())
+
+    def report(self):
+        """the summary as a table"""
+        def mb(value):
+            return f"{value / MB:>9.1f}" if value is not None else f"{'-':>9}"
+
+        lines = [f"{'stage':<44}{'calls':>6}{'wall s':>10}{'cpu s':>10}{'rss MB':>9}{'+rss MB':>9}{'py MB':>9}"]
+        for row in self.summary():
+            label = "  " * row["depth"] + row["name"]
+            lines.append(
+                f"{label[:44]:<44}{row['calls']:>6}{row['wall']:>10.3f}{row['cpu']:>10.3f}"
+                f"{mb(row['rss_peak'])}{mb(row['rss_growth'])}{mb(row['traced_peak'])}"
+            )
+        return "\n".join(lines)
+
+    def records(self):
+        """every span as a dict, for saving with the results of a run"""
+        return [asdict(s) for s in self.spans]
+
+    def save_json(self, path):
+        Path(path).write_text(json.dumps({"spans": self.records(), "summary": self.summary()}, default=str, indent=1))
+
+    def save_chrome_trace(self, path):
+        """Chrome trace event json, open it in chrome://tracing or https://ui.perfetto.dev"""
+        pid = os.getpid()
+        events = []
+        for s in self.spans:
+            events.append({
+                "name": s.name, "cat": s.path.split("/")[0], "ph": "X", "pid": pid, "tid": s.thread,
+                "ts": s.start * 1e6, "dur": s.wall * 1e6,
+                "args": {"cpu_s": s.cpu, "rss_peak_mb": None if s.rss_peak is None else s.rss_peak / MB,
+                         "traced_peak_mb": None if s.traced_peak is None else s.traced_peak / MB,
+                         **{k: str(v) for k, v in s.args.items()}},
+            })
+        Path(path).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+# the profiler spans go to, None when nothing is being measured
+_active = None
+
+
+def active_profiler():
+    return _active
+
+
+def span(name, **args):
+    """``with span("build"):`` time the block if a profiler is active, otherwise do nothing"""
+    if _active is None:
+        return nullcontext({})
+    return _active.span(name, **args)
+
+
+class laps:
+    """
+    Spans one after the other, without indenting the code they time:
+
+        lap = laps()
+        lap("variables")     # starts the span "variables"
+        ...
+        lap("constraints")   # ends "variables", starts "constraints"
+        ...
+        lap.end()
+
+    If the code raises before end() the open span is dropped when the span around it ends.
+    """
+
+    def __init__(self):
+        self._open = None
+
+    def __call__(self, name, **args):
+        self.end()
+        self._open = span(name, **args)
+        return self._open.__enter__()
+
+    def end(self):
+        if self._open is not None:
+            open_span, self._open = self._open, None
+            open_span.__exit__(None, None, None)
+
+
+def traced(name=None):
+    """decorator, the whole function is one span (named after the function by default)"""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def profiling(trace_memory=False, report=False, chrome_trace=None):
+    """
+    Measure every span in the block.
+
+    :param report: print the report at the end
+    :param chrome_trace: also write a Chrome trace to this file at the end
+    """
+    prof = Profiler(trace_memory).activate()
+    try:
+        yield prof
+    finally:
+        prof.deactivate()
+        if report:
+            print(prof.report())
+        if chrome_trace is not None:
+            prof.save_chrome_trace(chrome_trace)
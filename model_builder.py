@@ -0,0 +1,366 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from dataclasses import dataclass, field
+from instrumentation import laps, traced
+
+# =============================================================================
+# Builds the MECWLP straight into arrays (objective, bounds, types and a CSR
+# constraint matrix) and hands them to the solver in one bulk load, instead of
+# one addVariable / one xp expression per variable and constraint.
+# Solving is done by one of the backends in solver_backends.py.
+# =============================================================================
+
+INF = np.inf
+
+
+@dataclass
+class MatrixModel:
+    """
+    A (mixed integer) linear program held as arrays
+
+        minimise    c @ v
+        subject to  row_lb <= A @ v <= row_ub
+                    col_lb <=   v   <= col_ub,  v[integrality] integer
+
+    ``A`` is a scipy CSR array, missing bounds are +-np.inf.
+    """
+    name: str
+    c: np.ndarray
+    A: sp.csr_array
+    row_lb: np.ndarray
+    row_ub: np.ndarray
+    col_lb: np.ndarray
+    col_ub: np.ndarray
+    integrality: np.ndarray
+
+    @property
+    def n_rows(self):
+        return self.A.shape[0]
+
+    @property
+    def n_cols(self):
+        return self.A.shape[1]
+
+    def size(self):
+        return f"{self.n_rows:,} rows and {self.n_cols:,} columns"
+
+
+class MatrixBuilder:
+    """Collects blocks of columns, rows and coefficients and stacks them into a MatrixModel at the end"""
+
+    def __init__(self):
+        self.n_cols = 0
+        self.n_rows = 0
+        self._c, self._col_lb, self._col_ub, self._integer = [], [], [], []
+        self._row_lb, self._row_ub = [], []
+        self._rows, self._cols, self._vals = [], [], []
+
+    def add_columns(self, shape, cost=0.0, lb=0.0, ub=INF, integer=False):
+        """add np.prod(shape) columns, returns their indices in an array of that shape"""
+        shape = np.atleast_1d(shape)
+        n = int(np.prod(shape))
+        self._c.append(np.broadcast_to(np.asarray(cost, dtype=np.float64), tuple(shape)).ravel())
+        self._col_lb.append(np.broadcast_to(np.asarray(lb, dtype=np.float64), tuple(shape)).ravel())
+        self._col_ub.append(np.broadcast_to(np.asarray(ub, dtype=np.float64), tuple(shape)).ravel())
+        self._integer.append(np.full(n, integer, dtype=bool))
+
+        cols = self.n_cols + np.arange(n).reshape(shape)
+        self.n_cols += n
+        return cols
+
+    def add_rows(self, shape, lb=-INF, ub=INF):
+        """add np.prod(shape) rows, returns their indices in an array of that shape"""
+        shape = np.atleast_1d(shape)
+        n = int(np.prod(shape))
+        self._row_lb.append(np.broadcast_to(np.asarray(lb, dtype=np.float64), tuple(shape)).ravel())
+        self._row_ub.append(np.broadcast_to(np.asarray(ub, dtype=np.float64), tuple(shape)).ravel())
+
+        rows = self.n_rows + np.arange(n).reshape(shape)
+        self.n_rows += n
+        return rows
+
+    def add_coefs(self, rows, cols, vals=1.0):
+        """A[rows, cols] += vals, the three are broadcast against each other"""
+        rows, cols, vals = np.broadcast_arrays(rows, cols, np.asarray(vals, dtype=np.float64))
+        self._rows.append(rows.ravel())
+        self._cols.append(cols.ravel())
+        self._vals.append(vals.ravel())
+
+    def build(self, name):
+        def stack(parts, dtype):
+            return np.concatenate(parts).astype(dtype, copy=False) if parts else np.zeros(0, dtype)
+
+        A = sp.coo_array(
+            (stack(self._vals, np.float64), (stack(self._rows, np.int64), stack(self._cols, np.int64))),
+            shape=(self.n_rows, self.n_cols)
+        ).tocsr()
+        A.sum_duplicates()
+
+        return MatrixModel(
+            name=name,
+            c=stack(self._c, np.float64),
+            A=A,
+            row_lb=stack(self._row_lb, np.float64),
+            row_ub=stack(self._row_ub, np.float64),
+            col_lb=stack(self._col_lb, np.float64),
+            col_ub=stack(self._col_ub, np.float64),
+            integrality=stack(self._integer, bool),
+        )
+
+
+@dataclass
+class MecwlpInstance:
+    """
+    Everything the MECWLP needs as plain arrays, in the order of the id arrays.
+
+    demand is customer x product x period x scenario (one scenario for the deterministic model),
+    costs are per kg like CostSupplierCandidate (supplier x candidate) and CostCandidateCustomers
+    (candidate x customer).
+    """
+    candidates: np.ndarray
+    customers: np.ndarray
+    suppliers: np.ndarray
+    products: np.ndarray
+    periods: np.ndarray
+    scenarios: np.ndarray
+    demand: np.ndarray
+    cost_supplier_candidate: np.ndarray
+    cost_candidate_customer: np.ndarray
+    supplier_capacity: np.ndarray
+    supplier_product: np.ndarray
+    candidate_capacity: np.ndarray
+    setup_cost: np.ndarray
+    operating_cost: np.ndarray
+    scenario_probs: np.ndarray
+
+
+def make_instance(Candidates, Customers, Suppliers, Products, Times, Scenarios, demand,
+                  CostSupplierCandidate, CostCandidateCustomers,
+                  Candidates_df, Suppliers_df, Operating_costs_df, scenario_probs=None):
+    """
+    Pull the arrays out of the data frames for the given index sets.
+
+    :param demand: customer x product x period (x scenario) array in the order of the index sets
+    :param CostSupplierCandidate: suppliers x candidates array (see cost_matrices.py)
+    :param CostCandidateCustomers: candidates x customers array
+    :param scenario_probs: defaults to every scenario being equally likely
+    """
+    demand = np.asarray(demand)
+    if demand.ndim == 3:
+        demand = demand[..., None]
+    Scenarios = np.arange(1, demand.shape[-1] + 1) if Scenarios is None else np.asarray(Scenarios)
+    if scenario_probs is None:
+        scenario_probs = np.full(len(Scenarios), 1 / len(Scenarios))
+
+    return MecwlpInstance(
+        candidates=np.asarray(Candidates),
+        customers=np.asarray(Customers),
+        suppliers=np.asarray(Suppliers),
+        products=np.asarray(Products),
+        periods=np.asarray(Times),
+        scenarios=Scenarios,
+        demand=demand.astype(np.float64),
+        cost_supplier_candidate=np.asarray(CostSupplierCandidate, dtype=np.float64),
+        cost_candidate_customer=np.asarray(CostCandidateCustomers, dtype=np.float64),
+        supplier_capacity=Suppliers_df.loc[Suppliers, "Capacity"].to_numpy(dtype=np.float64),
+        supplier_product=Suppliers_df.loc[Suppliers, "Product group"].to_numpy(),
+        candidate_capacity=Candidates_df.loc[Candidates, "Capacity"].to_numpy(dtype=np.float64),
+        setup_cost=Candidates_df.loc[Candidates, "Setup cost"].to_numpy(dtype=np.float64),
+        operating_cost=pd.Series(Operating_costs_df).loc[Candidates].to_numpy(dtype=np.float64),
+        scenario_probs=np.asarray(scenario_probs, dtype=np.float64),
+    )
+
+
+@dataclass
+class MecwlpModel:
+    """
+    The built model plus where every variable ended up.
+
+    y_cols is candidate x period, x_cols is assignment pair x period x product x scenario where pair n
+    is (customer assign_cust[n], candidate assign_cand[n]), and z_cols is supply triple x period x scenario
+    where triple n is (supplier supply_sup[n], candidate supply_cand[n], product supply_prod[n]).
+    All of these are positions in the instance's id arrays. build_options are the keyword
+    arguments build_mecwlp was called with (stock_ratio, exact_stock, ...).
+    """
+    matrix: MatrixModel
+    instance: MecwlpInstance
+    y_cols: np.ndarray
+    x_cols: np.ndarray
+    z_cols: np.ndarray
+    assign_cust: np.ndarray
+    assign_cand: np.ndarray
+    supply_sup: np.ndarray
+    supply_cand: np.ndarray
+    supply_prod: np.ndarray
+    build_options: dict = field(default_factory=dict)
+
+    def y_values(self, sol):
+        return np.asarray(sol)[self.y_cols]
+
+    def x_values(self, sol):
+        return np.asarray(sol)[self.x_cols]
+
+    def z_values(self, sol):
+        return np.asarray(sol)[self.z_cols]
+
+    @traced("y_dict")
+    def y_dict(self, sol):
+        """{(j, t): 0/1} like prob.getSolution(y) used to give"""
+        inst = self.instance
+        keys = pd.MultiIndex.from_product([inst.candidates, inst.periods])
+        return dict(zip(keys, np.rint(self.y_values(sol)).astype(int).ravel().tolist()))
+
+    def supplier_usage(self, sol):
+        """supplier x period, the largest share of its stock a supplier sends anywhere in any scenario"""
+        inst = self.instance
+        usage = np.zeros((len(inst.suppliers), len(inst.periods)))
+        np.maximum.at(usage, self.supply_sup, self.z_values(sol).max(axis=-1))
+        return usage
+
+    @traced("cost_breakdown")
+    def cost_breakdown(self, sol):
+        """
+        (setup, operating, supplier->warehouse, warehouse->customer) with the last three
+        keyed by period, the same shape get_basic_summary_sol expects
+        """
+        sol = np.asarray(sol)
+        c = self.matrix.c
+        inst = self.instance
+        y = self.y_values(sol)
+
+        setup = inst.setup_cost @ y[:, -1]
+        operating, sup_ware, ware_cust = {}, {}, {}
+        for t_pos, t in enumerate(inst.periods):
+            operating[t] = inst.operating_cost @ y[:, t_pos]
+            z_t = self.z_cols[:, t_pos].ravel()
+            x_t = self.x_cols[:, t_pos].ravel()
+            sup_ware[t] = c[z_t] @ sol[z_t]
+            ware_cust[t] = c[x_t] @ sol[x_t]
+        return setup, operating, sup_ware, ware_cust
+
+
+def warehouse_costs(inst:MecwlpInstance):
+    """
+    candidate x period cost of y[j,t]: operating costs every period plus the setup cost
+    on the final period, since once it's built it stays open
+    """
+    y_cost = np.repeat(inst.operating_cost[:, None], len(inst.periods), axis=1)
+    y_cost[:, -1] += inst.setup_cost
+    return y_cost
+
+
+@traced()
+def build_mecwlp(inst:MecwlpInstance, stock_ratio=1.0, exact_stock=False, supply_only_open=False,
+                 max_open=None, assign_mask=None, supply_mask=None, name="MECWLP"):
+    """
+    Build the (stochastic) MECWLP from ``inst`` as one sparse matrix.
+
+    The deterministic model in part one.py is ``stock_ratio=1`` with stock >= deliveries, the stochastic
+    model in StochasticFinal.py is ``stock_ratio=.8, exact_stock=True, supply_only_open=True``.
+
+    :param stock_ratio: share of the deliveries to customers that has to come in from suppliers
+    :param exact_stock: stock in == stock_ratio * deliveries instead of >=
+    :param supply_only_open: add z[k,j,t,p,s] <= y[j,t]
+    :param max_open: at most this many warehouses open in each period
+    :param assign_mask: customers x candidates boolean array, x (and its linking rows) only exists
+        where this is True, see pruning.nearest_candidate_mask. None keeps every pair
+    :param supply_mask: suppliers x candidates boolean array, z only exists where this is True,
+        see pruning.cheapest_supplier_mask. None keeps every pair
+    """
+    nJ, nI, nK = len(inst.candidates), len(inst.customers), len(inst.suppliers)
+    nT, nP, nS = len(inst.periods), len(inst.products), len(inst.scenarios)
+    probs = inst.scenario_probs
+
+    # every customer can be served by every candidate, unless pruned
+    if assign_mask is None:
+        assign_cust, assign_cand = np.divmod(np.arange(nI * nJ), nJ)
+    else:
+        assign_cust, assign_cand = np.nonzero(assign_mask)
+    # each supplier only carries one product group, so z only exists for (k, j, product of k)
+    # instead of making a column for every product and bounding the other three at zero
+    if supply_mask is None:
+        supply_sup, supply_cand = np.divmod(np.arange(nK * nJ), nJ)
+    else:
+        supply_sup, supply_cand = np.nonzero(supply_mask)
+    supplier_prod_pos = np.searchsorted(inst.products, inst.supplier_product)
+    supply_prod = supplier_prod_pos[supply_sup]
+    nA, nZ = len(assign_cust), len(supply_sup)
+
+    mb = MatrixBuilder()
+
+    lap = laps()
+    lap("variables")
+    ######## Decision variables
+    # y[j,t] warehouse open
+    y_cols = mb.add_columns((nJ, nT), cost=warehouse_costs(inst), ub=1, integer=True)
+
+    # x[i,j,t,p,s] customer i gets product p from warehouse j
+    # pair x period x product x scenario demand
+    pair_demand = inst.demand[assign_cust].transpose(0, 2, 1, 3)
+    x_cost = (
+        inst.cost_candidate_customer[assign_cand, assign_cust][:, None, None, None]
+        * pair_demand * probs
+    )
+    x_cols = mb.add_columns((nA, nT, nP, nS), cost=x_cost, ub=1, integer=True)
+
+    # z[k,j,t,p,s] share of supplier k's stock of p sent to warehouse j
+    z_cost = (
+        inst.cost_supplier_candidate[supply_sup, supply_cand] * inst.supplier_capacity[supply_sup]
+    )[:, None, None] * probs
+    z_cols = mb.add_columns((nZ, nT, nS), cost=np.broadcast_to(z_cost, (nZ, nT, nS)), ub=1)
+
+    lap("constraints")
+    ########### Constraints
+    # we can only supply from a warehouse if it is built
+    rows = mb.add_rows(x_cols.shape, ub=0)
+    mb.add_coefs(rows, x_cols, 1)
+    mb.add_coefs(rows, y_cols[assign_cand][:, :, None, None], -1)
+
+    # if we build a warehouse it stays open
+    rows = mb.add_rows((nJ, nT - 1), ub=0)
+    mb.add_coefs(rows, y_cols[:, :-1], 1)
+    mb.add_coefs(rows, y_cols[:, 1:], -1)
+
+    if max_open is not None:
+        rows = mb.add_rows(nT, ub=max_open)
+        mb.add_coefs(rows[None, :], y_cols, 1)
+
+    # We must meet all customer demands, each year
+    rows = mb.add_rows((nI, nT, nP, nS), lb=1, ub=1)
+    mb.add_coefs(rows[assign_cust], x_cols, 1)
+
+    # we can supply out 100% of stock at most
+    rows = mb.add_rows((nK, nT, nS), ub=1)
+    mb.add_coefs(rows[supply_sup], z_cols, 1)
+
+    # we only supply to open warehouses
+    if supply_only_open:
+        rows = mb.add_rows(z_cols.shape, ub=0)
+        mb.add_coefs(rows, z_cols, 1)
+        mb.add_coefs(rows, y_cols[supply_cand][:, :, None], -1)
+
+    # a warehouse can deliver no more than what it has in stock
+    stock_in = inst.supplier_capacity[supply_sup][:, None, None]
+    rows = mb.add_rows((nJ, nT, nS), lb=0, ub=0 if exact_stock else INF)
+    mb.add_coefs(rows[supply_cand], z_cols, stock_in)
+    mb.add_coefs(rows[assign_cand][:, :, None, :], x_cols, -stock_ratio * pair_demand)
+
+    # a warehouse has a capacity
+    rows = mb.add_rows((nJ, nT, nS), ub=inst.candidate_capacity[:, None, None])
+    mb.add_coefs(rows[supply_cand], z_cols, stock_in)
+
+    lap("matrix")
+    matrix = mb.build(name)
+    lap.end()
+
+    return MecwlpModel(
+        matrix=matrix,
+        instance=inst,
+        y_cols=y_cols, x_cols=x_cols, z_cols=z_cols,
+        assign_cust=assign_cust, assign_cand=assign_cand,
+        supply_sup=supply_sup, supply_cand=supply_cand, supply_prod=supply_prod,
+        build_options=dict(stock_ratio=stock_ratio, exact_stock=exact_stock,
+                           supply_only_open=supply_only_open, max_open=max_open),
+    )
+
@@ -0,0 +1,96 @@
+import numpy as np
+
+# =============================================================================
+# p-median heuristics: open p of the candidates so that the sum over customers
+# of the cost to their cheapest open candidate is as small as possible.
+#
+# Everything works on the dense customer x candidate cost matrix. The open set
+# is first built greedily and then improved by vertex substitution (Teitz &
+# Bart), swapping one open candidate for a closed one while that helps. The
+# nearest and second nearest open candidate of every customer are kept, so the
+# value of every possible swap comes out of a couple of matrix operations.
+# =============================================================================
+
+
+def assignment_costs(costs, open_cols):
+    """
+    For each customer its cheapest open candidate (as a position into ``open_cols``) and the costs
+    of the cheapest and second cheapest open candidates.
+    """
+    sub = costs[:, open_cols]
+    if len(open_cols) == 1:
+        return np.zeros(len(costs), dtype=np.int64), sub[:, 0], np.full(len(costs), np.inf)
+    two = np.argpartition(sub, 1, axis=1)[:, :2]
+    rows = np.arange(len(costs))
+    d = sub[rows[:, None], two]
+    first = d.argmin(axis=1)
+    nearest = two[rows, first]
+    return nearest, d[rows, first], d[rows, 1 - first]
+
+
+def greedy_add(costs, p):
+    """open candidates one at a time, always the one that saves the most. Returns their columns"""
+    nI, nJ = costs.shape
+    best = np.full(nI, np.inf)
+    open_cols = []
+    for _ in range(p):
+        if open_cols:
+            saving = np.maximum(best[:, None] - costs, 0).sum(axis=0)
+        else:
+            # nothing to compare with yet, take the cheapest candidate on its own
+            saving = -costs.sum(axis=0)
+        saving[open_cols] = -np.inf
+        j = int(saving.argmax())
+        open_cols.append(j)
+        best = np.minimum(best, costs[:, j])
+    return np.array(open_cols)
+
+
+def vertex_substitution(costs, open_cols, max_swaps=10_000, tol=1e-9):
+    """
+    Teitz-Bart interchange: make the best single swap (close one open, open one closed) as long
+    as it lowers the total cost.
+
+    For an added candidate j and removed open candidate r, customer i then costs
+    min(c[i,j], d1[i]) unless r was its nearest, in which case min(c[i,j], d2[i]). So the total of
+    every swap is the sum of the first term plus, grouped by nearest, the difference of the two.
+    """
+    open_cols = np.array(open_cols)
+    p = len(open_cols)
+    nI, nJ = costs.shape
+    nearest, d1, d2 = assignment_costs(costs, open_cols)
+    total = d1.sum()
+    for _ in range(max_swaps):
+        with_j = np.minimum(costs, d1[:, None])
+        base = with_j.sum(axis=0)
+        # extra cost of closing r on top of opening j, summed over the customers nearest r
+        extra = np.zeros((p, nJ))
+        np.add.at(extra, nearest, np.minimum(costs, d2[:, None]) - with_j)
+        swap_total = base[None, :] + extra
+        swap_total[:, open_cols] = np.inf
+
+        r, j = np.unravel_index(swap_total.argmin(), swap_total.shape)
+        if swap_total[r, j] >= total - tol * max(1.0, abs(total)):
+            break
+        open_cols[r] = j
+        nearest, d1, d2 = assignment_costs(costs, open_cols)
+        total = d1.sum()
+    return open_cols
+
+
+def solve_p_median(costs, p, weights=None, max_swaps=10_000):
+    """
+    Open ``p`` candidates with small total assignment cost.
+
+    :param costs: customer x candidate cost matrix
+    :param weights: multiply every customer's costs by this, e.g. its demand
+    :return: the (sorted) columns of the open candidates and the total cost
+    """
+    costs = np.asarray(costs, dtype=np.float64)
+    if weights is not None:
+        costs = costs * np.asarray(weights, dtype=np.float64)[:, None]
+    if not 1 <= p <= costs.shape[1]:
+        raise ValueError(f"can't open {p} of {costs.shape[1]} candidates")
+    open_cols = vertex_substitution(costs, greedy_add(costs, p), max_swaps)
+    open_cols = np.sort(open_cols)
+    return open_cols, costs[:, open_cols].min(axis=1).sum()
@@ -1,14 +1,24 @@
 import numpy as np
 import pandas as pd
-import xpress as xp
-import platform
 from helper_funcs import *
 from clusteringdemand import *
-from time import perf_counter
+from cost_matrices import get_cost_matrices
+from model_builder import make_instance, build_mecwlp
+from solver_backends import make_backend, INFEASIBLE
+from pruning import grid_coords, solve_with_pruning, cheapest_supplier_mask
+from plan_evaluation import evaluate_plan_full
+from warm_start import heuristic_start
+from instrumentation import Profiler
+
+# time and memory of every stage (see instrumentation.py), the table is printed after the solve and
+# the trace can be opened in chrome://tracing or ui.perfetto.dev. Tracing memory slows things down
+TRACE_MEMORY = False
+TRACE_FILE = "part one trace.json"
+prof = Profiler(trace_memory=TRACE_MEMORY).activate()
 
 (
     PostcodeDistricts_df, Candidates_df, Suppliers_df,
-    Demand_df, DemandPeriods, DemandPeriodsScenarios_df,
+    Demand_df, data,
     Operating_costs_df, DistanceSupplierDistrict_df, DistanceDistrictDistrict_df,
     nbPeriods, nbScenarios
 ) = get_all_data("CaseStudyDataPY")
@@ -52,27 +62,14 @@ VehicleCostPerMileAndTonneOverall = {
 # Round-trip distance (factor 2)
 # Cost depends on supplier vehicle type
 # Division by 1000 converts from kg to tonnes
-CostSupplierCandidate = {
-    (k, j): 2
-    * DistanceSupplierDistrict_df.loc[k, j]
-    * VehicleCostPerMileAndTonneOverall[
-        Suppliers_df.loc[k, "Vehicle type"]
-    ]
-    / 1000
-    for j in Candidates_df.index
-    for k in Suppliers_df.index
-}
-
 # Cost from candidate facilities to customers
 # All transports use 3.5t vans (vehicle type 3)
-CostCandidateCustomers = {
-    (j, i): 2
-    * DistanceDistrictDistrict_df.loc[j, i]
-    * VehicleCostPerMileAndTonneOverall[3]
-    / 1000
-    for j in Candidates_df.index
-    for i in Candidates_df.index
-}
+# both are built as arrays in one go (see cost_matrices.py), every candidate x every district
+CostSupplierCandidate, CostCandidateCustomers = get_cost_matrices(
+    DistanceSupplierDistrict_df, DistanceDistrictDistrict_df, Suppliers_df,
+    VehicleCostPerMileAndTonneOverall,
+    suppliers=Suppliers_df.index, candidates=Candidates_df.index, customers=Candidates_df.index,
+)
 
 # =============================================================================
 # Index sets
@@ -84,8 +81,10 @@ CostCandidateCustomers = {
 # Candidates = rng.choice(Candidates_df.index, size =40, replace=False)
 
 #cluster the customer locations and take the aggregated demand
-all_Customers_df, reduced_Customers_df, _, DemandPeriods, _, _  = calcClusters(Demand_df, Candidates_df,DemandPeriodsScenarios_df, num_clusters=30)
+# cluster_data has the customer x product x period demand of each cluster, the n'th cluster goes to Customers[n]
+all_Customers_df, reduced_Customers_df, _, cluster_data  = calcClusters(Demand_df, Candidates_df, data, num_clusters=30)
 Customers = reduced_Customers_df.index
+DemandPeriods = cluster_data.demand_periods
 
 ########## this is where it gets  confusing
 #cluster the warehouse locations 
@@ -93,12 +92,12 @@ num_warehouses = 30
 
 # sub_start = perf_counter() 
 # print(f"solving subproblem of finding {num_warehouses} warehouses which have minimal transport cost")
-# reduced_warehouses_index = aggregate_warehouses_subproblem(num_warehouses, Candidates_df.index, Customers, CostCandidateCustomers )
+# reduced_warehouses_index = aggregate_warehouses_subproblem(num_warehouses, Candidates_df.index, Customers, CostCandidateCustomers[:, Candidates_df.index.get_indexer(Customers)] )
 # sub_end = perf_counter()
 # print(f"subproblem took {pretty_print_seconds(sub_end-sub_start)}")
 # Candidates = reduced_warehouses_index
 
-_, reduced_Candidates_df, _, _, _, _  = calcClusters(Demand_df, Candidates_df, DemandPeriodsScenarios_df, num_clusters=num_warehouses)
+_, reduced_Candidates_df, _, _  = calcClusters(Demand_df, Candidates_df, data, num_clusters=num_warehouses)
 Candidates = reduced_Candidates_df.index
 
 
@@ -122,180 +121,100 @@ agg_ware_cust_travel_costs = get_weighted_travel_costs(reduced_Customers_df, Cos
 # Build optimization model
 # =============================================================================
 
-if platform.system()== "Windows":
-    xp.init('c:/xpressmp/bin/xpauth.xpr')
-else:
-    print("lmk if that annoying message is coming up") #they did not lmk
-
-prob = xp.problem("Assignment 1")
-
-######## Decision variables 
-x = {
-    (i,j,t,p): prob.addVariable(name=f"X__C{i}_W{j}_T{t}_P{p}", vartype=xp.binary)
-    for i in Customers for j in Candidates for t in Times for p in Products
-}
-y = {
-    (j,t): prob.addVariable(name=f"Y__W{j}_T{t}", vartype = xp.binary)
-    for j in Candidates for t in Times
-}
-
-z = {
-    (k,j,t,p): prob.addVariable(name=f"Z__S{k}_W{j}_T{t}_P{p}", ub=1) #maybe specifying to xpress that the upper bound is one will help things
-    for k in Suppliers for j in Candidates for t in Times for p in Products
-}
-
-########### Constraints
-# we can only supply from a warehouse if it is built
-prob.addConstraint(
-    x[i,j,t,p] <= y[j,t]
-    for i in Customers for j in Candidates for t in Times for p in Products
-)
-#if we build a warehouse it stays open 
-prob.addConstraint(
-    y[j,t] <= y[j,t+1]
-    for j in Candidates for t in Times if t != max(Times)
-)
-if nbCandidates >30:
-    prob.addConstraint(
-        xp.Sum( y[j,t] for j in Candidates)
-        <=
-        nbCandidates//2
-        for t in Times 
-    )
-
-# We must meet all customer demands, each year
-prob.addConstraint(
-    xp.Sum(
-        x[i,j,t,p]
-        for j in Candidates
-    )
-    == 1
-    for i in Customers for p in Products for t in Times
+# "xpress" or "highs", highs has no licence so no size limit
+SOLVER = "xpress"
+backend = make_backend(
+    SOLVER,
+    time_limit=60*20,
+    rel_gap=.05,        # stop once the mip gap is below 5%
 )
 
-# the z decision variables are percentages of supplier k's total stock of p sent to warehouse j at time t 
-# constrain them less than one
-prob.addConstraint(
-    z[k,j,t,p] <= int( p == Suppliers_df["Product group"][k] )
-    for k in Suppliers for j in Candidates for p in Products for t in Times
+# the model only needs the costs between the chosen customers and candidates, as arrays
+CostSupplierCandidate_arr, CostCandidateCustomers_arr = get_cost_matrices(
+    DistanceSupplierDistrict_df, DistanceDistrictDistrict_df, Suppliers_df,
+    VehicleCostPerMileAndTonneOverall,
+    suppliers=Suppliers, candidates=Candidates, customers=Customers
 )
 
-# we can supply out 100% of stock at most
-prob.addConstraint(
-    xp.Sum(
-        z[k,j,t,p]
-        for j in Candidates
-    )
-    <= 1
-    for k in Suppliers for p in Products for t in Times
-)
-# # we only supply to open warehouses
-# prob.addConstraint(
-#     z[k,j,t,p] <= y[j,t]
-#     for t in Times for k in Suppliers for j in Candidates for p in Products
-# )
-
-
-
-######link warehouse stock supplier
-# a warehouse can deliver no more than what it has in stock
-# assuming no stock gets carried over into the next year because fuck that its too complicated
-prob.addConstraint(
-    xp.Sum(
-        Suppliers_df["Capacity"][k] * z[k,j,t,p]        #Into warehouse from suppliers
-        for k in Suppliers for p in Products
-    )
-    >=
-    xp.Sum(
-        DemandPeriods[i,p,t] * x[i,j,t,p]              #Out of warehouse to customers
-        for i in Customers  for p in Products                    
-    )
-    for j in Candidates for t in Times
+instance = make_instance(
+    Candidates, Customers, Suppliers, Products, Times, None,
+    DemandPeriods[cluster_data.customer_positions(Customers)],
+    CostSupplierCandidate_arr, CostCandidateCustomers_arr,
+    Candidates_df, Suppliers_df, Operating_costs_df,
 )
 
-# a warehouse has a capacity
-prob.addConstraint(
-    xp.Sum(
-        Suppliers_df["Capacity"][k] * z[k,j,t,p]        #Into warehouse from suppliers
-        for k in Suppliers for p in Products
+# only let each warehouse get each product from its nearest_suppliers cheapest suppliers
+# (plus more if they wouldn't have enough stock between them), None keeps every supplier
+nearest_suppliers = None
+supply_mask = None
+if nearest_suppliers is not None:
+    supply_mask = cheapest_supplier_mask(instance, n=nearest_suppliers, stock_ratio=1)
+
+# the whole model is built as arrays and loaded in one go, see model_builder.py for the formulation:
+#   x[i,j,t,p] binary, customer i gets product p from warehouse j
+#   y[j,t] binary, warehouse j is open (and stays open)
+#   z[k,j,t,p] in [0,1], share of supplier k's stock sent to warehouse j, only for the product k carries
+# a warehouse can deliver no more than what it has in stock (and has a capacity)
+# with lots of candidates at most half of them can be open
+def build_and_solve(assign_mask):
+    model = build_mecwlp(
+        instance, stock_ratio=1, exact_stock=False,
+        max_open=nbCandidates//2 if nbCandidates > 30 else None,
+        assign_mask=assign_mask, supply_mask=supply_mask,
+        name="Assignment 1"
     )
-    <= Candidates_df["Capacity"][j]                     #Warehouse capacity
-    for j in Candidates for t in Times
-)
 
+    # a greedy/drop plan with its flows so the solver has an incumbent straight away (see warm_start.py)
+    start_sol, start_obj = heuristic_start(model, backend)
 
-################################
-# Objective function
-#minimise costs
-#################################
-#we know that if we build a warehouse it will be open in year 10
-# so we can use year 10 to calculate fixed costs
-warehouse_setup_costs = xp.Sum(
-    Candidates_df["Setup cost"][j]*y[j,final_t]
-    for j in Candidates
-)
+    print(f"Solving a problem with {model.matrix.size()} using {SOLVER}")
+    result = backend.solve(model.matrix, mip_start=start_sol)
+    print(f"took {pretty_print_seconds(result.solve_time)} for a problem with {model.matrix.size()}")
 
-warehouse_operating_costs = {
-    t: xp.Sum(
-        Operating_costs_df[j]*y[j,t] 
-        for j in Candidates
-    )
-    for t in Times
-}
-
-supplier_to_warehouse_costs = {
-    t: xp.Sum(
-        CostSupplierCandidate[k,j] * Suppliers_df["Capacity"][k] * z[k,j,t,p]
-        for k in Suppliers for j in Candidates for p in Products
-    )
-    for t in Times
-}
-
-warehouse_to_customer_costs = {
-    t: xp.Sum(
-        CostCandidateCustomers[j,i] * DemandPeriods[i,p,t] * x[i,j,t,p]
-        for i in Customers for j in Candidates for p in Products
-    )
-    for t in Times
-}
+    return (model, result), result.status == INFEASIBLE
 
 ##################################
 #Solving
 ##################################
 
-
-prob.setControl('miprelstop', .05) # stop once the mip gap is below 5%
-prob.controls.maxtime = -60*20 
-prob.setObjective(
-    warehouse_setup_costs + xp.Sum(
-    warehouse_operating_costs[t] + supplier_to_warehouse_costs[t] + warehouse_to_customer_costs[t]
-    for t in Times
+# only let each customer be served from its nearest_k closest candidates, None keeps every pair
+# if that turns out infeasible nearest_k is doubled until it isn't
+nearest_k = None
+if nearest_k is None:
+    (model, result), _ = build_and_solve(None)
+else:
+    (model, result), _ = solve_with_pruning(
+        build_and_solve,
+        grid_coords(PostcodeDistricts_df, Customers), grid_coords(Candidates_df, Candidates),
+        k=nearest_k
     )
-    ,sense = xp.minimize
-)
-
-xp.setOutputEnabled(False)
-start_time = perf_counter()
-print(f"Solving a problem with {prob.getAttrib('rows'):,} rows and {prob.getAttrib("cols"):,} columns")
-prob.solve()
-end_time = perf_counter()
-print(f"took {pretty_print_seconds(end_time-start_time)} for a problem with {prob.getAttrib('rows'):,} rows and {prob.getAttrib("cols"):,} columns")
 
 # =============================================================================
 # Post-processing and data visualisation
 # =============================================================================
-print_sol_status(prob)
-
-x = { k:int(v) for k,v in prob.getSolution(x).items() }   # if x is not binary change this !!!
-y = { k:int(v) for k,v in prob.getSolution(y).items() }
-z = prob.getSolution(z)
-costs = (warehouse_setup_costs, warehouse_operating_costs, supplier_to_warehouse_costs, warehouse_to_customer_costs)
-costs = map(
-    lambda v: prob.getSolution(v),
-    costs
+print_sol_status(result)
+
+sol = result.x
+y = model.y_dict(sol)
+costs = model.cost_breakdown(sol)
+
+get_basic_summary_sol(result,xs=None, ys = y, zs=None, time_index=Times, product_index=Products, costs=costs)
+
+# the objective above is over the cluster centres, this is what the plan costs with every district
+# (each product to the nearest open warehouse with capacity repair plus a supplier LP, see plan_evaluation.py)
+cand_pos = Candidates_df.index.get_indexer(Candidates)
+full_instance = make_instance(
+    Candidates, data.customers, Suppliers, Products, Times, None, data.demand_periods,
+    CostSupplierCandidate_arr, CostCandidateCustomers[cand_pos][:, Candidates_df.index.get_indexer(data.customers)],
+    Candidates_df, Suppliers_df, Operating_costs_df,
 )
+full = evaluate_plan_full(full_instance, model.y_values(sol), stock_ratio=1, exact_stock=False, backend=backend)
+print(f"\nWith all {len(data.customers)} districts the plan costs {full.total:,.0f}")
+get_basic_summary_sol(result, xs=None, ys=full.y_dict(), zs=None, time_index=Times, product_index=Products, costs=full.cost_breakdown())
 
-get_basic_summary_sol(prob,xs=x, ys = y, zs=y, time_index=Times, product_index=Products, costs=costs)
+prof.deactivate()
+print(prof.report())
+prof.save_chrome_trace(TRACE_FILE)
 
 # put_solution_on_map(
 #     probs=prob,
@@ -306,11 +225,10 @@ get_basic_summary_sol(prob,xs=x, ys = y, zs=y, time_index=Times, product_index=P
 
 #another map to be consistent with the stochastic one
 
-probs=prob
-ys = prob.getSolution(y)
-zs = prob.getSolution(z)
-ys = prob.getSolution(y)
-zs = prob.getSolution(z)
+probs=result
+ys = model.y_dict(sol)
+# largest share of its stock each supplier sends anywhere in the final period
+supplier_used = dict(zip(Suppliers, model.supplier_usage(sol)[:, -1]))
 cand_gdf=Candidates_df.loc[Candidates]
 cust_gdf=PostcodeDistricts_df.loc[Customers] 
 supp_gdf=Suppliers_df
@@ -355,11 +273,7 @@ jitter_amount = 0.02
 for k in supp_gdf.index:
     supp = supp_gdf.loc[k]
     supp_loc = (supp["lat"], supp["lon"])
-    color = "green" if max(
-        zs[k,j,t,p] 
-        for p in product_index 
-        for j in cand_gdf.index 
-    ) else "grey"
+    color = "green" if supplier_used[k] else "grey"
 
     folium.CircleMarker(
         location=supp_loc,
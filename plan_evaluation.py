@@ -0,0 +1,186 @@
+import numpy as np
+from dataclasses import dataclass, field
+from model_builder import MatrixBuilder, MecwlpInstance
+from solver_backends import make_backend
+from instrumentation import traced
+
+# =============================================================================
+# What a warehouse plan really costs.
+#
+# The objective of an aggregated model is over cluster centres, so it can't be
+# compared between aggregation levels. Here the plan y[j,t] from any model is
+# costed against every district and every supplier instead:
+#
+#   - each product of each district goes to the district's cheapest open
+#     warehouse (the cost per tonne doesn't depend on the product), then
+#     products of districts are moved off warehouses that would go over
+#     capacity, the cheapest moves first. The model can split a district's
+#     products between warehouses too, so this is the same kind of assignment
+#   - the stock the warehouses need comes from the suppliers by a small
+#     transport LP, suppliers x open warehouses x periods
+#
+# so it's cheap enough to run on every sweep point. The assignment is a
+# heuristic, so the cost is an upper bound on the best flows for that plan.
+# =============================================================================
+
+
+@dataclass
+class PlanEvaluation:
+    """
+    Cost of a plan with full resolution demand. ``assignment`` is customer x product x period x scenario
+    (candidate position, -1 if not served), ``supply`` the supplier x candidate x period x scenario
+    shares of supplier stock
+    """
+    instance: MecwlpInstance
+    y: np.ndarray
+    assignment: np.ndarray = field(repr=False)
+    supply: np.ndarray = field(repr=False)
+    feasible: bool
+    setup: float
+    operating: dict
+    sup_ware: dict
+    ware_cust: dict
+
+    @property
+    def total(self):
+        if not self.feasible:
+            return np.inf
+        return self.setup + sum(self.operating.values()) + sum(self.sup_ware.values()) + sum(self.ware_cust.values())
+
+    def cost_breakdown(self):
+        """(setup, operating, supplier->warehouse, warehouse->customer) as get_basic_summary_sol wants them"""
+        return self.setup, self.operating, self.sup_ware, self.ware_cust
+
+    def y_dict(self):
+        """{(j, t): 0/1} like MecwlpModel.y_dict"""
+        inst = self.instance
+        return {
+            (j, t): int(self.y[j_pos, t_pos])
+            for j_pos, j in enumerate(inst.candidates) for t_pos, t in enumerate(inst.periods)
+        }
+
+
+def assign_customers(cost, demand, is_open, room):
+    """
+    Cheapest open warehouse for every customer, then customers are moved off overfull warehouses.
+    A "customer" is whatever is assigned as one, evaluate_plan_full and warm_start pass every
+    (customer, product) so each product can go to a different warehouse as in the model.
+
+    :param cost: candidate x customer cost per unit
+    :param demand: demand of every customer
+    :param is_open: which candidates are open
+    :param room: how much each candidate can deliver
+    :return: candidate position of every customer, None if the capacity can't be kept to
+    """
+    open_pos = np.flatnonzero(is_open)
+    sub = cost[open_pos]
+    assignment = open_pos[sub.argmin(axis=0)]
+    load = np.bincount(assignment, weights=demand, minlength=len(cost))
+
+    while True:
+        over = np.flatnonzero(load > room * (1 + 1e-9))
+        if len(over) == 0:
+            return assignment
+        j = over[np.argmax(load[over] - room[over])]
+        movable = np.flatnonzero((assignment == j) & (demand > 0))
+        # extra cost per unit of moving each of j's customers to every other open warehouse with space
+        fits = (room[open_pos][:, None] - load[open_pos][:, None] >= demand[movable][None, :]) & (open_pos[:, None] != j)
+        extra = np.where(fits, sub[:, movable] - cost[j, movable][None, :], np.inf)
+        if not np.isfinite(extra).any():
+            return None
+        to, who = np.unravel_index(extra.argmin(), extra.shape)
+        i = movable[who]
+        assignment[i] = open_pos[to]
+        load[j] -= demand[i]
+        load[open_pos[to]] += demand[i]
+
+
+def supply_lp(inst:MecwlpInstance, y, need, exact_stock, backend, supply_mask=None):
+    """
+    Cheapest shares of supplier stock to bring each warehouse ``need`` (candidate x period).
+
+    :param supply_mask: suppliers x candidates, only send along the True pairs (as in build_mecwlp)
+    :return: supplier x candidate x period shares, or None if the suppliers can't manage it
+    """
+    nK, nJ, nT = len(inst.suppliers), len(inst.candidates), len(inst.periods)
+    stock = inst.supplier_capacity
+    mb = MatrixBuilder()
+    z_cost = (inst.cost_supplier_candidate * stock[:, None])[:, :, None]
+    # only to open warehouses
+    z_ub = np.broadcast_to(y, (nK, nJ, nT))
+    if supply_mask is not None:
+        z_ub = z_ub * supply_mask[:, :, None]
+    z = mb.add_columns((nK, nJ, nT), cost=np.broadcast_to(z_cost, (nK, nJ, nT)), ub=z_ub)
+
+    # we can supply out 100% of stock at most
+    rows = mb.add_rows((nK, nT), ub=1)
+    mb.add_coefs(rows[:, None, :], z, 1)
+
+    # the stock they need, and no more than they hold
+    rows = mb.add_rows((nJ, nT), lb=need, ub=need if exact_stock else inst.candidate_capacity[:, None])
+    mb.add_coefs(rows[None, :, :], z, stock[:, None, None])
+
+    result = backend.solve(mb.build("supply"))
+    if not result.has_solution:
+        return None
+    return result.x[z]
+
+
+@traced()
+def evaluate_plan_full(inst:MecwlpInstance, y, stock_ratio=1.0, exact_stock=False, backend=None):
+    """
+    Cost the warehouse plan ``y`` (candidate x period, on the candidates of ``inst``) against the
+    customers and demand of ``inst``, normally every district at full resolution. The assignment is
+    a heuristic, so ``total`` is an upper bound on what the best flows for the plan cost.
+
+    :param stock_ratio: and ``exact_stock`` as in build_mecwlp
+    :param backend: solver for the supply LP
+    """
+    backend = make_backend(backend or "xpress")
+    y = np.rint(np.asarray(y, dtype=np.float64))
+    nI, nJ, nK, nP = len(inst.customers), len(inst.candidates), len(inst.suppliers), len(inst.products)
+    nT, nS = len(inst.periods), len(inst.scenarios)
+    # every (customer, product) is assigned on its own, unit n is customer n // nP and product n % nP
+    cost = np.repeat(inst.cost_candidate_customer, nP, axis=1)
+    units = np.arange(nI * nP)
+    # stock in is stock_ratio of what goes out, and stock in is capped by the capacity
+    room = inst.candidate_capacity / stock_ratio
+
+    assignment = np.full((nI * nP, nT, nS), -1, dtype=np.int64)
+    supply = np.zeros((nK, nJ, nT, nS))
+    ware_cust = np.zeros(nT)
+    sup_ware = np.zeros(nT)
+    feasible = True
+    for s_pos, prob in enumerate(inst.scenario_probs):
+        # unit x period
+        demand = inst.demand[..., s_pos].reshape(nI * nP, nT)
+        need = np.zeros((nJ, nT))
+        for t_pos in range(nT):
+            a = assign_customers(cost, demand[:, t_pos], y[:, t_pos] > .5, room) if y[:, t_pos].any() else None
+            if a is None:
+                feasible = False
+                break
+            assignment[:, t_pos, s_pos] = a
+            ware_cust[t_pos] += prob * cost[a, units] @ demand[:, t_pos]
+            need[:, t_pos] = stock_ratio * np.bincount(a, weights=demand[:, t_pos], minlength=nJ)
+        if not feasible:
+            break
+
+        z = supply_lp(inst, y, need, exact_stock, backend)
+        if z is None:
+            feasible = False
+            break
+        supply[..., s_pos] = z
+        sup_ware += prob * np.einsum("kjt,kj->t", z, inst.cost_supplier_candidate * inst.supplier_capacity[:, None])
+
+    return PlanEvaluation(
+        instance=inst,
+        y=y.astype(int),
+        assignment=assignment.reshape(nI, nP, nT, nS),
+        supply=supply,
+        feasible=feasible,
+        setup=inst.setup_cost @ y[:, -1],
+        operating={t: inst.operating_cost @ y[:, t_pos] for t_pos, t in enumerate(inst.periods)},
+        sup_ware=dict(zip(inst.periods, sup_ware)),
+        ware_cust=dict(zip(inst.periods, ware_cust)),
+    )
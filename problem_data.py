@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+
+
+def index_map(ids):
+    """id -> position, for going from the ids in the csvs to rows of the demand arrays"""
+    return {i: n for n, i in enumerate(np.asarray(ids).tolist())}
+
+
+def positions_of(labels:np.ndarray, ids):
+    """
+    Vectorised version of ``[index_map(labels)[i] for i in ids]``.
+    ``labels`` has to be sorted, which it always is for ProblemData.
+    """
+    ids = np.asarray(ids)
+    pos = np.searchsorted(labels, ids)
+    pos = np.minimum(pos, len(labels) - 1)
+    missing = labels[pos] != ids
+    if missing.any():
+        raise KeyError(f"ids {ids[missing][:10].tolist()} are not in the data")
+    return pos
+
+
+def demand_tensor(long_df:pd.DataFrame, axes, dtype=None):
+    """
+    Scatter a long csv frame (one row per key, a "Demand" column) into a dense array.
+
+    :param axes: list of (column name, sorted labels for that axis)
+    :param dtype: of the array, the Demand column's own by default. Raises if the values don't fit in it
+    """
+    demand = long_df["Demand"].to_numpy()
+    dtype = demand.dtype if dtype is None else np.dtype(dtype)
+    values = demand.astype(dtype)
+    if not np.array_equal(values, demand):
+        raise ValueError(f"the demand doesn't fit in {dtype} without losing data")
+    out = np.zeros(tuple(len(labels) for _, labels in axes), dtype=dtype)
+    pos = tuple(positions_of(labels, long_df[col].to_numpy()) for col, labels in axes)
+    out[pos] = values
+    return out
+
+
+@dataclass
+class ProblemData:
+    """
+    Demand for the MECWLP held as contiguous arrays instead of dicts keyed by tuples.
+
+    ``demand_periods[c, p, t]`` and ``demand_scenarios[c, p, t, s]`` are indexed by POSITION,
+    use the ``*_index`` dicts (or ``*_positions`` for whole arrays of ids) to go from the ids
+    used everywhere else to positions, e.g.
+    ``data.demand_periods[data.customer_positions(Customers)]`` is the customers x product x period
+    demand of the customers in the model.
+    """
+    customers: np.ndarray
+    candidates: np.ndarray
+    suppliers: np.ndarray
+    products: np.ndarray
+    periods: np.ndarray
+    scenarios: np.ndarray
+    demand_periods: np.ndarray
+    demand_scenarios: np.ndarray
+
+    def __post_init__(self):
+        self.customer_index = index_map(self.customers)
+        self.candidate_index = index_map(self.candidates)
+        self.supplier_index = index_map(self.suppliers)
+        self.product_index = index_map(self.products)
+        self.period_index = index_map(self.periods)
+        self.scenario_index = index_map(self.scenarios)
+
+    @property
+    def nbPeriods(self):
+        return len(self.periods)
+
+    @property
+    def nbScenarios(self):
+        return len(self.scenarios)
+
+    def customer_positions(self, ids):
+        return positions_of(self.customers, ids)
+
+    def candidate_positions(self, ids):
+        return positions_of(self.candidates, ids)
+
+    def supplier_positions(self, ids):
+        return positions_of(self.suppliers, ids)
+
+    def scenario_positions(self, ids):
+        return positions_of(self.scenarios, ids)
+
+    def aggregate(self, cluster_labels, centre_ids):
+        """
+        Sum demand over clusters of customers.
+
+        :param cluster_labels: cluster (0, ..., len(centre_ids)-1) of every customer, either a Series
+            indexed by customer id (like the "cluster label" column of calcClusters) or an array
+            in the same order as ``self.customers``
+        :param centre_ids: the id each cluster is known by in the model, cluster n -> centre_ids[n]
+        :return: a ProblemData whose customers are ``centre_ids``
+        """
+        if isinstance(cluster_labels, pd.Series):
+            cluster_labels = cluster_labels.reindex(self.customers).to_numpy()
+        cluster_labels = np.asarray(cluster_labels, dtype=np.intp)
+
+        centre_ids = np.asarray(centre_ids)
+        order = np.argsort(centre_ids, kind="stable")
+        # clusters get renumbered so the new customer ids are sorted like everything else
+        new_label = np.empty_like(order)
+        new_label[order] = np.arange(len(order))
+        cluster_labels = new_label[cluster_labels]
+
+        def summed(demand):
+            # int64 so sums of int32 demand can't overflow, float demand stays float
+            out = np.zeros((len(centre_ids),) + demand.shape[1:], dtype=np.result_type(demand.dtype, np.int64))
+            np.add.at(out, cluster_labels, demand)
+            return out
+
+        return ProblemData(
+            customers=centre_ids[order],
+            candidates=self.candidates, suppliers=self.suppliers,
+            products=self.products, periods=self.periods, scenarios=self.scenarios,
+            demand_periods=summed(self.demand_periods),
+            demand_scenarios=summed(self.demand_scenarios),
+        )
+
+    def demand_periods_dict(self):
+        """the old {(Customer, Product, Period): Demand} dict, only for code that still wants it"""
+        idx = pd.MultiIndex.from_product([self.customers, self.products, self.periods])
+        return dict(zip(idx, self.demand_periods.ravel().tolist()))
+
+    def demand_scenarios_dict(self):
+        """the old {(Customer, Product, Period, Scenario): Demand} dict"""
+        idx = pd.MultiIndex.from_product([self.customers, self.products, self.periods, self.scenarios])
+        return dict(zip(idx, self.demand_scenarios.ravel().tolist()))
+
+
+def build_problem_data(Candidates_df:pd.DataFrame, Suppliers_df:pd.DataFrame,
+                       DemandPeriods_df:pd.DataFrame, DemandPeriodsScenarios_df:pd.DataFrame):
+    """
+    Make a ProblemData from the long format csvs ``DemandPeriods.csv`` and ``DemandPeriodScenarios.csv``.
+    Keys missing from the csvs get zero demand.
+    """
+    customers = np.unique(DemandPeriods_df["Customer"].to_numpy())
+    products = np.unique(DemandPeriods_df["Product"].to_numpy())
+    periods = np.unique(DemandPeriods_df["Period"].to_numpy())
+    scenarios = np.unique(DemandPeriodsScenarios_df["Scenario"].to_numpy())
+
+    demand_periods = demand_tensor(
+        DemandPeriods_df,
+        [("Customer", customers), ("Product", products), ("Period", periods)]
+    )
+    demand_scenarios = demand_tensor(
+        DemandPeriodsScenarios_df,
+        [("Customer", customers), ("Product", products), ("Period", periods), ("Scenario", scenarios)]
+    )
+
+    return ProblemData(
+        customers=customers,
+        candidates=np.sort(Candidates_df.index.to_numpy()),
+        suppliers=np.sort(Suppliers_df.index.to_numpy()),
+        products=products, periods=periods, scenarios=scenarios,
+        demand_periods=demand_periods,
+        demand_scenarios=demand_scenarios,
+    )
@@ -0,0 +1,295 @@
+import numpy as np
+import copy
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from dataclasses import dataclass, replace
+from time import perf_counter
+from model_builder import MecwlpInstance, build_mecwlp, warehouse_costs
+from solver_backends import make_backend
+from scenario_subproblems import scenario_instance, ScenarioSolver
+from benders import BendersResult
+from warm_start import heuristic_start
+from helper_funcs import pretty_print_seconds
+
+# =============================================================================
+# Progressive hedging over the demand scenarios of the stochastic MECWLP.
+#
+# Every scenario gets its own copy of the warehouse plan y and is solved as a
+# full MIP on its own (in parallel if you like). Between iterations the copies
+# are pulled towards their probability weighted average ybar with
+#
+#   min  f_s(y, x, z) + w_s . y + rho/2 ||y - ybar||^2
+#
+# and since y is binary ||y - ybar||^2 = sum y (1 - 2 ybar) + const, so the
+# penalty is just a change to the cost of y and every subproblem stays a MIP.
+# w_s += rho (y_s - ybar) after each round. With sum_s p_s w_s = 0,
+# sum_s p_s min(f_s + w_s . y) is a lower bound on the stochastic problem.
+# =============================================================================
+
+
+# ---------------------------------------------------------------------------
+# worker process side, same arrangement as scenario_subproblems: the instance
+# goes over once, each task carries a scenario position, its y costs and start
+# ---------------------------------------------------------------------------
+_worker = {}
+
+
+def _init_worker(inst, backend, build_kwargs):
+    _worker.update(inst=inst, backend=backend, build_kwargs=build_kwargs, models={})
+
+
+def _worker_solve(s_pos, y_cost_change, mip_start, time_limit):
+    models = _worker["models"]
+    if s_pos not in models:
+        models[s_pos] = build_mecwlp(scenario_instance(_worker["inst"], s_pos), **_worker["build_kwargs"])
+    return _solve_scenario_mip(models[s_pos], _worker["backend"], y_cost_change, mip_start, time_limit)
+
+
+def limited(backend, time_limit):
+    """a copy of ``backend`` that stops after ``time_limit`` seconds (or its own limit if that's shorter)"""
+    if time_limit is None:
+        return backend
+    backend = copy.copy(backend)
+    backend.time_limit = time_limit if backend.time_limit is None else min(backend.time_limit, time_limit)
+    return backend
+
+
+def _solve_scenario_mip(model, backend, y_cost_change, mip_start, time_limit=None):
+    """
+    solve the scenario MIP with y costing that much more, returns (bestbound, y, solution).
+    y and solution are None if it stopped without a solution (the bound can still be -inf)
+    """
+    c = model.matrix.c.copy()
+    c[model.y_cols] += y_cost_change
+    result = limited(backend, time_limit).solve(replace(model.matrix, c=c), mip_start=mip_start)
+    if not result.has_solution:
+        return result.bestbound, None, None
+    return result.bestbound, np.rint(result.x[model.y_cols]), result.x
+
+
+class _ScenarioMips:
+    """the full MIP of every scenario, solved here or over a process pool"""
+
+    def __init__(self, inst:MecwlpInstance, backend, workers, build_kwargs):
+        self.inst = inst
+        self.backend = backend
+        self.build_kwargs = build_kwargs
+        self._models = {}
+        self._pool = None
+        if workers is not None and workers > 1:
+            worker_backend = copy.copy(backend)
+            worker_backend.threads = 1
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(inst, worker_backend, build_kwargs),
+            )
+
+    def solve(self, y_cost_changes, mip_starts, time_limit=None):
+        """one ``(bestbound, y, solution)`` per scenario, in scenario order, each MIP gets at most time_limit seconds"""
+        s_positions = range(len(self.inst.scenarios))
+        if self._pool is None:
+            results = []
+            for s_pos in s_positions:
+                if s_pos not in self._models:
+                    self._models[s_pos] = build_mecwlp(scenario_instance(self.inst, s_pos), **self.build_kwargs)
+                results.append(
+                    _solve_scenario_mip(self._models[s_pos], self.backend, y_cost_changes[s_pos], mip_starts[s_pos],
+                                        time_limit)
+                )
+            return results
+
+        return list(self._pool.map(_worker_solve, s_positions, y_cost_changes, mip_starts, repeat(time_limit)))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+@dataclass
+class PHResult(BendersResult):
+    """
+    The consensus plan, its expected cost with every scenario's flows solved as a MIP for that plan
+    (upper_bound) and the best lower bound found along the way. history holds
+    (iteration, disagreement, lower bound, seconds)
+    """
+    converged: bool = False
+
+
+def consensus_plans(y_scenarios, probs):
+    """
+    Plans to try at the end: ybar rounded, and every warehouse any scenario opens.
+    Both are made to stay open once opened.
+    """
+    ybar = np.tensordot(probs, y_scenarios, axes=1)
+    plans = [ybar >= .5, y_scenarios.max(axis=0) >= .5]
+    return [np.maximum.accumulate(plan, axis=1).astype(float) for plan in plans]
+
+
+# a scenario MIP always gets this long, even when the time is up
+MIN_SUBPROBLEM_TIME = 5
+
+
+def round_limit(time_limit, left, n_solves, workers, share):
+    """
+    Seconds each of ``n_solves`` scenario MIPs (``workers`` at a time) may take: at most ``share``
+    of time_limit for the lot of them, and no more than the ``left`` seconds. None without a time_limit
+    """
+    if time_limit is None:
+        return None
+    rounds = -(-n_solves // (workers if workers is not None and workers > 1 else 1))
+    return max(min(share * time_limit, left) / rounds, MIN_SUBPROBLEM_TIME)
+
+
+def solve_progressive_hedging(inst:MecwlpInstance, backend=None, rho_factor=.1, max_iterations=50,
+                              conv_tol=1e-3, time_limit=None, bound_every=5, workers=None,
+                              round_share=.1, eval_time_limit=None, verbose=True, **build_kwargs):
+    """
+    Progressive hedging on the scenarios of ``inst``.
+
+    :param backend: solver_backends backend (or its name) for the scenario MIPs
+    :param rho_factor: rho for y[j,t] is this times its cost, cheap warehouses are pulled together gently
+    :param conv_tol: stop once the average disagreement sum_s p_s |y_s - ybar| per y is below this
+    :param time_limit: seconds for the iterations, the plan is then costed on top of that
+    :param bound_every: work out the lower bound (one more MIP per scenario) every this many iterations,
+        the first iteration always gives one. None only uses the first
+    :param workers: solve the scenarios in this many processes
+    :param round_share: with a time_limit, one round of scenario MIPs gets at most this share of it
+        (split between the MIPs), and never more than is left
+    :param eval_time_limit: seconds each scenario MIP may take when costing the final plans, None leaves
+        them the backend's own limit
+    :param build_kwargs: passed on to build_mecwlp, e.g. ``stock_ratio=.8, exact_stock=True, supply_only_open=True``
+    """
+    backend = make_backend(backend or "xpress")
+    start = perf_counter()
+    probs = inst.scenario_probs
+    nS = len(inst.scenarios)
+    rho = rho_factor * warehouse_costs(inst)
+    no_change = [np.zeros_like(rho)] * nS
+
+    def limit():
+        left = None if time_limit is None else time_limit - (perf_counter() - start)
+        return round_limit(time_limit, left, nS, workers, round_share)
+
+    def bound_of(results):
+        # a scenario that stopped without a bound leaves this round without one
+        bounds = np.array([bound for bound, _, _ in results], dtype=float)
+        return probs @ bounds if np.isfinite(bounds).all() else -np.inf
+
+    def plans_of(results, y_before, starts_before):
+        """the y and solution of every scenario, the ones before where a MIP stopped without a solution"""
+        failed = [s_pos for s_pos, (_, y, _) in enumerate(results) if y is None]
+        if failed and verbose:
+            print(f"PH: no solution in time for scenarios {failed}, they keep their last plan")
+        return (np.array([y_before[s_pos] if y is None else y for s_pos, (_, y, _) in enumerate(results)]),
+                [starts_before[s_pos] if sol is None else sol for s_pos, (_, _, sol) in enumerate(results)])
+
+    # a greedy/drop plan of every scenario (see warm_start.py) to start the first MIPs from, and
+    # for a scenario to keep if its MIP finds nothing in time
+    heuristic_y, heuristic_starts = [None] * nS, [None] * nS
+    for s_pos in range(nS):
+        model = build_mecwlp(scenario_instance(inst, s_pos), **build_kwargs)
+        sol, _ = heuristic_start(model, backend, verbose=False)
+        if sol is not None:
+            heuristic_y[s_pos], heuristic_starts[s_pos] = model.y_values(sol), sol
+
+    mips = _ScenarioMips(inst, backend, workers, build_kwargs)
+    try:
+        # iteration 0, every scenario on its own. Its bound is the wait-and-see bound
+        results = mips.solve(no_change, heuristic_starts, limit())
+        lower = bound_of(results)
+        solved = [y for _, y, _ in results if y is not None] + [y for y in heuristic_y if y is not None]
+        if not solved:
+            raise RuntimeError("PH: no scenario MIP found a solution in the first round")
+        # a scenario with no plan at all starts from the others' rounded average
+        fallback = np.mean(solved, axis=0) >= .5
+        y_scenarios, starts = plans_of(
+            results, [fallback if y is None else y for y in heuristic_y], heuristic_starts
+        )
+        ybar = np.tensordot(probs, y_scenarios, axes=1)
+        w = rho * (y_scenarios - ybar)
+
+        history = [(0, np.inf, lower, perf_counter() - start)]
+        converged = False
+        iteration = 0
+        for iteration in range(1, max_iterations + 1):
+            # w_s + rho/2 (1 - 2 ybar) is the linearised penalty on y
+            changes = [w[s_pos] + rho / 2 * (1 - 2 * ybar) for s_pos in range(nS)]
+            results = mips.solve(changes, starts, limit())
+            y_scenarios, starts = plans_of(results, y_scenarios, starts)
+
+            ybar = np.tensordot(probs, y_scenarios, axes=1)
+            w += rho * (y_scenarios - ybar)
+            disagreement = probs @ np.abs(y_scenarios - ybar).reshape(nS, -1).mean(axis=1)
+
+            out_of_time = time_limit is not None and perf_counter() - start > time_limit
+            if bound_every and iteration % bound_every == 0 and not out_of_time:
+                # w still sums to zero over the scenarios so this is a valid bound
+                results = mips.solve(list(w), starts, limit())
+                lower = max(lower, bound_of(results))
+
+            elapsed = perf_counter() - start
+            history.append((iteration, disagreement, lower, elapsed))
+            if verbose:
+                print(f"PH it {iteration:>3}: disagreement {disagreement:.4f} lower {lower:>14,.0f} "
+                      f"{pretty_print_seconds(elapsed)}")
+
+            if disagreement <= conv_tol:
+                converged = True
+                break
+            if time_limit is not None and elapsed > time_limit:
+                if verbose:
+                    print("PH: out of time")
+                break
+    finally:
+        mips.close()
+
+    # the consensus plan rounded and the union of the scenario plans, and if neither can be costed for
+    # every scenario the greedy/drop plans of the scenarios. The cheapest plan costed for every scenario wins
+    best = None
+    def first_stage_of(y):
+        return (warehouse_costs(inst) * y).sum()
+    with ScenarioSolver(inst, limited(backend, eval_time_limit), workers, integer=True, **build_kwargs) as scenarios:
+        fallbacks = [y for y in heuristic_y if y is not None]
+        for plans in (consensus_plans(y_scenarios, probs), fallbacks):
+            tried = []
+            for y in plans:
+                if any(np.array_equal(y, other) for other in tried):
+                    continue
+                tried.append(y)
+                results = scenarios.solve(y)
+                if not all(ok for ok, _, _, _ in results):
+                    continue
+                recourse = np.array([value for _, value, _, _ in results])
+                total = first_stage_of(y) + probs @ recourse
+                if best is None or total < best[0]:
+                    best = (total, y, first_stage_of(y), recourse, scenarios.models(),
+                            [sol for _, _, _, sol in results])
+            if best is not None:
+                break
+
+    if best is None:
+        # keep the consensus plan, its breakdown then has each scenario's flows for that scenario's own plan
+        warnings.warn("PH: no plan could be costed for every scenario, upper_bound is inf")
+        y = consensus_plans(y_scenarios, probs)[0]
+        models = [build_mecwlp(scenario_instance(inst, s_pos), **build_kwargs) for s_pos in range(nS)]
+        best = (np.inf, y, first_stage_of(y), np.full(nS, np.nan), models, starts)
+    upper, y, first_stage, recourse, models, solutions = best
+
+    if verbose:
+        print(f"PH: plan costs {upper:,.0f}, lower bound {lower:,.0f}")
+    return PHResult(
+        instance=inst,
+        y=y.astype(int),
+        lower_bound=lower,
+        upper_bound=upper,
+        first_stage_cost=first_stage,
+        recourse_costs=recourse,
+        iterations=iteration,
+        scenario_models=models,
+        scenario_solutions=solutions,
+        history=history,
+        converged=converged,
+    )
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# =============================================================================
+# Pre-solve reductions that throw away variables which will never be used,
+# e.g. a customer in Aberdeen is never going to be served from Cornwall.
+# =============================================================================
+
+
+def grid_coords(df:pd.DataFrame, ids=None):
+    """(Easting, Northing) of ``ids`` as an n x 2 array, British National Grid so distances are in metres"""
+    df = df if ids is None else df.loc[ids]
+    return df[["X (Easting)", "Y (Northing)"]].to_numpy(dtype=np.float64)
+
+
+def nearest_candidate_mask(cust_xy, cand_xy, k=None, radius=None):
+    """
+    customers x candidates boolean array, True where customer i may be served from candidate j.
+
+    Uses a KD-tree over the candidate coordinates so nothing customers x candidates sized
+    is ever computed apart from the mask itself.
+
+    :param k: keep the k nearest candidates of each customer
+    :param radius: keep every candidate within this many metres. With both, a candidate is kept
+        if it is either, and every customer always keeps at least its nearest candidate
+    """
+    if k is None and radius is None:
+        raise ValueError("give k and/or radius")
+
+    cust_xy, cand_xy = np.asarray(cust_xy), np.asarray(cand_xy)
+    nI, nJ = len(cust_xy), len(cand_xy)
+    tree = cKDTree(cand_xy)
+    mask = np.zeros((nI, nJ), dtype=bool)
+
+    k_eff = 1 if k is None else min(int(k), nJ)
+    _, nearest = tree.query(cust_xy, k=k_eff)
+    nearest = np.asarray(nearest).reshape(nI, k_eff)
+    mask[np.arange(nI)[:, None], nearest] = True
+
+    if radius is not None:
+        for i, js in enumerate(tree.query_ball_point(cust_xy, r=radius)):
+            mask[i, js] = True
+
+    return mask
+
+
+def cheapest_supplier_mask(inst, n=5, stock_ratio=1.0, cover=1.0, verbose=True):
+    """
+    suppliers x candidates boolean array keeping, for every candidate and product group, only the
+    ``n`` cheapest suppliers of that product plus however many more (cheapest first) it takes for
+    their combined capacity to cover ``cover`` times the peak demand for the product. So even if a
+    single warehouse ends up serving everyone it can still reach enough stock.
+
+    Every other supplier is dominated for that candidate by closer suppliers with spare stock.
+
+    :param inst: the MecwlpInstance the model is built from
+    :param stock_ratio: share of deliveries that has to come in from suppliers (.8 in the stochastic model)
+    """
+    costs = inst.cost_supplier_candidate
+    nK, nJ = costs.shape
+    mask = np.zeros((nK, nJ), dtype=bool)
+
+    # product x period x scenario total demand, then the worst period and scenario
+    peak_demand = inst.demand.sum(axis=0).max(axis=(1, 2))
+
+    for p_pos, p in enumerate(inst.products):
+        sups = np.flatnonzero(inst.supplier_product == p)
+        if len(sups) == 0:
+            continue
+        need = stock_ratio * cover * peak_demand[p_pos]
+
+        # rank this product's suppliers by cost for every candidate
+        order = np.argsort(costs[sups], axis=0, kind="stable")
+        caps = inst.supplier_capacity[sups][order]
+        stock_before = np.cumsum(caps, axis=0) - caps
+        keep = (np.arange(len(sups))[:, None] < n) | (stock_before < need)
+
+        mask[sups[order], np.arange(nJ)[None, :]] = keep
+
+    if verbose:
+        per_pair = len(inst.periods) * len(inst.scenarios)
+        print(f"supplier pruning removed {(~mask).sum()*per_pair:,} of {mask.size*per_pair:,} z columns")
+    return mask
+
+
+def solve_with_pruning(build_and_solve, cust_xy, cand_xy, k=10, radius=None, grow=2, max_rounds=10):
+    """
+    Solve a model with the customer -> candidate pairs pruned to the nearest candidates,
+    and widen the pruning whenever it makes the model infeasible.
+
+    :param build_and_solve: function taking the customers x candidates mask (None means keep every pair)
+        and returning ``(result, infeasible)``. Only PROVEN infeasibility widens the pruning, running
+        out of time without a solution does not.
+    :param grow: k and radius are multiplied by this every time the pruned model is infeasible
+    :return: result of the last build_and_solve and the mask it used
+    """
+    nJ = len(cand_xy)
+    for _ in range(max_rounds):
+        mask = nearest_candidate_mask(cust_xy, cand_xy, k=k, radius=radius)
+        if mask.all():
+            mask = None     # nothing left to prune, so save the solver the bookkeeping
+
+        result, infeasible = build_and_solve(mask)
+        if not infeasible or mask is None:
+            return result, mask
+
+        k = None if k is None else min(int(np.ceil(k * grow)), nJ)
+        radius = None if radius is None else radius * grow
+        print(f"pruned model is infeasible, widening to {k=} {radius=}")
+
+    # still infeasible after widening that many times, the full model decides
+    return build_and_solve(None)[0], None
@@ -0,0 +1,123 @@
+import numpy as np
+from dataclasses import replace
+from model_builder import MecwlpInstance
+
+# =============================================================================
+# Scenario reduction for the demand scenarios.
+#
+# Rather than keeping the first few scenarios and throwing the rest away, pick
+# the n scenarios that best represent all of them and give each the probability
+# of the scenarios closest to it. Every scenario is one point, its whole
+# customer x product x period demand, and scenarios are compared by the
+# euclidean distance between those points.
+#
+#   keep, probs = reduce_scenarios(demand, 5)
+#   demand[..., keep] with probabilities probs
+# =============================================================================
+
+
+def scenario_distances(demand):
+    """scenario x scenario distances, ``demand`` has the scenarios on its last axis"""
+    points = np.asarray(demand, dtype=np.float64).reshape(-1, demand.shape[-1]).T
+    sq = (points ** 2).sum(axis=1)
+    d2 = sq[:, None] + sq[None, :] - 2 * points @ points.T
+    return np.sqrt(np.maximum(d2, 0))
+
+
+def redistribute(dist, probs, keep):
+    """the probability of every scenario goes to the nearest one that's kept"""
+    keep = np.asarray(keep)
+    nearest = keep[dist[:, keep].argmin(axis=1)]
+    nearest[keep] = keep
+    new_probs = np.zeros(len(probs))
+    np.add.at(new_probs, nearest, probs)
+    return new_probs[keep], nearest
+
+
+def fast_forward(dist, probs, n):
+    """
+    Fast forward selection (Heitsch & Roemisch): add one scenario at a time, always the one that
+    brings the probability weighted distance of every scenario to its nearest kept one down the most.
+
+    :return: positions of the kept scenarios in the order they were picked
+    """
+    nS = len(probs)
+    # c[k, u] distance from k to the nearest kept scenario if u was added as well
+    c = dist.copy()
+    keep = []
+    remaining = np.ones(nS, dtype=bool)
+    for _ in range(n):
+        # scenarios already kept don't count (and c[u, u] is 0 anyway)
+        cost = probs @ (c * remaining[:, None])
+        cost[~remaining] = np.inf
+        u = int(cost.argmin())
+        keep.append(u)
+        remaining[u] = False
+        c = np.minimum(c, c[:, [u]])
+    return np.array(keep)
+
+
+def k_medoids(dist, probs, n, max_iterations=100):
+    """
+    Probability weighted k-medoids started from fast forward selection: assign every scenario to
+    its nearest medoid, move each medoid to the member closest (weighted) to the rest of its group,
+    repeat until nothing moves.
+    """
+    keep = fast_forward(dist, probs, n)
+    for _ in range(max_iterations):
+        group = dist[:, keep].argmin(axis=1)
+        new_keep = keep.copy()
+        for g in range(n):
+            members = np.flatnonzero(group == g)
+            if len(members) == 0:
+                # only happens when two scenarios are identical
+                continue
+            within = probs[members] @ dist[np.ix_(members, members)]
+            new_keep[g] = members[within.argmin()]
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+    return keep
+
+
+METHODS = {
+    "fast_forward": fast_forward,
+    "k_medoids": k_medoids,
+}
+
+
+def reduce_scenarios(demand, n, probs=None, method="fast_forward"):
+    """
+    Pick ``n`` representative scenarios.
+
+    :param demand: customer x product x period x scenario demand
+    :param probs: probability of each scenario, defaults to all equally likely
+    :param method: "fast_forward" or "k_medoids"
+    :return: positions of the kept scenarios (sorted) and their new probabilities
+    """
+    nS = demand.shape[-1]
+    probs = np.full(nS, 1 / nS) if probs is None else np.asarray(probs, dtype=np.float64)
+    if n >= nS:
+        return np.arange(nS), probs
+    try:
+        select = METHODS[method]
+    except KeyError:
+        raise ValueError(f"unknown scenario reduction {method!r}, pick one of {list(METHODS)}") from None
+
+    dist = scenario_distances(demand)
+    keep = np.sort(select(dist, probs, n))
+    new_probs, _ = redistribute(dist, probs, keep)
+    return keep, new_probs
+
+
+def reduction_distance(demand, keep, probs=None):
+    """probability weighted distance from every scenario to its nearest kept one, how much was lost"""
+    nS = demand.shape[-1]
+    probs = np.full(nS, 1 / nS) if probs is None else np.asarray(probs)
+    return probs @ scenario_distances(demand)[:, keep].min(axis=1)
+
+
+def reduce_instance(inst:MecwlpInstance, n, method="fast_forward") -> MecwlpInstance:
+    """``inst`` with only ``n`` of its scenarios, reweighted"""
+    keep, probs = reduce_scenarios(inst.demand, n, inst.scenario_probs, method)
+    return replace(inst, scenarios=inst.scenarios[keep], demand=inst.demand[..., keep], scenario_probs=probs)
@@ -0,0 +1,211 @@
+import numpy as np
+import scipy.sparse as sp
+import copy
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from itertools import repeat
+from model_builder import MatrixModel, MecwlpInstance, MecwlpModel, build_mecwlp
+from solver_backends import SolverBackend, make_backend, INFEASIBLE
+
+# =============================================================================
+# The per scenario flow (x, z) problems of the stochastic MECWLP.
+#
+# Once the warehouse plan y[j,t] is fixed the scenarios have nothing to do with
+# each other, so each one is its own (LP or MIP) flow problem. ScenarioSolver
+# solves all of them for a plan, either here or fanned out over worker
+# processes, and is what benders.py (and anything else that evaluates plans) uses.
+# =============================================================================
+
+
+def scenario_instance(inst:MecwlpInstance, s_pos):
+    """``inst`` with only scenario ``s_pos`` (a position) in it, with probability 1"""
+    return replace(
+        inst,
+        scenarios=inst.scenarios[[s_pos]],
+        demand=inst.demand[..., [s_pos]],
+        scenario_probs=np.ones(1),
+    )
+
+
+def recourse_model(inst:MecwlpInstance, s_pos, integer=False, **build_kwargs):
+    """
+    The flow problem of scenario ``s_pos`` for a given plan: the single scenario MECWLP with the
+    y columns free of cost (they are fixed by their bounds, see fix_plan) and x relaxed unless ``integer``.
+
+    :param build_kwargs: passed on to build_mecwlp, e.g. stock_ratio, exact_stock, supply_only_open
+    """
+    model = build_mecwlp(scenario_instance(inst, s_pos), **build_kwargs)
+    c = model.matrix.c.copy()
+    c[model.y_cols] = 0.0
+    integrality = model.matrix.integrality if integer else np.zeros(model.matrix.n_cols, dtype=bool)
+    integrality = integrality.copy()
+    integrality[model.y_cols] = False
+    return replace(model, matrix=replace(model.matrix, c=c, integrality=integrality))
+
+
+def fix_plan(model:MecwlpModel, y):
+    """the model's matrix with y[j,t] fixed to the candidate x period 0/1 array ``y``"""
+    col_lb, col_ub = model.matrix.col_lb.copy(), model.matrix.col_ub.copy()
+    col_lb[model.y_cols] = y
+    col_ub[model.y_cols] = y
+    return replace(model.matrix, col_lb=col_lb, col_ub=col_ub)
+
+
+def phase_one(matrix:MatrixModel):
+    """
+    ``matrix`` with an artificial column on every side of every row that has a bound, costing 1
+    while everything else costs 0. Its optimum is 0 exactly when ``matrix`` is feasible.
+    """
+    rows_lb = np.flatnonzero(np.isfinite(matrix.row_lb))
+    rows_ub = np.flatnonzero(np.isfinite(matrix.row_ub))
+    n_art = len(rows_lb) + len(rows_ub)
+
+    # +a on rows that can be too small, -a on rows that can be too big
+    art = sp.csr_array(
+        (
+            np.r_[np.ones(len(rows_lb)), -np.ones(len(rows_ub))],
+            (np.r_[rows_lb, rows_ub], np.arange(n_art)),
+        ),
+        shape=(matrix.n_rows, n_art),
+    )
+    return replace(
+        matrix,
+        name=f"{matrix.name} phase one",
+        c=np.r_[np.zeros(matrix.n_cols), np.ones(n_art)],
+        A=sp.hstack([matrix.A, art], format="csr"),
+        col_lb=np.r_[matrix.col_lb, np.zeros(n_art)],
+        col_ub=np.r_[matrix.col_ub, np.full(n_art, np.inf)],
+        integrality=np.r_[np.zeros(matrix.n_cols, dtype=bool), np.zeros(n_art, dtype=bool)],
+    )
+
+
+def solve_recourse(model:MecwlpModel, y, backend:SolverBackend, feas_tol=1e-6):
+    """
+    Solve the flow LP of one scenario for the plan ``y``.
+
+    :return: ``(feasible, value, subgradient, solution)``. When feasible, value is the flow cost and
+        the subgradient (candidate x period) its slope in y. When not, both describe the phase one
+        infeasibility instead and solution is None. Integer flow problems have no subgradient (None)
+        and an infeasible one is just ``(False, inf, None, None)``. One that stopped (time limit)
+        without a solution is ``(False, nan, None, None)``, the plan isn't evaluated.
+    """
+    result = backend.solve(fix_plan(model, y))
+    if result.has_solution:
+        grad = None if result.reduced_costs is None else result.reduced_costs[model.y_cols]
+        return True, result.objval, grad, result.x
+    if model.matrix.integrality.any() and result.status != INFEASIBLE:
+        return False, np.nan, None, None
+    if result.status != INFEASIBLE:
+        raise RuntimeError(f"flow problem of {model.matrix.name} ended with status {result.status!r}")
+    if model.matrix.integrality.any():
+        # a MIP has no duals to make a cut from
+        return False, np.inf, None, None
+
+    result = backend.solve(phase_one(fix_plan(model, y)))
+    if not result.has_solution:
+        raise RuntimeError(f"phase one of {model.matrix.name} ended with status {result.status!r}")
+    if result.objval <= feas_tol:
+        # the solver called it infeasible but it's only just, take the phase one solution as it is
+        return True, 0.0, np.zeros(model.y_cols.shape), result.x[:model.matrix.n_cols]
+    return False, result.objval, result.reduced_costs[model.y_cols], None
+
+
+# ---------------------------------------------------------------------------
+# worker process side. The instance (demand and all) is sent once, when the
+# worker starts, each task then only carries a scenario position and the plan.
+# A worker builds a scenario's model the first time it gets that scenario.
+# ---------------------------------------------------------------------------
+_worker = {}
+
+
+def _init_worker(inst, backend, integer, build_kwargs):
+    _worker.update(inst=inst, backend=backend, integer=integer, build_kwargs=build_kwargs, models={})
+
+
+def _solve_scenario(s_pos, y):
+    models = _worker["models"]
+    if s_pos not in models:
+        models[s_pos] = recourse_model(_worker["inst"], s_pos, _worker["integer"], **_worker["build_kwargs"])
+    return solve_recourse(models[s_pos], y, _worker["backend"])
+
+
+class ScenarioSolver:
+    """
+    Solves the flow problem of every scenario of ``inst`` for a given warehouse plan.
+
+    With ``workers`` > 1 the scenarios are spread over that many processes, each running its solver
+    on a single thread, otherwise they are solved one after the other in this process. Results always
+    come back in scenario order. Use it as a context manager (or call close) so the workers are shut down.
+
+    On windows processes are started by re-importing the main script, so a script using workers
+    needs its code under ``if __name__ == "__main__":``.
+
+    :param backend: solver_backends backend or the name of one
+    :param integer: keep x binary in the flow problems, otherwise they are LPs
+    :param build_kwargs: passed on to build_mecwlp, e.g. ``stock_ratio=.8, exact_stock=True, supply_only_open=True``
+    """
+
+    def __init__(self, inst:MecwlpInstance, backend="highs", workers=None, integer=False, **build_kwargs):
+        self.inst = inst
+        self.backend = make_backend(backend)
+        self.integer = integer
+        self.build_kwargs = build_kwargs
+        self.workers = workers if workers is not None and workers > 1 else None
+        self._models = {}
+        self._pool = None
+
+        if self.workers is not None:
+            worker_backend = copy.copy(self.backend)
+            worker_backend.threads = 1
+            # any worker can get any scenario, so each gets every scenario's demand, once
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(inst, worker_backend, integer, build_kwargs),
+            )
+
+    def model(self, s_pos) -> MecwlpModel:
+        """the flow problem of scenario ``s_pos``, built the first time it's asked for"""
+        if s_pos not in self._models:
+            self._models[s_pos] = recourse_model(self.inst, s_pos, self.integer, **self.build_kwargs)
+        return self._models[s_pos]
+
+    def models(self):
+        return [self.model(s_pos) for s_pos in range(len(self.inst.scenarios))]
+
+    def solve(self, y):
+        """
+        Solve every scenario for the candidate x period plan ``y``.
+
+        :return: list with the ``(feasible, value, subgradient, solution)`` of solve_recourse for each scenario
+        """
+        s_positions = range(len(self.inst.scenarios))
+        if self._pool is None:
+            return [solve_recourse(self.model(s_pos), y, self.backend) for s_pos in s_positions]
+
+        # map hands the results back in the order the scenarios went in
+        return list(self._pool.map(_solve_scenario, s_positions, repeat(y)))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def evaluate_plan(inst:MecwlpInstance, y, backend="highs", workers=None, integer=True, **build_kwargs):
+    """
+    Expected flow cost of the warehouse plan ``y`` (candidate x period) over the scenarios of ``inst``.
+
+    :return: the expected flow cost and the flow cost of each scenario (inf where the plan is infeasible,
+        nan where the solver stopped without an answer)
+    """
+    with ScenarioSolver(inst, backend, workers, integer, **build_kwargs) as solver:
+        results = solver.solve(y)
+    costs = np.array([value if ok or np.isnan(value) else np.inf for ok, value, _, _ in results])
+    return inst.scenario_probs @ costs, costs
@@ -0,0 +1,114 @@
+import numpy as np
+from dataclasses import dataclass, asdict
+from time import perf_counter
+
+# =============================================================================
+# How a MIP solve got to its answer, recorded from the solver's callbacks
+# (see solver_backends.py): every new incumbent, plus the incumbent and bound
+# every `interval` seconds in between.
+#
+#   result = backend.solve(model.matrix)
+#   time_to_first_solution(result.progress), time_to_gap(result.progress, .05)
+#
+# experiment_runner.py keeps the points with every run, so time limits can be
+# picked from how long the runs actually took to get within a few percent.
+# =============================================================================
+
+SOLUTION = "solution"   # the solver found a better solution
+SAMPLE = "sample"       # a regular sample while it works
+END = "end"             # the final figures, once the solve is over
+
+
+@dataclass
+class ProgressPoint:
+    """Where the solve was ``elapsed`` seconds in, nan where there is no incumbent (or bound) yet"""
+    elapsed: float
+    incumbent: float
+    bound: float
+    gap: float
+    nodes: int
+    lp_iterations: int = None  # HiGHS doesn't give these until the end
+    event: str = SAMPLE
+
+
+def relative_gap(incumbent, bound):
+    """the gap as SolveResult.mip_gap works it out, nan without both"""
+    if not (np.isfinite(incumbent) and np.isfinite(bound)):
+        return np.nan
+    return abs(incumbent - bound) / (1e-10 + abs(incumbent))
+
+
+def finite_or_nan(value):
+    # the solvers use +-inf or 1e+40 for "nothing yet"
+    return float(value) if value is not None and abs(value) < 1e30 else np.nan
+
+
+class ProgressRecorder:
+    """
+    Collects the points of one solve, the backends call it from their callbacks.
+
+    :param interval: seconds between samples, new solutions are always kept
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.points = []
+        self.start = perf_counter()
+        self._last_sample = -np.inf
+
+    def due(self):
+        """whether a sample is wanted now"""
+        return perf_counter() - self.start - self._last_sample >= self.interval
+
+    def record(self, incumbent, bound, nodes, lp_iterations=None, event=SAMPLE):
+        elapsed = perf_counter() - self.start
+        if event == SAMPLE:
+            self._last_sample = elapsed
+        incumbent, bound = finite_or_nan(incumbent), finite_or_nan(bound)
+        self.points.append(ProgressPoint(
+            elapsed=elapsed,
+            incumbent=incumbent,
+            bound=bound,
+            gap=relative_gap(incumbent, bound),
+            nodes=None if nodes is None else int(nodes),
+            lp_iterations=None if lp_iterations is None or lp_iterations < 0 else int(lp_iterations),
+            event=event,
+        ))
+
+
+def time_to_first_solution(progress):
+    """seconds until the first incumbent, nan if there never was one"""
+    for p in progress:
+        if np.isfinite(p.incumbent):
+            return p.elapsed
+    return np.nan
+
+
+def time_to_gap(progress, gap):
+    """seconds until the gap was at most ``gap`` (.05 is 5%), nan if it never got there"""
+    for p in progress:
+        if np.isfinite(p.gap) and p.gap <= gap:
+            return p.elapsed
+    return np.nan
+
+
+def progress_records(progress):
+    """the points as dicts for a JSON results file, nan as None"""
+    return [
+        {k: (None if isinstance(v, float) and not np.isfinite(v) else v) for k, v in asdict(p).items()}
+        for p in progress
+    ]
+
+
+def progress_from_records(records):
+    """ProgressPoints back from progress_records"""
+    return [ProgressPoint(**{k: (np.nan if v is None and k in ("incumbent", "bound", "gap") else v)
+                             for k, v in r.items()}) for r in records]
+
+
+def progress_summary(progress, gaps=(.1, .05, .01)):
+    """time_to_first_solution and time_to_<gap>pct_gap for each of ``gaps``, nan where it never got there"""
+    summary = dict(time_to_first_solution=time_to_first_solution(progress))
+    for gap in gaps:
+        summary[f"time_to_{gap*100:g}pct_gap"] = time_to_gap(progress, gap)
+    return summary
@@ -0,0 +1,364 @@
+import numpy as np
+import platform
+from dataclasses import dataclass, field
+from time import perf_counter
+from instrumentation import laps, traced
+from model_builder import MatrixModel
+from solve_progress import ProgressRecorder, SOLUTION, SAMPLE, END
+
+# neither solver has to be installed, only the one you actually use
+try:
+    import xpress as xp
+except ImportError:
+    xp = None
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+# =============================================================================
+# One interface over the solvers. Every model is built as a MatrixModel
+# (see model_builder.py) and handed to a backend, so the same matrix can be
+# solved with Xpress or with HiGHS (no licence, no size limit) and compared.
+#
+#   backend = make_backend("highs", time_limit=20*60, rel_gap=.05, threads=1)
+#   result = backend.solve(model.matrix)
+#   result.status, result.objval, result.x
+#   result.progress     # incumbent and bound over time for a MIP (see solve_progress.py)
+# =============================================================================
+
+OPTIMAL = "optimal"
+FEASIBLE = "feasible"       # stopped with a solution that is not proven optimal
+INFEASIBLE = "infeasible"
+UNBOUNDED = "unbounded"
+NO_SOLUTION = "no solution" # stopped (time limit etc) before finding anything
+
+
+@dataclass
+class SolveResult:
+    """What came out of a solve, the same whichever solver did it"""
+    status: str
+    objval: float
+    bestbound: float
+    x: np.ndarray
+    solve_time: float
+    backend: str
+    raw: object = field(default=None, repr=False) # the solver's own problem object, for anything solver specific
+    reduced_costs: np.ndarray = field(default=None, repr=False) # only for LPs
+    duals: np.ndarray = field(default=None, repr=False)         # only for LPs
+    progress: list = field(default_factory=list, repr=False)     # solve_progress.ProgressPoints, only for MIPs
+
+    @property
+    def has_solution(self):
+        return self.status in (OPTIMAL, FEASIBLE)
+
+    @property
+    def mip_gap(self):
+        return abs(self.objval - self.bestbound) / (1e-10 + abs(self.objval))
+
+
+class SolverBackend:
+    """
+    Base class of the solver adapters.
+
+    :param time_limit: seconds, None for no limit
+    :param rel_gap: stop once the relative MIP gap is below this (miprelstop / mip_rel_gap)
+    :param threads: solver threads, None lets the solver decide
+    :param verbose: show the solver log
+    :param progress_interval: for MIPs keep the incumbent and bound this often (seconds) and at every
+        new solution in ``SolveResult.progress``, None doesn't track them
+    """
+    name = "base"
+
+    def __init__(self, time_limit=None, rel_gap=None, threads=None, verbose=False, progress_interval=1.0):
+        self.time_limit = time_limit
+        self.rel_gap = rel_gap
+        self.threads = threads
+        self.verbose = verbose
+        self.progress_interval = progress_interval
+
+    def solve(self, model:MatrixModel, mip_start=None, cutoff=None) -> SolveResult:
+        """
+        :param mip_start: a starting solution for a MIP, either a value for every column or a
+            ``(columns, values)`` pair for only some of them (the solver fills in the rest)
+        :param cutoff: for a MIP, throw away any node or solution with an objective above this
+            (mipabscutoff / objective_bound), e.g. the cost of a plan you already have
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}(time_limit={self.time_limit}, rel_gap={self.rel_gap}, threads={self.threads})"
+
+
+def split_mip_start(model:MatrixModel, mip_start):
+    """``(columns, values)`` of a mip_start given either way round"""
+    if isinstance(mip_start, tuple):
+        cols, values = mip_start
+        return np.asarray(cols, dtype=np.int64).ravel(), np.asarray(values, dtype=np.float64).ravel()
+    values = np.asarray(mip_start, dtype=np.float64)
+    if len(values) != model.n_cols:
+        raise ValueError(f"mip_start has {len(values)} values for {model.n_cols} columns")
+    return np.arange(model.n_cols), values
+
+
+def load_into_xpress(prob, model:MatrixModel):
+    """Load ``model`` into the empty xpress problem ``prob`` in one call"""
+    A = model.A.tocsc()
+    lb, ub = model.row_lb, model.row_ub
+    has_lb, has_ub = np.isfinite(lb), np.isfinite(ub)
+
+    rowtype = np.full(model.n_rows, "N")
+    rowtype[has_ub & ~has_lb] = "L"
+    rowtype[has_lb & ~has_ub] = "G"
+    rowtype[has_lb & has_ub] = "R"
+    rowtype[has_lb & has_ub & (lb == ub)] = "E"
+    rhs = np.where(has_ub, ub, np.where(has_lb, lb, 0.0))
+    rng = np.where(rowtype == "R", ub - lb, 0.0)
+
+    col_lb = np.where(np.isfinite(model.col_lb), model.col_lb, -xp.infinity)
+    col_ub = np.where(np.isfinite(model.col_ub), model.col_ub, xp.infinity)
+
+    args = dict(
+        probname=model.name, rowtype=rowtype.tolist(), rhs=rhs, rng=rng, objcoef=model.c,
+        start=A.indptr, collen=None, rowind=A.indices, rowcoef=A.data, lb=col_lb, ub=col_ub,
+    )
+    entind = np.flatnonzero(model.integrality)
+    if len(entind):
+        binary = (model.col_lb[entind] == 0) & (model.col_ub[entind] == 1)
+        prob.loadMIP(**args, coltype=np.where(binary, "B", "I").tolist(), entind=entind)
+    else:
+        prob.loadLP(**args)
+    prob.chgObjSense(xp.minimize)
+
+
+def xpress_result(prob, solve_time=np.nan):
+    """SolveResult of an already solved xpress problem"""
+    status = {
+        xp.SolStatus.OPTIMAL: OPTIMAL,
+        xp.SolStatus.FEASIBLE: FEASIBLE,
+        xp.SolStatus.INFEASIBLE: INFEASIBLE,
+        xp.SolStatus.UNBOUNDED: UNBOUNDED,
+    }.get(prob.attributes.solstatus, NO_SOLUTION)
+
+    has_solution = status in (OPTIMAL, FEASIBLE)
+    objval = prob.attributes.objval if has_solution else np.nan
+    is_mip = prob.attributes.mipents + prob.attributes.sets > 0
+    bestbound = prob.attributes.bestbound if is_mip else objval
+    lp_duals = has_solution and not is_mip
+
+    return SolveResult(
+        status=status,
+        objval=objval,
+        bestbound=bestbound,
+        x=np.asarray(prob.getSolution()) if has_solution else None,
+        solve_time=solve_time,
+        backend="xpress",
+        raw=prob,
+        reduced_costs=np.asarray(prob.getRedCosts()) if lp_duals else None,
+        duals=np.asarray(prob.getDuals()) if lp_duals else None,
+    )
+
+
+def watch_xpress(prob, interval):
+    """ProgressRecorder fed by the callbacks of the xpress problem ``prob``"""
+    recorder = ProgressRecorder(interval)
+
+    def record(prob, event):
+        a = prob.attributes
+        recorder.record(a.mipobjval if a.mipsols > 0 else np.nan, a.bestbound, a.nodes, a.simplexiter, event)
+
+    def on_solution(prob, data):
+        record(prob, SOLUTION)
+
+    # checktime is called very often, only sample every so often
+    def on_check(prob, data):
+        if recorder.due():
+            record(prob, SAMPLE)
+
+    prob.addIntsolCallback(on_solution, None, 0)
+    prob.addCheckTimeCallback(on_check, None, 0)
+    return recorder
+
+
+# xp.init only has to happen once per process, not for every backend
+_xpress_initialised = False
+
+
+class XpressBackend(SolverBackend):
+    name = "xpress"
+
+    def __init__(self, *args, **kwargs):
+        global _xpress_initialised
+        if xp is None:
+            raise ImportError("the xpress backend needs the xpress package, pip install xpress")
+        super().__init__(*args, **kwargs)
+        if platform.system()== "Windows" and not _xpress_initialised:
+            xp.init('c:/xpressmp/bin/xpauth.xpr')
+            _xpress_initialised = True
+
+    @traced("solve")
+    def solve(self, model:MatrixModel, mip_start=None, cutoff=None) -> SolveResult:
+        lap = laps()
+        lap("load model", backend="xpress", rows=model.n_rows, cols=model.n_cols)
+        prob = xp.problem(model.name)
+        prob.controls.outputlog = int(self.verbose)
+        load_into_xpress(prob, model)
+        if mip_start is not None and model.integrality.any():
+            cols, values = split_mip_start(model, mip_start)
+            prob.addMipSol(values, cols, "start")
+        if cutoff is not None and model.integrality.any():
+            prob.controls.mipabscutoff = cutoff
+
+        if self.time_limit is not None:
+            prob.controls.maxtime = -int(np.ceil(self.time_limit)) # negative means stop even without a solution
+        if self.rel_gap is not None:
+            prob.controls.miprelstop = self.rel_gap
+        if self.threads is not None:
+            prob.controls.threads = self.threads
+
+        recorder = None
+        if self.progress_interval is not None and model.integrality.any():
+            recorder = watch_xpress(prob, self.progress_interval)
+        lap("optimise")
+        start = perf_counter()
+        prob.solve()
+        solve_time = perf_counter() - start
+        lap("get solution")
+        result = xpress_result(prob, solve_time)
+        lap.end()
+        if recorder is not None:
+            recorder.record(result.objval, result.bestbound, prob.attributes.nodes, prob.attributes.simplexiter, END)
+            result.progress = recorder.points
+        return result
+
+
+def bounded_below(model:MatrixModel):
+    """whether the objective can't go to -inf, every column with a cost is bounded on the side that lowers it"""
+    return bool(np.all(((model.c >= 0) | np.isfinite(model.col_ub)) & ((model.c <= 0) | np.isfinite(model.col_lb))))
+
+
+def watch_highs(h, interval):
+    """ProgressRecorder fed by the MIP callbacks of the highspy.Highs ``h``"""
+    recorder = ProgressRecorder(interval)
+
+    def record(e, event):
+        out = e.data_out
+        # simplex_iteration_count is -1 in the MIP callbacks, the recorder keeps None for it
+        recorder.record(out.mip_primal_bound, out.mip_dual_bound, out.mip_node_count, out.simplex_iteration_count, event)
+
+    def on_solution(e):
+        record(e, SOLUTION)
+
+    # the interrupt check comes round very often, only sample every so often
+    def on_interrupt(e):
+        if recorder.due():
+            record(e, SAMPLE)
+
+    h.cbMipImprovingSolution.subscribe(on_solution)
+    h.cbMipInterrupt.subscribe(on_interrupt)
+    return recorder
+
+
+class HighsBackend(SolverBackend):
+    name = "highs"
+
+    def __init__(self, *args, **kwargs):
+        if highspy is None:
+            raise ImportError("the highs backend needs highspy, pip install highspy")
+        super().__init__(*args, **kwargs)
+
+    @traced("solve")
+    def solve(self, model:MatrixModel, mip_start=None, cutoff=None) -> SolveResult:
+        h = highspy.Highs()
+        h.setOptionValue("output_flag", self.verbose)
+        if self.time_limit is not None:
+            h.setOptionValue("time_limit", float(self.time_limit))
+        if self.rel_gap is not None:
+            h.setOptionValue("mip_rel_gap", float(self.rel_gap))
+        if self.threads is not None:
+            h.setOptionValue("threads", int(self.threads))
+
+        lap = laps()
+        lap("load model", backend="highs", rows=model.n_rows, cols=model.n_cols)
+        A = model.A.tocsr()
+        inf = highspy.kHighsInf
+        is_mip = model.integrality.any()
+        h.passModel(
+            model.n_cols, model.n_rows, A.nnz,
+            2,  # row wise matrix
+            1,  # minimise
+            0.0,
+            model.c,
+            np.clip(model.col_lb, -inf, inf), np.clip(model.col_ub, -inf, inf),
+            np.clip(model.row_lb, -inf, inf), np.clip(model.row_ub, -inf, inf),
+            A.indptr.astype(np.int32), A.indices.astype(np.int32), A.data,
+            model.integrality.astype(np.int32),
+        )
+        if mip_start is not None and is_mip:
+            cols, values = split_mip_start(model, mip_start)
+            h.setSolution(len(cols), cols.astype(np.int32), values)
+        if cutoff is not None and is_mip:
+            h.setOptionValue("objective_bound", float(cutoff))
+
+        recorder = watch_highs(h, self.progress_interval) if self.progress_interval is not None and is_mip else None
+        lap("optimise")
+        start = perf_counter()
+        h.run()
+        # presolve often can't say which of the two it is. If the objective can't go to -inf it
+        # is infeasible, otherwise solve again without presolve to find out
+        if h.getModelStatus() == highspy.HighsModelStatus.kUnboundedOrInfeasible and not bounded_below(model):
+            h.setOptionValue("presolve", "off")
+            h.run()
+        solve_time = perf_counter() - start
+
+        lap("get solution")
+        model_status = h.getModelStatus()
+        info = h.getInfo()
+        has_solution = info.primal_solution_status == highspy.kSolutionStatusFeasible
+        if model_status == highspy.HighsModelStatus.kOptimal:
+            status = OPTIMAL
+        elif model_status == highspy.HighsModelStatus.kInfeasible:
+            status = INFEASIBLE
+        elif model_status == highspy.HighsModelStatus.kUnboundedOrInfeasible:
+            status = INFEASIBLE if bounded_below(model) else UNBOUNDED
+        elif model_status == highspy.HighsModelStatus.kUnbounded:
+            status = UNBOUNDED
+        else:
+            status = FEASIBLE if has_solution else NO_SOLUTION
+
+        objval = info.objective_function_value if has_solution else np.nan
+        solution = h.getSolution()
+        lp_duals = has_solution and not is_mip and solution.dual_valid
+        result = SolveResult(
+            status=status,
+            objval=objval,
+            bestbound=info.mip_dual_bound if is_mip else objval,
+            x=np.asarray(solution.col_value) if has_solution else None,
+            solve_time=solve_time,
+            backend="highs",
+            raw=h,
+            reduced_costs=np.asarray(solution.col_dual) if lp_duals else None,
+            duals=np.asarray(solution.row_dual) if lp_duals else None,
+        )
+        lap.end()
+        if recorder is not None:
+            recorder.record(result.objval, result.bestbound, info.mip_node_count, info.simplex_iteration_count, END)
+            result.progress = recorder.points
+        return result
+
+
+BACKENDS = {
+    "xpress": XpressBackend,
+    "highs": HighsBackend,
+}
+
+
+def make_backend(name="xpress", **options) -> SolverBackend:
+    """the backend called ``name`` ("xpress" or "highs"), options are those of SolverBackend"""
+    if isinstance(name, SolverBackend):
+        return name
+    try:
+        return BACKENDS[name.lower()](**options)
+    except KeyError:
+        raise ValueError(f"unknown solver {name!r}, pick one of {list(BACKENDS)}") from None
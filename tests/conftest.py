@@ -0,0 +1,44 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# the modules live in the repo root, not in a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from model_builder import MecwlpInstance
+
+
+def small_instance(nJ=3, nI=4, nT=2, nS=2, seed=0):
+    """
+    A MECWLP small enough for the xpress community licence: four product groups, one supplier per
+    group plus a second supplier of group 1, and warehouses that can't take all the demand on their own.
+    """
+    rng = np.random.default_rng(seed)
+    products = np.arange(1, 5)
+    supplier_product = np.r_[products, 1]
+    demand = rng.uniform(10, 100, (nI, len(products), nT, nS))
+    peak = demand.sum(axis=(0, 1)).max()
+    return MecwlpInstance(
+        candidates=np.arange(1, nJ + 1),
+        customers=np.arange(101, 101 + nI),
+        suppliers=np.arange(1001, 1001 + len(supplier_product)),
+        products=products,
+        periods=np.arange(1, nT + 1),
+        scenarios=np.arange(1, nS + 1),
+        demand=demand,
+        cost_supplier_candidate=rng.uniform(.1, 1, (len(supplier_product), nJ)),
+        cost_candidate_customer=rng.uniform(.1, 1, (nJ, nI)),
+        supplier_capacity=np.full(len(supplier_product), peak),
+        supplier_product=supplier_product,
+        candidate_capacity=np.full(nJ, .6 * peak),
+        setup_cost=rng.uniform(500, 1000, nJ),
+        operating_cost=rng.uniform(50, 100, nJ),
+        scenario_probs=np.full(nS, 1 / nS),
+    )
+
+
+@pytest.fixture
+def instance():
+    return small_instance()
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from scipy.cluster.hierarchy import linkage, fcluster
+
+import aggregation_tree
+from aggregation_tree import AggregationTree, aggregation_tree as build_tree, ward_merges
+
+
+def same_partition(a, b):
+    """whether two labellings put the points in the same groups, whatever the groups are numbered"""
+    pairs = set(zip(a, b))
+    return len(pairs) == len(set(a)) == len(set(b))
+
+
+@pytest.fixture
+def districts():
+    rng = np.random.default_rng(3)
+    points = rng.uniform(0, 100, (40, 2))
+    weights = rng.integers(1, 5, 40).astype(float)
+    return np.arange(500, 540), points, weights
+
+
+def test_labels_match_scipy_ward(districts):
+    ids, points, weights = districts
+    tree = AggregationTree(ids, points, weights, *ward_merges(points, weights))
+
+    # a district of weight w is w districts at the same spot for unweighted Ward
+    repeated = np.repeat(np.arange(len(points)), weights.astype(int))
+    Z = linkage(points[repeated], method="ward")
+    for k in (1, 2, 5, 12, 25, 40):
+        expected = fcluster(Z, k, criterion="maxclust")
+        # the copies of a district always end up together
+        expected = expected[np.searchsorted(repeated, np.arange(len(points)))]
+        labels = tree.labels(k)
+        assert sorted(set(labels)) == list(range(k))
+        assert same_partition(labels, expected)
+
+
+def test_centres_are_the_district_nearest_the_weighted_middle(districts):
+    ids, points, weights = districts
+    tree = AggregationTree(ids, points, weights, *ward_merges(points, weights))
+
+    labels, centre_ids = tree.cut(8)
+    assert len(centre_ids) == 8
+    for n, centre_id in enumerate(centre_ids):
+        members = np.flatnonzero(labels == n)
+        middle = np.average(points[members], axis=0, weights=weights[members])
+        nearest = members[np.argmin(((points[members] - middle)**2).sum(axis=1))]
+        assert centre_id == ids[nearest]
+
+
+def test_tree_kept_on_disk(districts, tmp_path, monkeypatch):
+    ids, points, weights = districts
+    monkeypatch.setattr(aggregation_tree, "_trees", {})
+    tree = build_tree(ids, points, weights, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("ward_tree_*.npz"))) == 1
+
+    # a new process only has the file
+    monkeypatch.setattr(aggregation_tree, "_trees", {})
+    monkeypatch.setattr(aggregation_tree, "ward_merges", None)
+    loaded = build_tree(ids, points, weights, cache_dir=tmp_path)
+    for k in (3, 10):
+        assert np.array_equal(loaded.labels(k), tree.labels(k))
+        assert np.array_equal(loaded.cut(k)[1], tree.cut(k)[1])
+
+
+def test_cut_out_of_range(districts):
+    ids, points, weights = districts
+    tree = AggregationTree(ids, points, weights, *ward_merges(points, weights))
+    with pytest.raises(ValueError):
+        tree.labels(0)
+    with pytest.raises(ValueError):
+        tree.labels(len(ids) + 1)
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import clusteringdemand
+from clusteringdemand import calcClusters
+from problem_data import build_problem_data
+
+
+@pytest.fixture
+def districts():
+    """60 districts as read by get_all_data, two products, three periods and two scenarios"""
+    rng = np.random.default_rng(0)
+    ids = np.arange(1, 61)
+    Candidates_df = pd.DataFrame({
+        "X (Easting)": rng.uniform(350_000, 550_000, 60),
+        "Y (Northing)": rng.uniform(150_000, 450_000, 60),
+    }, index=pd.Index(ids, name="Candidate ID"))
+    keys = pd.MultiIndex.from_product([ids, [1, 2], [1, 2, 3], [1, 2]], names=["Customer", "Product", "Period", "Scenario"])
+    scenarios = pd.DataFrame({"Demand": rng.integers(0, 1000, len(keys))}, index=keys).reset_index()
+    periods = scenarios.groupby(["Customer", "Product", "Period"], as_index=False)["Demand"].mean()
+    Demand_df = periods.groupby(["Customer", "Product"], as_index=False)["Demand"].sum()
+    data = build_problem_data(Candidates_df, pd.DataFrame(index=[1001]), periods, scenarios)
+    return Demand_df, Candidates_df, data
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """the number of times the clustering actually runs, with an empty memo"""
+    monkeypatch.setattr(clusteringdemand, "_cluster_memo", type(clusteringdemand._cluster_memo)())
+    calls = []
+    real = clusteringdemand.cluster_districts
+    def cluster_districts(*args, **kwargs):
+        calls.append(args[3])
+        return real(*args, **kwargs)
+    monkeypatch.setattr(clusteringdemand, "cluster_districts", cluster_districts)
+    return calls
+
+
+def test_memo_hits_and_misses(districts, counted, tmp_path):
+    Demand_df, Candidates_df, data = districts
+    first = calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path)
+    again = calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path)
+    assert counted == [8]
+    pd.testing.assert_frame_equal(first[0], again[0])
+    assert (first[3].demand_scenarios == again[3].demand_scenarios).all()
+
+    # another size, other settings or other demand is another result
+    calcClusters(Demand_df, Candidates_df, data, num_clusters=9, cache_dir=tmp_path)
+    calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path, random_state=1)
+    changed = Demand_df.assign(Demand=Demand_df["Demand"] + 1)
+    calcClusters(changed, Candidates_df, data, num_clusters=8, cache_dir=tmp_path)
+    assert counted == [8, 9, 8, 8]
+
+
+def test_results_come_back_from_disk(districts, counted, tmp_path):
+    Demand_df, Candidates_df, data = districts
+    first = calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path)
+    clusteringdemand._cluster_memo.clear()
+    again = calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path)
+    assert counted == [8]
+    pd.testing.assert_frame_equal(first[1], again[1])
+
+    calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path, use_cache=False)
+    assert counted == [8, 8]
+
+
+def test_changing_a_result_leaves_the_memo_alone(districts, counted, tmp_path):
+    Demand_df, Candidates_df, data = districts
+    all_df, reduced_df, _, cluster_data = calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path)
+    labels = all_df["cluster label"].copy()
+    all_df["cluster label"] = -1
+    cluster_data.demand_periods[:] = 0
+
+    all_again, _, _, data_again = calcClusters(Demand_df, Candidates_df, data, num_clusters=8, cache_dir=tmp_path)
+    assert (all_again["cluster label"] == labels).all()
+    assert data_again.demand_periods.any()
+    # the summed demand is all still there
+    assert data_again.demand_periods.sum() == data.demand_periods.sum()
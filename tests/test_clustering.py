@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from clusteringdemand import haversine, centermost_points, cluster_points, get_weighted_travel_costs
+
+
+def test_haversine():
+    # a degree of latitude on the mean earth radius
+    assert haversine(50.0, -1.0, 51.0, -1.0) == pytest.approx(np.pi / 180 * 6371008.8)
+    assert haversine(np.array([52.0]), np.array([0.0]), np.array([52.0]), np.array([0.0]))[0] == 0
+
+
+def test_centermost_points_matches_a_loop_over_clusters():
+    rng = np.random.default_rng(0)
+    latlon = np.c_[rng.uniform(50, 56, 200), rng.uniform(-5, 1, 200)]
+    labels = rng.integers(0, 7, 200)
+    centres = centermost_points(latlon, labels, 7)
+
+    for n in range(7):
+        members = np.flatnonzero(labels == n)
+        middle = latlon[members].mean(axis=0)
+        dist = haversine(latlon[members, 0], latlon[members, 1], middle[0], middle[1])
+        assert centres[n] == members[dist.argmin()]
+
+
+def test_centermost_points_empty_cluster():
+    with pytest.raises(ValueError):
+        centermost_points(np.zeros((3, 2)), np.array([0, 0, 2]), 3)
+
+
+def blobs(sizes, seed=0):
+    """lat, lon points in tight groups far apart, and which group each is in"""
+    rng = np.random.default_rng(seed)
+    middles = np.c_[np.linspace(50, 57, len(sizes)), np.linspace(-5, 1, len(sizes))]
+    group = np.repeat(np.arange(len(sizes)), sizes)
+    return middles[group] + rng.normal(0, .02, (len(group), 2)), group
+
+
+def same_partition(a, b):
+    return len(set(zip(a.tolist(), b.tolist()))) == len(set(a.tolist())) == len(set(b.tolist()))
+
+
+@pytest.mark.parametrize("method, options", [
+    ("kmeans", {}),
+    ("minibatch", dict(chunk_size=50)),
+    ("grid", dict(chunk_size=50, cell_size=.05)),
+    ("ward", {}),
+])
+def test_every_backend_finds_the_groups(method, options):
+    points, group = blobs([40, 25, 60, 30])
+    labels = cluster_points(points, np.ones(len(points)), 4, method, **options)
+    assert labels.dtype == np.int64
+    assert same_partition(labels, group)
+
+
+def test_minibatch_reads_a_memmap(tmp_path):
+    points, group = blobs([100, 80, 120])
+    stored = np.lib.format.open_memmap(tmp_path / "points.npy", mode="w+", dtype=np.float64, shape=points.shape)
+    stored[:] = points
+    labels = cluster_points(stored, np.ones(len(points)), 3, "minibatch", chunk_size=64)
+    assert same_partition(labels, group)
+
+
+def test_grid_needs_enough_cells_and_unknown_method():
+    points, _ = blobs([10, 10])
+    with pytest.raises(ValueError):
+        cluster_points(points, np.ones(len(points)), 5, "grid", cell_size=20.0)
+    with pytest.raises(ValueError):
+        cluster_points(points, np.ones(len(points)), 2, "dbscan")
+
+
+def test_weighted_travel_costs_match_the_old_loop():
+    rng = np.random.default_rng(2)
+    customers = np.array([5, 9, 2, 14, 7, 11, 3])
+    warehouses = np.array([40, 41, 42])
+    all_cust_df = pd.DataFrame({"cluster label": [2, 0, 1, 0, 2, 2, 1]}, index=customers)
+    reduced_customers_df = pd.DataFrame(index=[9, 3, 5])   # cluster n's centre is row n
+    costs = rng.uniform(1, 10, (3, 7))
+
+    # what get_weighted_travel_costs did with the cost dicts
+    cost_ware_cust = {(j, i): costs[j_pos, i_pos] for j_pos, j in enumerate(warehouses) for i_pos, i in enumerate(customers)}
+    expected = {(j, c): 0 for j, _ in cost_ware_cust for c in reduced_customers_df.index}
+    for (j, i), cost in cost_ware_cust.items():
+        expected[j, reduced_customers_df.index[all_cust_df.loc[i, "cluster label"]]] += cost
+
+    got = get_weighted_travel_costs(reduced_customers_df, costs, all_cust_df)
+    assert got.shape == (3, 3)
+    for (j, c), cost in expected.items():
+        assert got[np.flatnonzero(warehouses == j)[0], reduced_customers_df.index.get_loc(c)] == pytest.approx(cost)
+
+    weights = rng.uniform(0, 5, 7)
+    weighted = get_weighted_travel_costs(reduced_customers_df, costs, all_cust_df, weights)
+    assert weighted[:, 0] == pytest.approx(costs[:, [1, 3]] @ weights[[1, 3]])
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cost_matrices import get_cost_matrices
+
+RATES = {1: 0.185, 2: 0.720, 3: 0.857}
+
+
+@pytest.fixture
+def distances():
+    rng = np.random.default_rng(0)
+    districts = np.array([11, 3, 27, 8, 15])
+    suppliers = np.array([1001, 1002, 1003])
+    Suppliers_df = pd.DataFrame({"Vehicle type": [1, 3, 2]}, index=suppliers)
+    supplier_district = pd.DataFrame(rng.uniform(1, 100, (3, 5)), index=suppliers, columns=districts)
+    district_district = pd.DataFrame(rng.uniform(1, 100, (5, 5)), index=districts, columns=districts)
+    return supplier_district, district_district, Suppliers_df
+
+
+def test_matches_the_original_loops(distances):
+    supplier_district, district_district, Suppliers_df = distances
+    candidates, customers = [27, 11, 8], [3, 15, 11, 27]
+    sup_cand, cand_cust = get_cost_matrices(supplier_district, district_district, Suppliers_df, RATES,
+                                            candidates=candidates, customers=customers)
+
+    # the dict comprehensions the scripts had before
+    for k_pos, k in enumerate(Suppliers_df.index):
+        for j_pos, j in enumerate(candidates):
+            expected = 2 * supplier_district.loc[k, j] * RATES[Suppliers_df.loc[k, "Vehicle type"]] / 1000
+            assert sup_cand[k_pos, j_pos] == pytest.approx(expected)
+    for j_pos, j in enumerate(candidates):
+        for i_pos, i in enumerate(customers):
+            assert cand_cust[j_pos, i_pos] == pytest.approx(2 * district_district.loc[j, i] * RATES[3] / 1000)
+
+    sup_dict, cust_dict = get_cost_matrices(supplier_district, district_district, Suppliers_df, RATES,
+                                            candidates=candidates, customers=customers, as_dict=True)
+    assert sup_dict[1003, 8] == pytest.approx(sup_cand[2, 2])
+    assert cust_dict[11, 27] == pytest.approx(cand_cust[1, 3])
+
+
+def test_unknown_ids_raise(distances):
+    with pytest.raises(KeyError):
+        get_cost_matrices(*distances, RATES, candidates=[27, 99])
@@ -0,0 +1,51 @@
+import os
+
+import helper_funcs
+from helper_funcs import get_all_data, data_dir_fingerprint
+
+
+def counting_reader(monkeypatch):
+    calls = []
+    def read_all_data(data_dir):
+        calls.append(data_dir)
+        return {"read": len(calls)}
+    monkeypatch.setattr(helper_funcs, "read_all_data", read_all_data)
+    return calls
+
+
+def test_second_load_comes_from_the_cache(tmp_path, monkeypatch):
+    (tmp_path / "Demand.csv").write_text("Customer,Product,Demand\n1,1,5\n")
+    calls = counting_reader(monkeypatch)
+
+    assert get_all_data(tmp_path) == {"read": 1}
+    assert get_all_data(tmp_path) == {"read": 1}
+    assert len(calls) == 1
+    assert len(list((tmp_path / ".cache").glob("all_data_*.pkl"))) == 1
+
+
+def test_changed_csv_is_read_again(tmp_path, monkeypatch):
+    csv = tmp_path / "Demand.csv"
+    csv.write_text("Customer,Product,Demand\n1,1,5\n")
+    calls = counting_reader(monkeypatch)
+    before = data_dir_fingerprint(tmp_path)
+    get_all_data(tmp_path)
+
+    csv.write_text("Customer,Product,Demand\n1,1,6\n")
+    stat = csv.stat()
+    os.utime(csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert data_dir_fingerprint(tmp_path) != before
+    assert get_all_data(tmp_path) == {"read": 2}
+    # the stale cache file is gone
+    assert len(list((tmp_path / ".cache").glob("all_data_*.pkl"))) == 1
+
+
+def test_unreadable_cache_and_no_cache(tmp_path, monkeypatch):
+    (tmp_path / "Demand.csv").write_text("Customer,Product,Demand\n1,1,5\n")
+    calls = counting_reader(monkeypatch)
+    get_all_data(tmp_path)
+    cache_file, = (tmp_path / ".cache").glob("all_data_*.pkl")
+    cache_file.write_bytes(b"half written")
+
+    assert get_all_data(tmp_path) == {"read": 2}
+    assert get_all_data(tmp_path, use_cache=False) == {"read": 3}
+    assert get_all_data(tmp_path) == {"read": 2}
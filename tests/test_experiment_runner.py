@@ -0,0 +1,79 @@
+import json
+from dataclasses import asdict
+
+import experiment_runner
+from experiment_runner import RunConfig, config_grid, completed_keys, run_experiments, load_records
+
+
+def write_records(path, records):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+
+
+def test_records_from_before_the_pruning_settings_still_count(tmp_path):
+    path = tmp_path / "results.jsonl"
+    old = dict(num_warehouses=20, num_customers=80, aggregation="kmeans", scenarios=None, gap=.1,
+               time_limit=900, solver="xpress", status="optimal")
+    write_records(path, [old])
+    assert RunConfig(20, 80, "kmeans", None, .1, 900, "xpress").key in completed_keys(path)
+    assert RunConfig(20, 80, "kmeans", None, .1, 900, "xpress", nearest_k=10).key not in completed_keys(path)
+
+
+def test_config_grid_pruning():
+    configs = config_grid((20, 40), (80,), nearest_k=(None, 10))
+    assert [(c.num_warehouses, c.nearest_k) for c in configs] == [(20, None), (40, None), (20, 10), (40, 10)]
+
+
+def test_config_grid_supplier_pruning():
+    configs = config_grid((20,), (80,), nearest_suppliers=(None, 3))
+    assert [c.nearest_suppliers for c in configs] == [None, 3]
+
+
+def fake_sweep(monkeypatch, fail=()):
+    """run_experiments with the data loading and the runs themselves replaced, returns the runs made"""
+    runs = []
+    def run_config(config, sweep_data, threads, previous_plan=None, verbose=True):
+        runs.append((config, previous_plan))
+        if config.num_warehouses in fail:
+            raise RuntimeError("solver fell over")
+        return dict(asdict(config), status="optimal", objval=1.0, mip_gap=0.0, total_time=1.0), ("plan", config.num_warehouses)
+    monkeypatch.setattr(experiment_runner, "load_sweep_data", lambda data_dir: None)
+    monkeypatch.setattr(experiment_runner, "run_config", run_config)
+    return runs
+
+
+def test_resume_skips_what_is_done(tmp_path, monkeypatch):
+    path = tmp_path / "results.jsonl"
+    configs = config_grid((20, 40, 60), (80,), aggregation=("kmeans",))
+    write_records(path, [
+        dict(asdict(configs[0]), status="optimal"),
+        dict(asdict(configs[1]), status="error", error="RuntimeError: out of memory"),
+    ])
+    # a line cut off when the last sweep was killed
+    with open(path, "a") as f:
+        f.write('{"num_warehouses": 60, "num_cust')
+
+    assert completed_keys(path) == {configs[0].key}
+    runs = fake_sweep(monkeypatch)
+    records = run_experiments(configs, path)
+    # the errored run goes again, the done one doesn't
+    assert [config for config, _ in runs] == configs[1:]
+    assert [r["num_warehouses"] for r in records] == [40, 60]
+    assert completed_keys(path) == {config.key for config in configs}
+
+    runs.clear()
+    assert run_experiments(configs, path) == []
+    assert runs == []
+
+
+def test_failed_run_is_recorded_and_plans_chain(tmp_path, monkeypatch):
+    path = tmp_path / "results.jsonl"
+    configs = config_grid((20, 40, 60), (80,), aggregation=("kmeans",))
+    runs = fake_sweep(monkeypatch, fail=(40,))
+    records = run_experiments(configs, path)
+
+    assert [r["status"] for r in records] == ["optimal", "error", "optimal"]
+    assert "solver fell over" in records[1]["error"]
+    # each run starts from the last plan of the same aggregation, the failed one has none to give
+    assert [plan for _, plan in runs] == [None, ("plan", 20), ("plan", 20)]
+    assert completed_keys(path) == {configs[0].key, configs[2].key}
+    assert [r["num_warehouses"] for r in load_records(path)] == [20, 40, 60]
@@ -0,0 +1,72 @@
+import json
+import time
+
+import pytest
+
+from instrumentation import profiling, span, laps, traced, active_profiler
+
+
+@traced()
+def work():
+    with span("inner", rows=3):
+        time.sleep(.01)
+
+
+def test_nothing_is_recorded_without_a_profiler():
+    assert active_profiler() is None
+    with span("build") as args:
+        args["cache"] = "hit"
+    work()
+
+
+def test_spans_nest_and_add_up():
+    with profiling() as prof:
+        with span("outer"):
+            work()
+            work()
+    rows = {row["path"]: row for row in prof.summary()}
+    assert list(rows) == ["outer", "outer/work", "outer/work/inner"]
+    assert rows["outer/work"]["calls"] == 2 and rows["outer/work/inner"]["depth"] == 2
+    assert rows["outer"]["wall"] >= rows["outer/work"]["wall"] >= .02
+    assert prof.spans[0].args == {"rows": 3}
+    assert active_profiler() is None
+
+
+def test_laps_follow_each_other():
+    with profiling() as prof:
+        with span("run"):
+            lap = laps()
+            lap("build")
+            time.sleep(.01)
+            lap("solve")
+            work()
+            lap.end()
+    assert [row["path"] for row in prof.summary()] == ["run", "run/build", "run/solve", "run/solve/work",
+                                                        "run/solve/work/inner"]
+    build, = [s for s in prof.spans if s.name == "build"]
+    solve, = [s for s in prof.spans if s.name == "solve"]
+    assert build.start + build.wall <= solve.start + 1e-6
+
+
+def test_lap_left_open_by_an_exception_is_dropped():
+    with profiling() as prof:
+        with pytest.raises(RuntimeError):
+            with span("run"):
+                lap = laps()
+                lap("build")
+                raise RuntimeError
+        with span("after"):
+            pass
+    # "run" ended with "build" still open, "after" isn't nested in either
+    assert [row["path"] for row in prof.summary()] == ["run", "after"]
+
+
+def test_inner_profiler_hands_its_spans_up(tmp_path):
+    with profiling() as outer:
+        with span("sweep"):
+            with profiling(chrome_trace=tmp_path / "trace.json") as inner:
+                work()
+    assert [row["path"] for row in inner.summary()] == ["work", "work/inner"]
+    assert [row["path"] for row in outer.summary()] == ["sweep", "sweep/work", "sweep/work/inner"]
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    assert sorted(e["name"] for e in events) == ["inner", "work"]
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from model_builder import build_mecwlp
+from solver_backends import make_backend, OPTIMAL
+
+xp = pytest.importorskip("xpress")
+
+# (stock_ratio, exact_stock, supply_only_open) of part one.py and StochasticFinal.py
+DETERMINISTIC = (1.0, False, False)
+STOCHASTIC = (.8, True, True)
+
+
+def original_formulation(inst, stock_ratio, exact_stock, supply_only_open):
+    """
+    The model the way the scripts used to add it to xpress, one variable and one constraint at a time,
+    with z over every product and bounded to 0 where the supplier doesn't carry it.
+    """
+    Customers, Candidates, Suppliers = range(len(inst.customers)), range(len(inst.candidates)), range(len(inst.suppliers))
+    Times, Scenarios = range(len(inst.periods)), range(len(inst.scenarios))
+    Products = range(len(inst.products))
+    final_t = Times[-1]
+    probs = inst.scenario_probs
+
+    prob = xp.problem("original")
+    x = {
+        (i,j,t,p,s): prob.addVariable(vartype=xp.binary)
+        for i in Customers for j in Candidates for t in Times for p in Products for s in Scenarios
+    }
+    y = {(j,t): prob.addVariable(vartype=xp.binary) for j in Candidates for t in Times}
+    z = {
+        (k,j,t,p,s): prob.addVariable(ub=1)
+        for k in Suppliers for j in Candidates for t in Times for p in Products for s in Scenarios
+    }
+
+    prob.addConstraint(
+        x[i,j,t,p,s] <= y[j,t]
+        for i in Customers for j in Candidates for t in Times for p in Products for s in Scenarios
+    )
+    prob.addConstraint(y[j,t] <= y[j,t+1] for j in Candidates for t in Times if t != final_t)
+    prob.addConstraint(
+        xp.Sum(x[i,j,t,p,s] for j in Candidates) == 1
+        for i in Customers for p in Products for t in Times for s in Scenarios
+    )
+    prob.addConstraint(
+        z[k,j,t,p,s] <= int(inst.products[p] == inst.supplier_product[k])
+        for k in Suppliers for j in Candidates for p in Products for t in Times for s in Scenarios
+    )
+    prob.addConstraint(
+        xp.Sum(z[k,j,t,p,s] for j in Candidates) <= 1
+        for k in Suppliers for p in Products for t in Times for s in Scenarios
+    )
+    if supply_only_open:
+        prob.addConstraint(
+            z[k,j,t,p,s] <= y[j,t]
+            for t in Times for k in Suppliers for j in Candidates for p in Products for s in Scenarios
+        )
+    for j in Candidates:
+        for t in Times:
+            for s in Scenarios:
+                stock_in = xp.Sum(inst.supplier_capacity[k] * z[k,j,t,p,s] for k in Suppliers for p in Products)
+                delivered = stock_ratio * xp.Sum(
+                    inst.demand[i,p,t,s] * x[i,j,t,p,s] for i in Customers for p in Products
+                )
+                prob.addConstraint(stock_in == delivered if exact_stock else stock_in >= delivered)
+                prob.addConstraint(stock_in <= inst.candidate_capacity[j])
+
+    prob.setObjective(
+        xp.Sum(inst.setup_cost[j] * y[j,final_t] for j in Candidates)
+        + xp.Sum(inst.operating_cost[j] * y[j,t] for j in Candidates for t in Times)
+        + xp.Sum(
+            probs[s] * inst.cost_supplier_candidate[k,j] * inst.supplier_capacity[k] * z[k,j,t,p,s]
+            for k in Suppliers for j in Candidates for t in Times for p in Products for s in Scenarios
+        )
+        + xp.Sum(
+            probs[s] * inst.cost_candidate_customer[j,i] * inst.demand[i,p,t,s] * x[i,j,t,p,s]
+            for i in Customers for j in Candidates for t in Times for p in Products for s in Scenarios
+        ),
+        sense=xp.minimize,
+    )
+    return prob
+
+
+@pytest.mark.parametrize("options", [DETERMINISTIC, STOCHASTIC], ids=["deterministic", "stochastic"])
+def test_same_optimum_as_original(instance, options):
+    stock_ratio, exact_stock, supply_only_open = options
+    model = build_mecwlp(instance, stock_ratio=stock_ratio, exact_stock=exact_stock, supply_only_open=supply_only_open)
+    result = make_backend("xpress", rel_gap=0, progress_interval=None).solve(model.matrix)
+
+    prob = original_formulation(instance, *options)
+    prob.setControl("outputlog", 0)
+    prob.setControl("miprelstop", 0)
+    prob.optimize()
+
+    assert result.status == OPTIMAL
+    assert result.objval == pytest.approx(prob.attributes.mipobjval, rel=1e-6)
+    # the setup, operating and flow costs add up to the objective
+    setup, operating, sup_ware, ware_cust = model.cost_breakdown(result.x)
+    assert setup + sum(operating.values()) + sum(sup_ware.values()) + sum(ware_cust.values()) == pytest.approx(result.objval)
+
+
+@pytest.mark.parametrize("options", [DETERMINISTIC, STOCHASTIC], ids=["deterministic", "stochastic"])
+def test_only_the_zero_supply_rows_and_columns_are_gone(instance, options):
+    stock_ratio, exact_stock, supply_only_open = options
+    model = build_mecwlp(instance, stock_ratio=stock_ratio, exact_stock=exact_stock, supply_only_open=supply_only_open)
+    prob = original_formulation(instance, *options)
+
+    nJ, nK = len(instance.candidates), len(instance.suppliers)
+    nT, nP, nS = len(instance.periods), len(instance.products), len(instance.scenarios)
+    # z for the products a supplier doesn't carry, with their rows: z <= 0, the "at most 100%"
+    # rows of those products and, when there, z <= y
+    other_z = nK * nJ * nT * (nP - 1) * nS
+    removed_rows = nK * nJ * nT * nP * nS + nK * (nP - 1) * nT * nS + (other_z if supply_only_open else 0)
+
+    assert model.matrix.n_cols == prob.attributes.cols - other_z
+    assert model.matrix.n_rows == prob.attributes.rows - removed_rows
+    assert model.z_cols.size == nK * nJ * nT * nS
+    assert np.array_equal(instance.products[model.supply_prod], instance.supplier_product[model.supply_sup])
@@ -0,0 +1,65 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from p_median import solve_p_median, greedy_add, vertex_substitution, assignment_costs
+from clusteringdemand import aggregate_warehouses_subproblem
+
+
+def brute_force(costs, p):
+    return min(costs[:, list(cols)].min(axis=1).sum() for cols in itertools.combinations(range(costs.shape[1]), p))
+
+
+def planar_costs(nI, nJ, seed):
+    rng = np.random.default_rng(seed)
+    customers, candidates = rng.uniform(0, 100, (nI, 2)), rng.uniform(0, 100, (nJ, 2))
+    return np.linalg.norm(customers[:, None] - candidates[None], axis=2)
+
+
+def test_close_to_brute_force():
+    gaps = []
+    for seed, p in itertools.product(range(10), [1, 3, 5]):
+        costs = planar_costs(25, 12, seed)
+        open_cols, total = solve_p_median(costs, p)
+        assert len(set(open_cols.tolist())) == p
+        assert total == pytest.approx(costs[:, open_cols].min(axis=1).sum())
+        gaps.append(total / brute_force(costs, p) - 1)
+    gaps = np.array(gaps)
+    # a local optimum of the swaps, usually the optimum and never far off on these
+    assert (gaps >= -1e-9).all() and gaps.max() < .1
+    assert (gaps < 1e-9).mean() >= .8
+
+
+def test_swaps_never_make_it_worse():
+    costs = planar_costs(40, 15, 7)
+    start = greedy_add(costs, 4)
+    swapped = vertex_substitution(costs, start)
+    assert costs[:, swapped].min(axis=1).sum() <= costs[:, start].min(axis=1).sum()
+
+
+def test_assignment_costs():
+    costs = np.array([[3., 1., 2.], [1., 5., 4.]])
+    nearest, d1, d2 = assignment_costs(costs, np.array([0, 2]))
+    assert nearest.tolist() == [1, 0]
+    assert d1.tolist() == [2, 1] and d2.tolist() == [3, 4]
+
+
+def test_weights_and_bad_p():
+    costs = planar_costs(10, 6, 1)
+    weights = np.arange(1, 11)
+    open_cols, total = solve_p_median(costs, 2, weights)
+    assert total == pytest.approx(brute_force(costs * weights[:, None], 2), rel=.02)
+    with pytest.raises(ValueError):
+        solve_p_median(costs, 7)
+
+
+def test_subproblem_picks_candidate_ids():
+    costs = planar_costs(20, 8, 3)
+    ids = np.arange(101, 109)
+    picked = aggregate_warehouses_subproblem(3, ids, np.arange(20), costs.T)
+    open_cols, _ = solve_p_median(costs, 3)
+    assert picked == ids[open_cols].tolist()
+    # the dict form the older scripts pass
+    as_dict = {(j, i): costs[i, j_pos] for j_pos, j in enumerate(ids) for i in range(20)}
+    assert aggregate_warehouses_subproblem(3, ids, np.arange(20), as_dict) == picked
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from dataclasses import replace
+
+from conftest import small_instance
+from model_builder import build_mecwlp
+from plan_evaluation import evaluate_plan_full, assign_customers
+from scenario_subproblems import fix_plan
+from solver_backends import make_backend
+
+pytest.importorskip("highspy")
+
+
+@pytest.fixture
+def backend():
+    return make_backend("highs", progress_interval=None)
+
+
+def plan_optimum(inst, y, backend):
+    model = build_mecwlp(inst)
+    return backend.solve(fix_plan(model, y)).objval
+
+
+def test_assign_customers_moves_the_cheapest():
+    cost = np.array([[1., 1., 1.], [2., 5., 3.]])
+    demand = np.array([4., 4., 4.])
+    # everyone wants warehouse 0 but it only takes two of them, customer 0 is the cheapest to move
+    a = assign_customers(cost, demand, np.array([True, True]), np.array([8., 100.]))
+    assert a.tolist() == [1, 0, 0]
+    assert assign_customers(cost, demand, np.array([True, False]), np.array([8., 100.])) is None
+
+
+def test_plan_with_room_is_costed_exactly(backend):
+    inst = small_instance(nJ=3, nI=6, nT=2, nS=1, seed=5)
+    # with no capacity to work around and the same supply cost at every warehouse, the cheapest
+    # warehouse for each district is the best the model can do too
+    same_supply = np.repeat(inst.cost_supplier_candidate[:, :1], 3, axis=1)
+    inst = replace(inst, candidate_capacity=inst.candidate_capacity * 10, cost_supplier_candidate=same_supply)
+    y = np.array([[0, 1], [1, 1], [0, 0]], dtype=float)
+    full = evaluate_plan_full(inst, y, backend=backend)
+    assert full.feasible
+    assert full.total == pytest.approx(plan_optimum(inst, y, backend))
+
+
+def test_tight_plan_is_an_upper_bound(backend):
+    inst = small_instance(nJ=3, nI=6, nT=2, nS=1, seed=5)
+    y = np.ones((3, 2))
+    full = evaluate_plan_full(inst, y, backend=backend)
+    assert full.feasible
+    assert full.total >= plan_optimum(inst, y, backend) * (1 - 1e-9)
+    assert full.assignment.shape == (6, 4, 2, 1)
+
+
+def test_products_of_a_district_can_split(backend):
+    # one district wanting 10 of two products, two warehouses that hold 10 each
+    inst = small_instance(nJ=2, nI=1, nT=1, nS=1)
+    demand = np.zeros((1, 4, 1, 1))
+    demand[0, :2] = 10
+    inst = replace(inst, demand=demand, candidate_capacity=np.full(2, 10.0),
+                   supplier_capacity=np.full(len(inst.suppliers), 100.0))
+    full = evaluate_plan_full(inst, np.ones((2, 1)), backend=backend)
+    assert full.feasible
+    assert sorted(full.assignment[0, :2, 0, 0].tolist()) == [0, 1]
+    assert full.total == pytest.approx(plan_optimum(inst, np.ones((2, 1)), backend))
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from problem_data import demand_tensor, build_problem_data
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    customers, products, periods, scenarios = [7, 3, 11], [1, 2], [1, 2, 3], [1, 2]
+    keys = pd.MultiIndex.from_product([customers, products, periods], names=["Customer", "Product", "Period"])
+    periods_df = keys.to_frame(index=False).assign(Demand=rng.integers(0, 100, len(keys)))
+    keys = pd.MultiIndex.from_product([customers, products, periods, scenarios],
+                                      names=["Customer", "Product", "Period", "Scenario"])
+    scenarios_df = keys.to_frame(index=False).assign(Demand=rng.integers(0, 100, len(keys)))
+    candidates_df = pd.DataFrame(index=[20, 10])
+    suppliers_df = pd.DataFrame(index=[5, 4, 6])
+    return candidates_df, suppliers_df, periods_df, scenarios_df
+
+
+def test_arrays_match_the_csv_rows(frames):
+    data = build_problem_data(*frames)
+    _, _, periods_df, scenarios_df = frames
+
+    assert data.customers.tolist() == [3, 7, 11]
+    assert data.candidates.tolist() == [10, 20]
+    assert data.demand_periods.shape == (3, 2, 3)
+    for row in periods_df.itertuples():
+        c, p, t = data.customer_index[row.Customer], data.product_index[row.Product], data.period_index[row.Period]
+        assert data.demand_periods[c, p, t] == row.Demand
+    assert data.demand_periods_dict() == {
+        (row.Customer, row.Product, row.Period): row.Demand for row in periods_df.itertuples()
+    }
+    assert data.demand_scenarios.sum() == scenarios_df["Demand"].sum()
+
+
+def test_missing_keys_are_zero(frames):
+    candidates_df, suppliers_df, periods_df, scenarios_df = frames
+    data = build_problem_data(candidates_df, suppliers_df, periods_df.iloc[1:], scenarios_df)
+    row = periods_df.iloc[0]
+    assert data.demand_periods[data.customer_index[row.Customer], data.product_index[row.Product],
+                               data.period_index[row.Period]] == 0
+
+
+def test_float_demand_is_kept():
+    df = pd.DataFrame({"Customer": [1, 2], "Demand": [1.5, 2.25]})
+    out = demand_tensor(df, [("Customer", np.array([1, 2]))])
+    assert out.tolist() == [1.5, 2.25]
+    with pytest.raises(ValueError):
+        demand_tensor(df, [("Customer", np.array([1, 2]))], dtype=np.int32)
+
+
+def test_aggregate_sums_over_clusters(frames):
+    data = build_problem_data(*frames)
+    # customers 3 and 11 together under id 11, 7 on its own
+    agg = data.aggregate(np.array([0, 1, 0]), [11, 7])
+
+    assert agg.customers.tolist() == [7, 11]
+    assert np.array_equal(agg.demand_periods[0], data.demand_periods[1])
+    assert np.array_equal(agg.demand_periods[1], data.demand_periods[0] + data.demand_periods[2])
+    assert np.array_equal(agg.demand_scenarios.sum(axis=0), data.demand_scenarios.sum(axis=0))
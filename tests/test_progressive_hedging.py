@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import progressive_hedging
+from progressive_hedging import solve_progressive_hedging, consensus_plans
+from solver_backends import make_backend
+from model_builder import build_mecwlp
+
+pytest.importorskip("highspy")
+
+STOCHASTIC = dict(stock_ratio=.8, exact_stock=True, supply_only_open=True)
+
+
+def test_consensus_plans_stay_open():
+    y_scenarios = np.array([[[0, 1, 0]], [[0, 0, 1]], [[0, 0, 1]]], dtype=float)
+    rounded, union = consensus_plans(y_scenarios, np.full(3, 1 / 3))
+    assert rounded.tolist() == [[0, 0, 1]]
+    assert union.tolist() == [[0, 1, 1]]
+
+
+def test_plan_is_costed(instance):
+    result = solve_progressive_hedging(instance, make_backend("highs", progress_interval=None), max_iterations=3,
+                                       verbose=False, **STOCHASTIC)
+    assert np.isfinite(result.upper_bound)
+    assert result.lower_bound <= result.upper_bound * (1 + 1e-6)
+    assert (np.diff(result.y, axis=1) >= 0).all()
+
+    # a plan can't cost less than the optimum of the extensive form
+    model = build_mecwlp(instance, **STOCHASTIC)
+    full = make_backend("highs", progress_interval=None).solve(model.matrix)
+    assert result.upper_bound >= full.objval * (1 - 1e-6)
+
+
+def test_no_plan_costed_warns(instance, monkeypatch):
+    # every scenario's integer flows "fail", for the consensus plans and the greedy/drop ones alike
+    monkeypatch.setattr(progressive_hedging.ScenarioSolver, "solve",
+                        lambda self, y: [(False, np.inf, None, None)] * len(self.inst.scenarios))
+    with pytest.warns(UserWarning, match="no plan could be costed"):
+        result = solve_progressive_hedging(instance, make_backend("highs", progress_interval=None), max_iterations=1,
+                                           verbose=False, **STOCHASTIC)
+    assert result.upper_bound == np.inf
+    assert len(result.scenario_solutions) == len(instance.scenarios)
+
+
+def test_worker_processes_match_serial(instance):
+    backend = make_backend("highs", progress_interval=None)
+    serial = solve_progressive_hedging(instance, backend, max_iterations=2, verbose=False, **STOCHASTIC)
+    pooled = solve_progressive_hedging(instance, backend, max_iterations=2, workers=2, verbose=False, **STOCHASTIC)
+    assert pooled.upper_bound == pytest.approx(serial.upper_bound)
+    assert pooled.lower_bound == pytest.approx(serial.lower_bound)
@@ -0,0 +1,40 @@
+import numpy as np
+from dataclasses import replace
+
+from conftest import small_instance
+from pruning import nearest_candidate_mask, cheapest_supplier_mask
+
+
+def test_nearest_candidate_mask_matches_sorting():
+    rng = np.random.default_rng(0)
+    cust_xy, cand_xy = rng.uniform(0, 1000, (30, 2)), rng.uniform(0, 1000, (12, 2))
+    dist = np.linalg.norm(cust_xy[:, None] - cand_xy[None], axis=2)
+
+    mask = nearest_candidate_mask(cust_xy, cand_xy, k=3)
+    expected = np.zeros_like(mask)
+    np.put_along_axis(expected, np.argsort(dist, axis=1)[:, :3], True, axis=1)
+    assert (mask == expected).all()
+
+    mask = nearest_candidate_mask(cust_xy, cand_xy, radius=200)
+    assert (mask == ((dist <= 200) | (dist == dist.min(axis=1, keepdims=True)))).all()
+    assert nearest_candidate_mask(cust_xy, cand_xy, k=50).all()
+
+
+def test_cheapest_supplier_mask_keeps_enough_stock():
+    inst = small_instance(nJ=4, nI=5, nT=2, nS=2, seed=1)
+    # two suppliers of product 1 that can only cover the peak demand between them
+    peak = inst.demand.sum(axis=0).max(axis=(1, 2))
+    capacity = inst.supplier_capacity.copy()
+    capacity[[0, 4]] = .6 * peak[0]
+    inst = replace(inst, supplier_capacity=capacity)
+
+    mask = cheapest_supplier_mask(inst, n=1, verbose=False)
+    # every other product has one supplier, which is always kept
+    assert mask[1:4].all()
+    assert mask[[0, 4]].all()
+
+    # with plenty of stock only the cheapest is kept
+    capacity[[0, 4]] = 2 * peak[0]
+    mask = cheapest_supplier_mask(replace(inst, supplier_capacity=capacity), n=1, verbose=False)
+    cheapest = np.argmin(inst.cost_supplier_candidate[[0, 4]], axis=0)
+    assert (mask[0] == (cheapest == 0)).all() and (mask[4] == (cheapest == 1)).all()
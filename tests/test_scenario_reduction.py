@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from conftest import small_instance
+from scenario_reduction import reduce_scenarios, reduction_distance, reduce_instance, scenario_distances
+
+
+def grouped_demand(sizes, seed=0):
+    """scenarios in tight groups around far apart centres, group g has sizes[g] scenarios"""
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(0, 1000, (len(sizes), 4, 2, 3))
+    scenarios = [centres[g] + rng.normal(0, 1, centres[g].shape) for g, size in enumerate(sizes) for _ in range(size)]
+    return np.stack(scenarios, axis=-1), np.repeat(np.arange(len(sizes)), sizes)
+
+
+@pytest.mark.parametrize("method", ["fast_forward", "k_medoids"])
+def test_one_scenario_per_group_with_its_mass(method):
+    demand, group = grouped_demand([5, 3, 2])
+    probs = np.random.default_rng(1).dirichlet(np.ones(10))
+    keep, new_probs = reduce_scenarios(demand, 3, probs, method)
+
+    assert sorted(group[keep].tolist()) == [0, 1, 2]
+    assert new_probs.sum() == pytest.approx(1)
+    for k, p in zip(keep, new_probs):
+        assert p == pytest.approx(probs[group == group[k]].sum())
+
+
+def test_mass_goes_to_the_nearest_kept_scenario():
+    demand = np.random.default_rng(2).uniform(0, 100, (6, 4, 3, 12))
+    probs = np.full(12, 1 / 12)
+    keep, new_probs = reduce_scenarios(demand, 4)
+    nearest = keep[scenario_distances(demand)[:, keep].argmin(axis=1)]
+    expected = [probs[nearest == k].sum() for k in keep]
+    assert new_probs == pytest.approx(expected)
+    assert (np.diff(keep) > 0).all()
+
+
+def test_k_medoids_is_no_worse_and_more_scenarios_lose_less():
+    demand = np.random.default_rng(3).uniform(0, 100, (6, 4, 3, 15))
+    ff, _ = reduce_scenarios(demand, 4, method="fast_forward")
+    km, _ = reduce_scenarios(demand, 4, method="k_medoids")
+    assert reduction_distance(demand, km) <= reduction_distance(demand, ff) + 1e-9
+    more, _ = reduce_scenarios(demand, 8)
+    assert reduction_distance(demand, more) <= reduction_distance(demand, ff)
+
+
+def test_nothing_to_reduce_and_bad_method():
+    demand = np.ones((2, 4, 3, 3))
+    keep, probs = reduce_scenarios(demand, 5)
+    assert keep.tolist() == [0, 1, 2] and probs == pytest.approx([1 / 3] * 3)
+    with pytest.raises(ValueError):
+        reduce_scenarios(np.random.default_rng(0).uniform(size=(2, 4, 3, 6)), 2, method="random")
+
+
+def test_reduce_instance():
+    inst = small_instance(nS=6, seed=4)
+    reduced = reduce_instance(inst, 2)
+    assert reduced.demand.shape[-1] == len(reduced.scenarios) == 2
+    assert reduced.scenario_probs.sum() == pytest.approx(1)
+    assert set(reduced.scenarios) <= set(inst.scenarios)
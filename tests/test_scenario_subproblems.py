@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from dataclasses import replace
+
+from benders import solve_benders, master_backend, MIN_MASTER_TIME
+from scenario_subproblems import recourse_model, solve_recourse, ScenarioSolver
+from solver_backends import make_backend
+from model_builder import build_mecwlp
+
+pytest.importorskip("highspy")
+
+STOCHASTIC = dict(stock_ratio=.8, exact_stock=True, supply_only_open=True)
+
+
+@pytest.fixture
+def backend():
+    return make_backend("highs", progress_interval=None)
+
+
+def phase_one_value(model, y, backend):
+    """how infeasible the flows are for y, 0 when they're feasible"""
+    ok, value, _, _ = solve_recourse(model, y, backend)
+    return 0.0 if ok else value
+
+
+def test_phase_one_cut(instance, backend):
+    model = recourse_model(instance, 0, **STOCHASTIC)
+    nJ, nT = len(instance.candidates), len(instance.periods)
+    # one warehouse can't take all the demand, see small_instance
+    y = np.zeros((nJ, nT))
+    y[0] = 1
+
+    ok, value, grad, sol = solve_recourse(model, y, backend)
+    assert not ok and sol is None
+    assert value > 0
+    assert grad.shape == (nJ, nT)
+
+    # the infeasibility is convex in y, so the cut is under it at every plan, and a plan
+    # with feasible flows (0) is never cut off
+    rng = np.random.default_rng(1)
+    plans = [np.ones((nJ, nT))] + [np.maximum.accumulate(rng.integers(0, 2, (nJ, nT)), axis=1) for _ in range(10)]
+    for other in plans:
+        assert phase_one_value(model, other, backend) >= value + np.sum(grad * (other - y)) - 1e-6
+    assert value + np.sum(grad * (np.ones((nJ, nT)) - y)) <= 1e-6
+
+
+def test_optimality_cut(instance, backend):
+    model = recourse_model(instance, 1, **STOCHASTIC)
+    nJ, nT = len(instance.candidates), len(instance.periods)
+    y = np.ones((nJ, nT))
+
+    ok, value, grad, _ = solve_recourse(model, y, backend)
+    assert ok
+
+    for closed in range(nJ):
+        other = y.copy()
+        other[closed] = 0
+        ok, other_value, _, _ = solve_recourse(model, other, backend)
+        assert ok
+        assert other_value >= value + np.sum(grad * (other - y)) - 1e-6 * abs(value)
+
+
+def test_integer_flows_have_no_cut(instance, backend):
+    model = recourse_model(instance, 0, integer=True, **STOCHASTIC)
+    y = np.zeros((len(instance.candidates), len(instance.periods)))
+
+    assert solve_recourse(model, y, backend) == (False, np.inf, None, None)
+
+
+def test_master_backend(backend):
+    backend.rel_gap, backend.time_limit = .05, 20 * 60
+    master = master_backend(backend, 1e-3, 30.0)
+    assert (master.rel_gap, master.time_limit) == (1e-3, 30.0)
+    # the loop's own backend is left alone
+    assert (backend.rel_gap, backend.time_limit) == (.05, 20 * 60)
+    assert master_backend(backend, 1e-3, -5.0).time_limit == MIN_MASTER_TIME
+    assert master_backend(backend, .1, None).time_limit == 20 * 60
+
+
+def test_benders_matches_extensive_form_with_lp_flows(instance, backend):
+    result = solve_benders(instance, backend, tol=1e-6, verbose=False, **STOCHASTIC)
+    # the extensive form with x relaxed is the problem benders solves
+    model = build_mecwlp(instance, **STOCHASTIC)
+    integrality = model.matrix.integrality.copy()
+    integrality[model.x_cols.ravel()] = False
+    full = backend.solve(replace(model.matrix, integrality=integrality))
+    assert result.upper_bound == pytest.approx(full.objval, rel=1e-5)
+    assert result.lower_bound <= result.upper_bound * (1 + 1e-6)
+
+
+def test_worker_processes_match_serial():
+    from conftest import small_instance
+    inst = small_instance(nS=3, seed=3)
+    y = np.ones((len(inst.candidates), len(inst.periods)))
+    with ScenarioSolver(inst, "highs", **STOCHASTIC) as serial, \
+            ScenarioSolver(inst, "highs", workers=2, **STOCHASTIC) as pooled:
+        expected = serial.solve(y)
+        # twice, the second time the workers reuse the models they built
+        for _ in range(2):
+            got = pooled.solve(y)
+            assert [value for _, value, _, _ in got] == pytest.approx([value for _, value, _, _ in expected])
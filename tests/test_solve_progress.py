@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from model_builder import build_mecwlp
+from solver_backends import make_backend
+from solve_progress import (ProgressRecorder, ProgressPoint, SOLUTION, SAMPLE, END, time_to_first_solution,
+                            time_to_gap, progress_records, progress_from_records, progress_summary)
+
+
+def points():
+    return [
+        ProgressPoint(elapsed=1.0, incumbent=np.nan, bound=50.0, gap=np.nan, nodes=0),
+        ProgressPoint(elapsed=2.0, incumbent=200.0, bound=60.0, gap=.7, nodes=5, event=SOLUTION),
+        ProgressPoint(elapsed=3.0, incumbent=100.0, bound=92.0, gap=.08, nodes=9, event=SOLUTION),
+        ProgressPoint(elapsed=4.0, incumbent=100.0, bound=96.0, gap=.04, nodes=20),
+    ]
+
+
+def test_summaries():
+    progress = points()
+    assert time_to_first_solution(progress) == 2.0
+    assert time_to_gap(progress, .1) == 3.0
+    assert time_to_gap(progress, .05) == 4.0
+    assert np.isnan(time_to_gap(progress, .01))
+
+    summary = progress_summary(progress)
+    assert summary["time_to_first_solution"] == 2.0
+    assert summary["time_to_5pct_gap"] == 4.0
+    assert np.isnan(summary["time_to_1pct_gap"])
+    assert np.isnan(time_to_first_solution(progress[:1]))
+
+
+def test_records_round_trip():
+    records = progress_records(points())
+    # nan is None so it goes into a JSON file
+    assert records[0]["incumbent"] is None and records[0]["gap"] is None
+    back = progress_from_records(records)
+    assert back[1:] == points()[1:]
+    assert np.isnan(back[0].incumbent)
+
+
+def test_recorder():
+    recorder = ProgressRecorder(interval=3600)
+    assert recorder.due()
+    recorder.record(1e40, -1e40, 0)
+    assert not recorder.due()
+    recorder.record(110.0, 100.0, 7, lp_iterations=-1, event=SOLUTION)
+    recorder.record(105.0, 100.0, 9, lp_iterations=300, event=END)
+
+    first, solution, end = recorder.points
+    # the solvers' "nothing yet" values are nan
+    assert np.isnan(first.incumbent) and np.isnan(first.bound) and np.isnan(first.gap)
+    assert solution.gap == pytest.approx(10 / 110)
+    assert solution.lp_iterations is None
+    assert (end.event, end.lp_iterations) == (END, 300)
+    assert [p.elapsed for p in recorder.points] == sorted(p.elapsed for p in recorder.points)
+
+
+@pytest.mark.parametrize("solver", ["highs", "xpress"])
+def test_backends_record_progress(instance, solver):
+    pytest.importorskip("highspy" if solver == "highs" else "xpress")
+    model = build_mecwlp(instance)
+    result = make_backend(solver, progress_interval=0.0).solve(model.matrix)
+
+    events = [p.event for p in result.progress]
+    assert events[-1] == END and SOLUTION in events
+    assert set(events) <= {SOLUTION, SAMPLE, END}
+    assert result.progress[-1].incumbent == pytest.approx(result.objval)
+    assert np.isfinite(time_to_first_solution(result.progress))
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from model_builder import MatrixModel
+from solver_backends import make_backend, INFEASIBLE, UNBOUNDED
+
+pytest.importorskip("highspy")
+
+
+def integer_model(c, A, row_lb, row_ub, col_ub):
+    return MatrixModel(
+        name="small", c=np.asarray(c, dtype=float), A=sp.csr_array(np.asarray(A, dtype=float)),
+        row_lb=np.asarray(row_lb, dtype=float), row_ub=np.asarray(row_ub, dtype=float),
+        col_lb=np.zeros(len(c)), col_ub=np.asarray(col_ub, dtype=float), integrality=np.ones(len(c), dtype=bool),
+    )
+
+
+def test_highs_infeasible_mip_is_infeasible():
+    # x1 + x2 >= 3 and x1 + x2 <= 1, presolve calls this unbounded or infeasible
+    model = integer_model([1, 1], [[1, 1], [1, 1]], [3, -np.inf], [np.inf, 1], [5, 5])
+    assert make_backend("highs").solve(model).status == INFEASIBLE
+
+
+def test_highs_unbounded_mip_is_unbounded():
+    model = integer_model([-1, 0], [[1, -1]], [0], [np.inf], [np.inf, np.inf])
+    assert make_backend("highs").solve(model).status == UNBOUNDED
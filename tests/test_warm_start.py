@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from conftest import small_instance
+from model_builder import build_mecwlp
+from solver_backends import make_backend
+from warm_start import heuristic_start, plan_start, violation, drop, drop_savings, map_plan
+
+pytest.importorskip("highspy")
+
+
+@pytest.mark.parametrize("nS", [1, 3])
+def test_heuristic_start_is_feasible(nS):
+    model = build_mecwlp(small_instance(nJ=6, nI=10, nT=3, nS=nS, seed=2), stock_ratio=.8, exact_stock=True)
+    sol, objval = heuristic_start(model, "highs", verbose=False)
+    assert sol is not None
+    assert violation(model, sol) < 1e-4
+    assert objval == pytest.approx(model.matrix.c @ sol)
+    y = model.y_values(sol)
+    # warehouses never close
+    assert (np.diff(y, axis=1) >= -1e-9).all()
+
+
+def test_all_closed_plan_has_no_start(instance):
+    model = build_mecwlp(instance)
+    y = np.zeros((len(instance.candidates), len(instance.periods)))
+    assert plan_start(model, y, "highs") == (None, np.inf)
+
+
+def test_drop_savings():
+    # units 0, 1 are cheapest at warehouse 0 and pay 1 and 3 more at warehouse 1, unit 2 only fits warehouse 2
+    weighted = np.array([[1., 2., np.inf], [1., 4., np.inf], [np.inf, np.inf, 5.]])
+    fixed = np.array([10., 10., 10.])
+    saving = drop_savings(weighted, fixed, np.array([True, True, True]))
+    assert saving[0] == 10 - 4
+    assert saving[1] == 10
+    # unit 2 has nowhere else to go
+    assert saving[2] == -np.inf
+    assert (drop_savings(weighted, fixed, np.array([True, False, False])) == -np.inf).all()
+
+
+def test_drop_only_evaluates_the_best_estimates():
+    calls = []
+    def evaluate(is_open):
+        calls.append(is_open.copy())
+        return is_open.sum()
+    saving = np.arange(20.0)
+    is_open = np.ones(20, dtype=bool)
+    drop(is_open, evaluate, lambda is_open: np.where(is_open, saving, -np.inf), tries=3)
+    assert not is_open.any()
+    # the first step tries the three biggest savings
+    assert [np.flatnonzero(~c).tolist() for c in calls[1:4]] == [[19], [18], [17]]
+    # one evaluation for the current plan plus at most three per step
+    assert len(calls) <= 1 + 20 * 4
+
+    calls.clear()
+    drop(np.ones(20, dtype=bool), evaluate)
+    assert len(calls) > 1 + 20 * 4
+
+
+def test_map_plan_moves_to_the_nearest_candidates():
+    xy = np.array([[0., 0.], [10., 0.], [20., 0.]])
+    new_xy = np.array([[1., 0.], [9., 1.], [50., 0.]])
+    y = np.array([[0, 1, 1], [1, 1, 1], [0, 0, 0]], dtype=float)
+    # candidates 1 and 2 both land on new candidate 1, it opens when the first of them did
+    assert map_plan(y, xy, new_xy).tolist() == [[0, 1, 1], [1, 1, 1], [0, 0, 0]]
+    assert map_plan(y, new_xy, xy).tolist() == [[0, 1, 1], [1, 1, 1], [0, 0, 0]]
+    moved = map_plan(y, xy, np.array([[10., 0.]]))
+    assert moved.tolist() == [[1, 1, 1]]
+
+
+def test_plan_start_of_a_previous_solution(instance):
+    model = build_mecwlp(instance)
+    best = make_backend("highs", progress_interval=None).solve(model.matrix)
+    y = model.y_values(best.x)
+    sol, objval = plan_start(model, y, "highs")
+    # the flows are the heuristic's, so no better than the optimum but as feasible
+    assert sol is not None and violation(model, sol) < 1e-4
+    assert objval >= best.objval * (1 - 1e-9)
+    assert (model.y_values(sol) == y).all()
@@ -0,0 +1,297 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from model_builder import MecwlpModel, warehouse_costs
+from plan_evaluation import assign_customers, supply_lp
+from solver_backends import make_backend
+from instrumentation import traced
+
+# =============================================================================
+# A quick feasible solution of the MECWLP to hand the solver as a MIP start,
+# so it has an incumbent from the first second instead of after minutes.
+#
+# The plan y[j,t] is built backwards from the final period:
+#
+#   - final period: greedy add (always the warehouse that saves the most,
+#     until none pays for itself and there is capacity for every period), then
+#     drop (close the warehouse whose closing saves the most, while one does)
+#   - every earlier period starts from the warehouses of the next one and only
+#     drops, so nothing ever closes
+#
+# Each product of each customer goes to its cheapest open warehouse with room
+# (plan_evaluation.assign_customers), a kg from j costing the transport to the
+# customer plus stock_ratio times the cheapest supplier of that product to j,
+# and the supplier stock is the cheapest that covers it (plan_evaluation.supply_lp).
+#
+#   start, cost = heuristic_start(model, backend)
+#   result = backend.solve(model.matrix, mip_start=start)
+#
+# map_plan moves the plan of an earlier solve onto another candidate set, so a
+# sweep over sizes can start each run from the last one (plan_start completes it).
+# =============================================================================
+
+
+def unit_costs(model:MecwlpModel):
+    """
+    Every (customer, product) is assigned on its own, unit n is customer n // nP and product n % nP.
+
+    :return: candidate x unit cost of delivering one kg (np.inf where the model has no x) and the
+        unit x period x scenario demand
+    """
+    inst = model.instance
+    nJ, nI, nK, nP = len(inst.candidates), len(inst.customers), len(inst.suppliers), len(inst.products)
+    stock_ratio = model.build_options.get("stock_ratio", 1.0)
+
+    allowed = np.zeros((nJ, nI), dtype=bool)
+    allowed[model.assign_cand, model.assign_cust] = True
+    supply_allowed = np.zeros((nK, nJ), dtype=bool)
+    supply_allowed[model.supply_sup, model.supply_cand] = True
+
+    # product x candidate, cheapest supplier of each product that may send there
+    supplier_prod_pos = np.searchsorted(inst.products, inst.supplier_product)
+    stock_cost = np.full((nP, nJ), np.inf)
+    np.minimum.at(stock_cost, supplier_prod_pos, np.where(supply_allowed, inst.cost_supplier_candidate, np.inf))
+
+    cost = inst.cost_candidate_customer[:, :, None] + stock_ratio * stock_cost.T[:, None, :]
+    cost[~allowed] = np.inf
+    return cost.reshape(nJ, nI * nP), inst.demand.reshape(nI * nP, *inst.demand.shape[2:])
+
+
+def period_cost(cost, demand, probs, is_open, room, t_pos):
+    """expected transport cost in period ``t_pos`` with the warehouses ``is_open``, np.inf if they can't manage"""
+    if not is_open.any():
+        return np.inf
+    total = 0.0
+    for s_pos, prob in enumerate(probs):
+        d = demand[:, t_pos, s_pos]
+        if not np.isfinite(cost[is_open].min(axis=0)).all():
+            return np.inf
+        a = assign_customers(cost, d, is_open, room)
+        if a is None:
+            return np.inf
+        total += prob * (cost[a, np.arange(len(d))] @ d)
+    return total
+
+
+# drop only works out the real cost of closing this many warehouses a step, the ones that look best
+DROP_TRIES = 5
+
+
+def drop_savings(weighted, fixed, is_open):
+    """
+    Rough saving of closing each open warehouse: its fixed cost less what its units pay extra at
+    their next cheapest open warehouse, ignoring capacity. -inf where it isn't open or its units
+    have nowhere else to go.
+
+    :param weighted: unit x candidate expected cost of serving each unit from each candidate
+    :param fixed: what each candidate costs to keep open
+    """
+    saving = np.full(len(is_open), -np.inf)
+    open_pos = np.flatnonzero(is_open)
+    if len(open_pos) < 2:
+        return saving
+    w = weighted[:, open_pos]
+    two = np.argpartition(w, 1, axis=1)[:, :2]
+    best, second = np.take_along_axis(w, two, axis=1).T
+    first = two[:, 0]
+    swap = second < best
+    first = np.where(swap, two[:, 1], first)
+    best, second = np.minimum(best, second), np.maximum(best, second)
+    extra = np.zeros(len(open_pos))
+    served = np.isfinite(best)
+    np.add.at(extra, first[served], second[served] - best[served])
+    saving[open_pos] = fixed[open_pos] - extra
+    saving[~np.isfinite(saving)] = -np.inf
+    return saving
+
+
+def drop(is_open, evaluate, estimate=None, tries=DROP_TRIES):
+    """
+    close whichever open warehouse saves the most (``evaluate`` gives the cost), while that lowers the cost.
+    With ``estimate`` (the rough saving of closing each warehouse, see drop_savings) only the ``tries``
+    that look best are evaluated each step
+    """
+    current = evaluate(is_open)
+    while True:
+        best, best_j = current, None
+        if estimate is None:
+            trial_js = np.flatnonzero(is_open)
+        else:
+            saving = estimate(is_open)
+            trial_js = [j for j in np.argsort(-saving)[:tries] if np.isfinite(saving[j])]
+        for j in trial_js:
+            is_open[j] = False
+            trial = evaluate(is_open)
+            is_open[j] = True
+            if trial < best - 1e-9 * max(1.0, abs(best)):
+                best, best_j = trial, j
+        if best_j is None:
+            return current
+        is_open[best_j] = False
+        current = evaluate(is_open)
+
+
+def greedy_drop_plan(model:MecwlpModel, cost=None, demand=None):
+    """
+    candidate x period 0/1 warehouse plan for the model's instance, None if the heuristic
+    can't find a feasible one
+    """
+    inst = model.instance
+    if cost is None:
+        cost, demand = unit_costs(model)
+    nJ, nT = len(inst.candidates), len(inst.periods)
+    probs = inst.scenario_probs
+    max_open = model.build_options.get("max_open")
+    # the stock coming in is stock_ratio of what goes out, and is capped by the capacity
+    room = inst.candidate_capacity / model.build_options.get("stock_ratio", 1.0)
+
+    # final period: the warehouses have to do for every period, so cost them as if they're
+    # open throughout and only drop them from earlier periods later
+    fixed = warehouse_costs(inst).sum(axis=1)
+    def every_period(is_open):
+        return fixed @ is_open + sum(period_cost(cost, demand, probs, is_open, room, t) for t in range(nT))
+
+    # expected cost of each unit from each candidate over all periods, for the greedy add
+    weighted = cost.T * np.einsum("nts,s->n", demand, probs)[:, None]
+    weighted[~np.isfinite(cost.T)] = np.inf
+    most_demand = demand.sum(axis=0).max()
+
+    is_open = np.zeros(nJ, dtype=bool)
+    best = np.full(len(weighted), np.inf)
+    while not is_open.all() and (max_open is None or is_open.sum() < max_open):
+        if is_open.any():
+            saving = np.maximum(best[:, None] - weighted, 0).sum(axis=0) - fixed
+        else:
+            saving = -np.where(np.isfinite(weighted), weighted, 1e30).sum(axis=0) - fixed
+        saving[is_open] = -np.inf
+        enough_room = room[is_open].sum() >= most_demand
+        if enough_room and np.isfinite(best).all() and saving.max() <= 0:
+            break
+        j = int(saving.argmax())
+        is_open[j] = True
+        best = np.minimum(best, weighted[:, j])
+
+    # capacity the assignment can't work with: keep opening the one that helps most
+    while not np.isfinite(every_period(is_open)):
+        closed = np.flatnonzero(~is_open)
+        if len(closed) == 0 or (max_open is not None and is_open.sum() >= max_open):
+            return None
+        trials = []
+        for j in closed:
+            is_open[j] = True
+            trials.append(every_period(is_open))
+            is_open[j] = False
+        # if nothing is feasible yet go for the most room
+        j = closed[np.argmin(trials)] if np.isfinite(trials).any() else closed[np.argmax(room[closed])]
+        is_open[j] = True
+
+    drop(is_open, every_period, lambda is_open: drop_savings(weighted, fixed, is_open))
+
+    y = np.zeros((nJ, nT))
+    y[:, -1] = is_open
+    for t_pos in range(nT - 2, -1, -1):
+        # in earlier periods closing only saves the operating cost of that period
+        is_open = y[:, t_pos + 1] > .5
+        def this_period(is_open, t_pos=t_pos):
+            return inst.operating_cost @ is_open + period_cost(cost, demand, probs, is_open, room, t_pos)
+        weighted_t = cost.T * (demand[:, t_pos] @ probs)[:, None]
+        weighted_t[~np.isfinite(cost.T)] = np.inf
+        drop(is_open, this_period, lambda is_open: drop_savings(weighted_t, inst.operating_cost, is_open))
+        y[:, t_pos] = is_open
+    return y
+
+
+def plan_solution(model:MecwlpModel, y, cost=None, demand=None, backend=None):
+    """
+    Every column of the model for the warehouse plan ``y``: the assignment as in greedy_drop_plan and
+    the cheapest supply for it. None if the plan can't be completed
+    """
+    inst = model.instance
+    if cost is None:
+        cost, demand = unit_costs(model)
+    backend = make_backend(backend or "xpress")
+    opts = model.build_options
+    stock_ratio = opts.get("stock_ratio", 1.0)
+    nJ, nI, nK, nP = len(inst.candidates), len(inst.customers), len(inst.suppliers), len(inst.products)
+    nT, nS = len(inst.periods), len(inst.scenarios)
+    room = inst.candidate_capacity / stock_ratio
+    unit_cust, unit_prod = np.divmod(np.arange(nI * nP), nP)
+    supply_mask = np.zeros((nK, nJ), dtype=bool)
+    supply_mask[model.supply_sup, model.supply_cand] = True
+    pair = np.full((nI, nJ), -1)
+    pair[model.assign_cust, model.assign_cand] = np.arange(len(model.assign_cust))
+
+    sol = np.zeros(model.matrix.n_cols)
+    sol[model.y_cols] = y
+    for s_pos in range(nS):
+        need = np.zeros((nJ, nT))
+        for t_pos in range(nT):
+            d = demand[:, t_pos, s_pos]
+            is_open = y[:, t_pos] > .5
+            if not is_open.any():
+                return None
+            a = assign_customers(cost, d, is_open, room)
+            if a is None or (pair[unit_cust, a] < 0).any():
+                return None
+            sol[model.x_cols[pair[unit_cust, a], t_pos, unit_prod, s_pos]] = 1
+            need[:, t_pos] = stock_ratio * np.bincount(a, weights=d, minlength=nJ)
+
+        z = supply_lp(inst, y, need, opts.get("exact_stock", False), backend, supply_mask)
+        if z is None:
+            return None
+        sol[model.z_cols[..., s_pos]] = z[model.supply_sup, model.supply_cand]
+    return sol
+
+
+def violation(model:MecwlpModel, sol):
+    """largest amount by which ``sol`` breaks a row or column bound of the model"""
+    m = model.matrix
+    activity = m.A @ sol
+    rows = np.maximum(m.row_lb - activity, activity - m.row_ub)
+    cols = np.maximum(m.col_lb - sol, sol - m.col_ub)
+    return max(rows.max(initial=0), cols.max(initial=0))
+
+
+def plan_start(model:MecwlpModel, y, backend=None, tol=1e-6, cost=None, demand=None):
+    """
+    The plan ``y`` completed with its flows (see plan_solution) and its objective, checked against
+    the model. (None, np.inf) if it can't be completed
+    """
+    sol = plan_solution(model, y, cost, demand, backend)
+    if sol is None:
+        return None, np.inf
+    # the supply LP is solved to the solver's tolerances, scale them with the numbers in the rows
+    scale = max(1.0, np.abs(model.matrix.row_ub[np.isfinite(model.matrix.row_ub)]).max(initial=1.0))
+    if violation(model, sol) > tol * scale:
+        return None, np.inf
+    return sol, model.matrix.c @ sol
+
+
+@traced()
+def heuristic_start(model:MecwlpModel, backend=None, tol=1e-6, verbose=True):
+    """
+    A feasible solution of ``model`` to pass as ``mip_start``, and its objective.
+    (None, np.inf) if the heuristic doesn't find one, the solver then starts cold as before.
+
+    :param backend: solver for the supply LPs, the script's own so they follow SOLVER (xpress by default)
+    """
+    cost, demand = unit_costs(model)
+    y = greedy_drop_plan(model, cost, demand)
+    sol, objval = (None, np.inf) if y is None else plan_start(model, y, backend, tol, cost, demand)
+    if verbose:
+        if sol is None:
+            print("warm start: the heuristic found no feasible solution")
+        else:
+            print(f"warm start: {int(y[:, -1].sum())} warehouses open by the end, objective {objval:,.0f}")
+    return sol, objval
+
+
+def map_plan(y, xy, new_xy):
+    """
+    A plan for other candidates: every warehouse open in ``y`` (candidate x period, candidates at
+    ``xy``) moves to the nearest of the candidates at ``new_xy``, from the period it opened in.
+    """
+    y = np.asarray(y) > .5
+    nearest = cKDTree(new_xy).query(xy)[1]
+    new_y = np.zeros((len(new_xy), y.shape[1]))
+    np.maximum.at(new_y, nearest, y.astype(float))
+    return new_y